@@ -1,18 +1,27 @@
 """管理接口 - Token管理和系统配置"""
 
+import gzip
 import secrets
 import time
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, Depends, Header, Query
-from fastapi.responses import HTMLResponse
+import orjson
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
 from app.core.config import setting
+from app.core.exception import GrokApiException
 from app.core.logger import logger
+from app.core.proxy_pool import proxy_pool
+from app.services.grok import imaging
 from app.services.grok.token import token_manager
+from app.services.grok.token_index import CATEGORY_LABELS, SORT_KEYS, token_category
+from app.services.grok.conversation import conversation_store
+from app.services.response_cache import response_cache
 from app.services.request_stats import request_stats
+from app.services.token_transfer import token_transfer
 from app.models.grok_models import TokenType
 
 
@@ -22,10 +31,13 @@ router = APIRouter(tags=["管理"])
 STATIC_DIR = Path(__file__).parents[2] / "template"
 TEMP_DIR = Path(__file__).parents[3] / "data" / "temp"
 IMAGE_CACHE_DIR = TEMP_DIR / "image"
+IMAGE_VARIANT_DIR = TEMP_DIR / "image_variant"  # 缩放/转码派生图（随图片缓存一起清理）
+THUMB_QUERY = "?w=320&format=auto"  # 缓存预览缩略图参数
 VIDEO_CACHE_DIR = TEMP_DIR / "video"
 SESSION_EXPIRE_HOURS = 24
 BYTES_PER_KB = 1024
 BYTES_PER_MB = 1024 * 1024
+GZIP_MIN_BYTES = 4096  # 超过该大小的列表响应启用gzip
 
 # 会话存储
 _sessions: Dict[str, datetime] = {}
@@ -68,12 +80,17 @@ class TokenInfo(BaseModel):
     last_failure_time: Optional[int] = None
     last_failure_reason: str = ""
     limit_reason: str = ""
+    inflight: int = 0
+    health: Dict[str, Any] = {}
+    quotas: Dict[str, Any] = {}
 
 
 class TokenListResponse(BaseModel):
     success: bool
     data: List[TokenInfo]
     total: int
+    page: int = 1
+    page_size: int = 0
 
 
 class UpdateSettingsRequest(BaseModel):
@@ -133,59 +150,6 @@ def _get_cooldown_remaining_ms(token_data: Dict[str, Any], now_ms: Optional[int]
         return 0
 
 
-def _is_token_in_cooldown(token_data: Dict[str, Any], now_ms: Optional[int] = None) -> bool:
-    """判断Token是否处于429冷却中."""
-    return _get_cooldown_remaining_ms(token_data, now_ms) > 0
-
-
-def calculate_token_stats(tokens: Dict[str, Any], token_type: str) -> Dict[str, int]:
-    """计算Token统计."""
-    total = len(tokens)
-    expired = sum(1 for t in tokens.values() if t.get("status") == "expired")
-    now_ms = int(time.time() * 1000)
-    cooldown = 0
-    exhausted = 0
-    unused = 0
-    active = 0
-
-    for token_data in tokens.values():
-        if token_data.get("status") == "expired":
-            continue
-
-        if _is_token_in_cooldown(token_data, now_ms):
-            cooldown += 1
-            continue
-
-        remaining = token_data.get("remainingQueries", -1)
-        heavy_remaining = token_data.get("heavyremainingQueries", -1)
-
-        if token_type == "normal":
-            if remaining == -1:
-                unused += 1
-            elif remaining == 0:
-                exhausted += 1
-            else:
-                active += 1
-        else:
-            if remaining == -1 and heavy_remaining == -1:
-                unused += 1
-            elif remaining == 0 or heavy_remaining == 0:
-                exhausted += 1
-            else:
-                active += 1
-
-    limited = cooldown + exhausted
-    return {
-        "total": total,
-        "unused": unused,
-        "limited": limited,
-        "cooldown": cooldown,
-        "exhausted": exhausted,
-        "expired": expired,
-        "active": active
-    }
-
-
 def verify_admin_session(authorization: Optional[str] = Header(None)) -> bool:
     """验证管理员会话"""
     if not authorization or not authorization.startswith("Bearer "):
@@ -205,27 +169,48 @@ def verify_admin_session(authorization: Optional[str] = Header(None)) -> bool:
 
 def get_token_status(token_data: Dict[str, Any], token_type: str) -> str:
     """获取Token状态."""
-    if token_data.get("status") == "expired":
-        return "失效"
-
-    if _is_token_in_cooldown(token_data):
-        return "冷却中"
-
-    remaining = token_data.get("remainingQueries", -1)
-    heavy_remaining = token_data.get("heavyremainingQueries", -1)
-
-    if token_type == "ssoSuper":
-        if remaining == -1 and heavy_remaining == -1:
-            return "未使用"
-        if remaining == 0 or heavy_remaining == 0:
-            return "额度耗尽"
-        return "正常"
-
-    if remaining == -1:
-        return "未使用"
-    if remaining == 0:
-        return "额度耗尽"
-    return "正常"
+    internal_type = TokenType.SUPER.value if token_type == "ssoSuper" else TokenType.NORMAL.value
+    return CATEGORY_LABELS[token_category(token_data, internal_type)]
+
+
+def _token_info(token: str, token_type: str, data: Dict[str, Any], now_ms: int) -> TokenInfo:
+    """构建Token列表项"""
+    display_type = "ssoSuper" if token_type == TokenType.SUPER.value else "sso"
+    cooldown_remaining_ms = _get_cooldown_remaining_ms(data, now_ms)
+    limit_reason = "cooldown" if cooldown_remaining_ms else ""
+    heavy_exhausted = display_type == "ssoSuper" and data.get("heavyremainingQueries", -1) == 0
+    if not limit_reason and (data.get("remainingQueries", -1) == 0 or heavy_exhausted):
+        limit_reason = "exhausted"
+    return TokenInfo(
+        token=token,
+        token_type=display_type,
+        created_time=parse_created_time(data.get("createdTime")),
+        remaining_queries=data.get("remainingQueries", -1),
+        heavy_remaining_queries=data.get("heavyremainingQueries", -1),
+        status=CATEGORY_LABELS[token_category(data, token_type, now_ms)],
+        tags=data.get("tags", []),
+        note=data.get("note", ""),
+        cooldown_until=data.get("cooldownUntil") if cooldown_remaining_ms else None,
+        cooldown_remaining=(cooldown_remaining_ms + 999) // 1000 if cooldown_remaining_ms else 0,
+        last_failure_time=data.get("lastFailureTime") or None,
+        last_failure_reason=data.get("lastFailureReason") or "",
+        limit_reason=limit_reason,
+        inflight=token_manager.get_inflight(token),
+        health=token_manager.get_health(token),
+        quotas=data.get("quotas") or {}
+    )
+
+
+def _json_response(request: Request, payload: Dict[str, Any]) -> Response:
+    """JSON响应，客户端支持时gzip压缩（大列表）"""
+    body = orjson.dumps(payload)
+    if len(body) < GZIP_MIN_BYTES or "gzip" not in request.headers.get("accept-encoding", ""):
+        return Response(content=body, media_type="application/json")
+    return Response(
+        content=gzip.compress(body, compresslevel=5),
+        media_type="application/json",
+        headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+    )
 
 
 def _calculate_dir_size(directory: Path) -> int:
@@ -314,63 +299,45 @@ async def admin_logout(_: bool = Depends(verify_admin_session), authorization: O
 
 
 @router.get("/api/tokens", response_model=TokenListResponse)
-async def list_tokens(_: bool = Depends(verify_admin_session)) -> TokenListResponse:
-    """获取Token列表"""
+async def list_tokens(
+    request: Request,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(0, ge=0, le=1000, description="每页数量（0为全部）"),
+    token_type: Optional[str] = Query(None, pattern="^(sso|ssoNormal|ssoSuper)$"),
+    status: Optional[str] = Query(None, pattern="^(unused|cooldown|exhausted|expired|active)$"),
+    tag: Optional[str] = None,
+    cooldown: Optional[bool] = None,
+    search: Optional[str] = None,
+    sort: str = Query("created_time", pattern=f"^({'|'.join(SORT_KEYS)})$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    _: bool = Depends(verify_admin_session)
+) -> Response:
+    """获取Token列表（支持分页、按类型/状态/标签/冷却筛选、排序与搜索）"""
     try:
-        logger.debug("[Admin] 获取Token列表")
+        logger.debug(f"[Admin] 获取Token列表: page={page}, size={page_size}, status={status}, tag={tag}")
+
+        internal_type = None
+        if token_type:
+            internal_type = TokenType.SUPER.value if token_type == "ssoSuper" else TokenType.NORMAL.value
+        total, tokens = token_manager.query_tokens(
+            token_type=internal_type,
+            status=status,
+            tag=tag or None,
+            cooldown=cooldown,
+            search=(search or "").strip() or None,
+            sort=sort,
+            desc=order == "desc",
+            offset=(page - 1) * page_size,
+            limit=page_size or None,
+        )
 
-        all_tokens = token_manager.get_tokens()
-        token_list: List[TokenInfo] = []
         now_ms = int(time.time() * 1000)
+        token_list = [_token_info(token, t, data, now_ms) for token, t, data in tokens]
 
-        # 普通Token
-        for token, data in all_tokens.get(TokenType.NORMAL.value, {}).items():
-            cooldown_remaining_ms = _get_cooldown_remaining_ms(data, now_ms)
-            cooldown_until = data.get("cooldownUntil") if cooldown_remaining_ms else None
-            limit_reason = "cooldown" if cooldown_remaining_ms else ""
-            if not limit_reason and data.get("remainingQueries", -1) == 0:
-                limit_reason = "exhausted"
-            token_list.append(TokenInfo(
-                token=token,
-                token_type="sso",
-                created_time=parse_created_time(data.get("createdTime")),
-                remaining_queries=data.get("remainingQueries", -1),
-                heavy_remaining_queries=data.get("heavyremainingQueries", -1),
-                status=get_token_status(data, "sso"),
-                tags=data.get("tags", []),
-                note=data.get("note", ""),
-                cooldown_until=cooldown_until,
-                cooldown_remaining=(cooldown_remaining_ms + 999) // 1000 if cooldown_remaining_ms else 0,
-                last_failure_time=data.get("lastFailureTime") or None,
-                last_failure_reason=data.get("lastFailureReason") or "",
-                limit_reason=limit_reason
-            ))
-
-        # Super Token
-        for token, data in all_tokens.get(TokenType.SUPER.value, {}).items():
-            cooldown_remaining_ms = _get_cooldown_remaining_ms(data, now_ms)
-            cooldown_until = data.get("cooldownUntil") if cooldown_remaining_ms else None
-            limit_reason = "cooldown" if cooldown_remaining_ms else ""
-            if not limit_reason and (data.get("remainingQueries", -1) == 0 or data.get("heavyremainingQueries", -1) == 0):
-                limit_reason = "exhausted"
-            token_list.append(TokenInfo(
-                token=token,
-                token_type="ssoSuper",
-                created_time=parse_created_time(data.get("createdTime")),
-                remaining_queries=data.get("remainingQueries", -1),
-                heavy_remaining_queries=data.get("heavyremainingQueries", -1),
-                status=get_token_status(data, "ssoSuper"),
-                tags=data.get("tags", []),
-                note=data.get("note", ""),
-                cooldown_until=cooldown_until,
-                cooldown_remaining=(cooldown_remaining_ms + 999) // 1000 if cooldown_remaining_ms else 0,
-                last_failure_time=data.get("lastFailureTime") or None,
-                last_failure_reason=data.get("lastFailureReason") or "",
-                limit_reason=limit_reason
-            ))
-
-        logger.debug(f"[Admin] Token列表获取成功: {len(token_list)}个")
-        return TokenListResponse(success=True, data=token_list, total=len(token_list))
+        logger.debug(f"[Admin] Token列表获取成功: {len(token_list)}/{total}个")
+        return _json_response(request, TokenListResponse(
+            success=True, data=token_list, total=total, page=page, page_size=page_size
+        ).model_dump())
 
     except Exception as e:
         logger.error(f"[Admin] 获取Token列表异常: {e}")
@@ -384,10 +351,12 @@ async def add_tokens(request: AddTokensRequest, _: bool = Depends(verify_admin_s
         logger.debug(f"[Admin] 添加Token: {request.token_type}, {len(request.tokens)}个")
 
         token_type = validate_token_type(request.token_type)
-        await token_manager.add_token(request.tokens, token_type)
+        count = await token_manager.add_token(request.tokens, token_type)
+        skipped = len(request.tokens) - count
 
-        logger.debug(f"[Admin] Token添加成功: {len(request.tokens)}个")
-        return {"success": True, "message": f"成功添加 {len(request.tokens)} 个Token", "count": len(request.tokens)}
+        logger.debug(f"[Admin] Token添加成功: {count}个")
+        message = f"成功添加 {count} 个Token" + (f"，跳过已存在 {skipped} 个" if skipped else "")
+        return {"success": True, "message": message, "count": count}
 
     except HTTPException:
         raise
@@ -396,6 +365,53 @@ async def add_tokens(request: AddTokensRequest, _: bool = Depends(verify_admin_s
         raise HTTPException(status_code=500, detail={"error": f"添加失败: {e}", "code": "ADD_ERROR"})
 
 
+@router.post("/api/tokens/import")
+async def import_tokens(request: Request, token_type: str = "ssoNormal", _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """流式批量导入Token
+
+    请求体每行一个Token（纯文本，使用 token_type 类型），或 /api/tokens/export 导出的
+    ["ssoNormal", "<token>", {数据}] 行；按块写入，已存在的Token跳过。
+    """
+    try:
+        progress = await token_transfer.import_stream(request.stream(), validate_token_type(token_type))
+        message = f"成功导入 {progress['added']} 个Token，跳过已存在 {progress['skipped']} 个"
+        if progress["invalid"]:
+            message += f"，无效 {progress['invalid']} 行"
+        return {"success": True, "message": message, "data": progress}
+
+    except HTTPException:
+        raise
+    except GrokApiException as e:
+        raise HTTPException(status_code=e.status_code or 400, detail={"error": e.message, "code": e.error_code})
+    except Exception as e:
+        logger.error(f"[Admin] Token导入异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"导入失败: {e}", "code": "IMPORT_ERROR"})
+
+
+@router.get("/api/tokens/import-progress")
+async def get_import_progress(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """获取Token导入进度"""
+    return {"success": True, "data": token_transfer.get_progress()}
+
+
+@router.get("/api/tokens/export")
+async def export_tokens(
+    token_type: Optional[str] = None,
+    format: str = Query("ndjson", pattern="^(ndjson|text)$"),
+    _: bool = Depends(verify_admin_session)
+) -> StreamingResponse:
+    """流式导出Token池（ndjson 含完整数据，可直接导入其他节点；text 每行一个Token）"""
+    token_type_enum = validate_token_type(token_type) if token_type else None
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/plain; charset=utf-8"
+    filename = f"tokens.{'jsonl' if format == 'ndjson' else 'txt'}"
+    logger.info(f"[Admin] 导出Token: {token_type or 'all'}, 格式: {format}")
+    return StreamingResponse(
+        token_transfer.export_stream(token_type_enum, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
 @router.post("/api/tokens/delete")
 async def delete_tokens(request: DeleteTokensRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     """批量删除Token"""
@@ -445,7 +461,7 @@ async def get_cache_size(_: bool = Depends(verify_admin_session)) -> Dict[str, A
     try:
         logger.debug("[Admin] 获取缓存大小")
 
-        image_size = _calculate_dir_size(IMAGE_CACHE_DIR) if IMAGE_CACHE_DIR.exists() else 0
+        image_size = sum(_calculate_dir_size(d) for d in (IMAGE_CACHE_DIR, IMAGE_VARIANT_DIR) if d.exists())
         video_size = _calculate_dir_size(VIDEO_CACHE_DIR) if VIDEO_CACHE_DIR.exists() else 0
         total_size = image_size + video_size
 
@@ -514,6 +530,7 @@ async def list_cache_files(
                 "size_bytes": size,
                 "mtime": int(mtime * 1000),
                 "url": f"/images/{file_path.name}",
+                "thumb": f"/images/{file_path.name}{THUMB_QUERY}" if cache_type == "image" and imaging.AVAILABLE else "",
                 "type": cache_type
             }
             for file_path, mtime, size in sliced
@@ -546,9 +563,11 @@ async def clear_cache(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]
         image_count = 0
         video_count = 0
 
-        # 清理图片
-        if IMAGE_CACHE_DIR.exists():
-            for file_path in IMAGE_CACHE_DIR.iterdir():
+        # 清理图片（含派生图）
+        for cache_dir in (IMAGE_CACHE_DIR, IMAGE_VARIANT_DIR):
+            if not cache_dir.exists():
+                continue
+            for file_path in cache_dir.iterdir():
                 if file_path.is_file():
                     try:
                         file_path.unlink()
@@ -587,8 +606,10 @@ async def clear_image_cache(_: bool = Depends(verify_admin_session)) -> Dict[str
         logger.debug("[Admin] 清理图片缓存")
 
         count = 0
-        if IMAGE_CACHE_DIR.exists():
-            for file_path in IMAGE_CACHE_DIR.iterdir():
+        for cache_dir in (IMAGE_CACHE_DIR, IMAGE_VARIANT_DIR):
+            if not cache_dir.exists():
+                continue
+            for file_path in cache_dir.iterdir():
                 if file_path.is_file():
                     try:
                         file_path.unlink()
@@ -634,9 +655,9 @@ async def get_stats(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     try:
         logger.debug("[Admin] 开始获取统计信息")
 
-        all_tokens = token_manager.get_tokens()
-        normal_stats = calculate_token_stats(all_tokens.get(TokenType.NORMAL.value, {}), "normal")
-        super_stats = calculate_token_stats(all_tokens.get(TokenType.SUPER.value, {}), "super")
+        stats = token_manager.get_token_stats()
+        normal_stats = stats[TokenType.NORMAL.value]
+        super_stats = stats[TokenType.SUPER.value]
         total = normal_stats["total"] + super_stats["total"]
 
         logger.debug(f"[Admin] 统计信息获取成功 - 普通Token: {normal_stats['total']}, Super Token: {super_stats['total']}, 总计: {total}")
@@ -685,16 +706,7 @@ async def get_all_tags(_: bool = Depends(verify_admin_session)) -> Dict[str, Any
     try:
         logger.debug("[Admin] 获取所有标签")
 
-        all_tokens = token_manager.get_tokens()
-        tags_set = set()
-
-        for token_type_data in all_tokens.values():
-            for token_data in token_type_data.values():
-                tags = token_data.get("tags", [])
-                if isinstance(tags, list):
-                    tags_set.update(tags)
-
-        tags_list = sorted(list(tags_set))
+        tags_list = token_manager.get_all_tags()
         logger.debug(f"[Admin] 标签获取成功: {len(tags_list)}个")
         return {"success": True, "data": tags_list}
 
@@ -833,6 +845,9 @@ async def get_request_stats(_: bool = Depends(verify_admin_session)) -> Dict[str
     """获取请求统计数据"""
     try:
         stats = request_stats.get_stats(hours=24, days=7)
+        stats["conversation"] = conversation_store.get_stats()
+        stats["cache"].update(response_cache.get_stats())
+        stats["proxy"] = proxy_pool.get_stats()
         return {"success": True, "data": stats}
     except Exception as e:
         logger.error(f"[Admin] 获取请求统计异常: {e}")
@@ -855,6 +870,11 @@ class UpdateKeyStatusRequest(BaseModel):
     is_active: bool
 
 
+class UpdateKeyCacheRequest(BaseModel):
+    key: str
+    enabled: bool
+
+
 class BatchAddKeyRequest(BaseModel):
     name_prefix: str
     count: int
@@ -955,6 +975,30 @@ async def update_key_name(request: UpdateKeyNameRequest, _: bool = Depends(verif
         raise HTTPException(status_code=500, detail={"error": f"更新失败: {e}"})
 
 
+@router.post("/api/keys/cache")
+async def update_key_cache(request: UpdateKeyCacheRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """更新 Key 响应缓存开关"""
+    try:
+        from app.services.api_keys import api_key_manager
+        if await api_key_manager.update_key_cache(request.key, request.enabled):
+            return {"success": True, "message": "缓存设置更新成功"}
+        return {"success": False, "message": "Key不存在"}
+    except Exception as e:
+        logger.error(f"[Admin] 更新Key缓存设置失败: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"更新失败: {e}"})
+
+
+@router.post("/api/cache/responses/clear")
+async def clear_response_cache(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """清空响应缓存"""
+    try:
+        count = response_cache.clear()
+        return {"success": True, "message": f"成功清理响应缓存，删除 {count} 条", "data": {"deleted_count": count}}
+    except Exception as e:
+        logger.error(f"[Admin] 清理响应缓存失败: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"清理失败: {e}"})
+
+
 @router.post("/api/keys/batch-add")
 async def batch_add_keys(request: BatchAddKeyRequest, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     """批量添加 Key"""
@@ -13,6 +13,7 @@ from pydantic import BaseModel
 
 from app.core.logger import logger
 from app.api.admin.manage import verify_admin_session
+from app.services.key_import import key_importer
 
 router = APIRouter(tags=["注册机管理"])
 
@@ -141,9 +142,15 @@ KEYS_DIR = PROJECT_ROOT / "keys"
 REGISTER_LOG_DIR = PROJECT_ROOT / "logs" / "register"
 REGISTER_PROCESS_FILE = PROJECT_ROOT / "data" / "register_process.json"
 REGISTER_SCRIPT = PROJECT_ROOT / "grok.py"
+REGISTER_LOG_FILE = REGISTER_LOG_DIR / "register.log"
+REGISTER_LOG_MAX_BYTES = 5 * 1024 * 1024  # 单个日志文件上限，超过后轮转
+REGISTER_LOG_BACKUPS = 3                  # 保留的轮转日志数（register.log.1 ~ .3）
+LOG_TAIL_BLOCK = 8192                     # 倒序读取日志的块大小
+LOG_FETCH_MAX_BYTES = 256 * 1024          # 增量拉取单个文件单次最多读取的字节数
 
 # 确保目录存在
 KEYS_DIR.mkdir(parents=True, exist_ok=True)
+key_importer.keys_file = KEYS_DIR / "grok.txt"
 REGISTER_LOG_DIR.mkdir(parents=True, exist_ok=True)
 REGISTER_PROCESS_FILE.parent.mkdir(parents=True, exist_ok=True)
 
@@ -293,7 +300,12 @@ def _save_config(config: Dict[str, Any]):
         raise
 
 
-async def _read_generated_keys() -> List[Dict[str, Any]]:
+async def _read_generated_keys() -> Dict[str, Any]:
+    """读取已生成的账号（在线程中执行，不阻塞事件循环）"""
+    return await asyncio.to_thread(_load_generated_keys)
+
+
+def _load_generated_keys() -> Dict[str, Any]:
     """读取已生成的账号"""
     keys_file = KEYS_DIR / "grok.txt"
     accounts_file = KEYS_DIR / "accounts.txt"
@@ -336,20 +348,96 @@ async def _read_generated_keys() -> List[Dict[str, Any]]:
     }
 
 
-async def _read_register_log(lines: int = 100) -> List[str]:
-    """读取注册机日志"""
-    log_file = REGISTER_LOG_DIR / "register.log"
-    if not log_file.exists():
-        return []
+def _rotate_register_log() -> None:
+    """轮转注册机日志（register.log → register.log.1 → ...，超出保留数的删除）"""
+    for i in range(REGISTER_LOG_BACKUPS, 0, -1):
+        src = REGISTER_LOG_FILE.with_name(f"{REGISTER_LOG_FILE.name}.{i - 1}") if i > 1 else REGISTER_LOG_FILE
+        if src.exists():
+            os.replace(src, REGISTER_LOG_FILE.with_name(f"{REGISTER_LOG_FILE.name}.{i}"))
+
+
+def _split_log_lines(data: bytes) -> List[str]:
+    return [line.strip() for line in data.decode("utf-8", errors="replace").splitlines() if line.strip()]
+
 
+def _tail_log(path: Path, lines: int) -> tuple:
+    """从文件末尾倒序按块读取最后 N 行，返回 (日志行, 游标)"""
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        pos = st.st_size
+        data = b""
+        # 多读一行，保证第一行完整
+        while pos > 0 and data.count(b"\n") <= lines:
+            step = min(LOG_TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    if pos > 0:
+        data = data[data.index(b"\n") + 1:]
+    return _split_log_lines(data)[-lines:], f"{st.st_ino}:{st.st_size}"
+
+
+def _read_log_since(cursor: str, lines: int) -> Optional[tuple]:
+    """读取游标之后新增的完整行（含已轮转文件中未读完的部分），游标失效时返回None"""
     try:
-        with open(log_file, 'r', encoding='utf-8') as f:
-            all_lines = f.readlines()
-            # 返回最后 N 行
-            return [line.strip() for line in all_lines[-lines:] if line.strip()]
+        inode, offset = (int(part) for part in cursor.split(":"))
+    except ValueError:
+        return None
+
+    # 按时间顺序排列：最旧的轮转文件 ... register.log
+    files = [REGISTER_LOG_FILE.with_name(f"{REGISTER_LOG_FILE.name}.{i}") for i in range(REGISTER_LOG_BACKUPS, 0, -1)]
+    files.append(REGISTER_LOG_FILE)
+    stats = []
+    for path in files:
+        try:
+            stats.append((path, path.stat()))
+        except FileNotFoundError:
+            continue
+
+    index = next((i for i, (_, st) in enumerate(stats) if st.st_ino == inode), None)
+    if index is None or offset > stats[index][1].st_size:
+        return None  # 游标所在文件已被删除或截断
+
+    # 最多返回 lines 行，游标停在最后返回的行之后，超出的行留给下次拉取
+    logs = []
+    for path, st in stats[index:]:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(LOG_FETCH_MAX_BYTES)
+        end = 0
+        while len(logs) < lines and (newline := data.find(b"\n", end)) >= 0:
+            logs.extend(_split_log_lines(data[end:newline]))  # 只返回完整行，写入中的末行下次读取
+            end = newline + 1
+        cursor = f"{st.st_ino}:{offset + end}"
+        if len(logs) >= lines or offset + end < st.st_size:
+            break
+        offset = 0
+    return logs, cursor
+
+
+async def _read_register_log(lines: int = 100, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """读取注册机日志（在线程中执行，不阻塞事件循环）
+
+    Args:
+        lines: 最多返回的行数
+        cursor: 上次返回的游标，传入时只返回之后新增的行
+
+    Returns:
+        {"logs": 日志行, "cursor": 新游标, "reset": 是否为完整尾部（游标为空或已失效）}
+    """
+    if not REGISTER_LOG_FILE.exists():
+        return {"logs": [], "cursor": None, "reset": True}
+
+    try:
+        if cursor:
+            result = await asyncio.to_thread(_read_log_since, cursor, lines)
+            if result is not None:
+                return {"logs": result[0], "cursor": result[1], "reset": False}
+        logs, cursor = await asyncio.to_thread(_tail_log, REGISTER_LOG_FILE, lines)
+        return {"logs": logs, "cursor": cursor, "reset": True}
     except Exception as e:
         logger.error(f"读取注册机日志失败: {e}")
-        return []
+        return {"logs": [], "cursor": cursor, "reset": False}
 
 
 # === API 端点 ===
@@ -545,9 +633,10 @@ async def start_register(request: RegisterStartRequest, _: bool = Depends(verify
 
         logger.info(f"[环境检测] 最终使用的 Solver URL: {solver_url}")
 
-        # 准备日志文件 (清空旧日志)
-        log_file = REGISTER_LOG_DIR / "register.log"
+        # 准备日志文件 (轮转旧日志)
+        log_file = REGISTER_LOG_FILE
         log_file.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(_rotate_register_log)
         with open(log_file, 'w', encoding='utf-8') as f:
             f.write(f"--- 注册机启动于 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n")
 
@@ -632,15 +721,15 @@ async def stop_register(_: bool = Depends(verify_admin_session)) -> Dict[str, An
 
 
 @router.get("/api/register/logs")
-async def get_register_logs(lines: int = 100, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
-    """获取注册机日志"""
+async def get_register_logs(lines: int = 100, cursor: Optional[str] = None, _: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """获取注册机日志（传入上次返回的 cursor 时只返回新增行）"""
     try:
-        logs = await _read_register_log(lines)
+        result = await _read_register_log(max(1, min(lines, 1000)), cursor)
         return {
             "success": True,
             "data": {
-                "logs": logs,
-                "count": len(logs)
+                **result,
+                "count": len(result["logs"])
             }
         }
     except Exception as e:
@@ -664,33 +753,21 @@ async def get_register_keys(_: bool = Depends(verify_admin_session)) -> Dict[str
 
 @router.post("/api/register/keys/import")
 async def import_keys_to_tokens(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
-    """将生成的 Token 导入到 Token 管理"""
+    """将生成的 Token 导入到 Token 管理（重新扫描整个文件，已存在的 Token 跳过）"""
     try:
-        keys_file = KEYS_DIR / "grok.txt"
-        if not keys_file.exists():
+        if not (KEYS_DIR / "grok.txt").exists():
             return {"success": False, "message": "没有可导入的 Token"}
 
-        tokens = []
-        with open(keys_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    tokens.append(line)
-
-        if not tokens:
+        result = await key_importer.sync(rescan=True)
+        if not result["read"]:
             return {"success": False, "message": "Token 文件为空"}
 
-        # 导入到 token_manager
-        from app.services.grok.token import token_manager
-        from app.models.grok_models import TokenType
-
-        await token_manager.add_token(tokens, TokenType.NORMAL)
-
-        logger.info(f"已导入 {len(tokens)} 个 Token")
+        skipped = result["read"] - result["added"]
+        logger.info(f"已导入 {result['added']} 个 Token，跳过已存在 {skipped} 个")
         return {
             "success": True,
-            "message": f"成功导入 {len(tokens)} 个 Token",
-            "data": {"count": len(tokens)}
+            "message": f"成功导入 {result['added']} 个 Token，跳过已存在 {skipped} 个",
+            "data": {"count": result["added"], "skipped": skipped}
         }
     except Exception as e:
         logger.error(f"导入 Token 失败: {e}")
@@ -712,6 +789,7 @@ async def clear_register_keys(_: bool = Depends(verify_admin_session)) -> Dict[s
             accounts_file.unlink()
             count += 1
 
+        await key_importer.reset()
         logger.info("已清空生成的账号文件")
         return {
             "success": True,
@@ -750,8 +828,9 @@ async def _monitor_register_process(process: subprocess.Popen, log_file: Path):
 
         asyncio.create_task(asyncio.to_thread(_reader))
 
-        # 使用 'a' 模式继续追加（因为上面 start_register 已经创建/清空了文件）
-        with open(log_file, 'a', encoding='utf-8') as f:
+        # 使用 'a' 模式继续追加（因为上面 start_register 已经创建了文件）
+        f = open(log_file, 'a', encoding='utf-8')
+        try:
             while True:
                 line = await queue.get()
                 if line is None:
@@ -760,9 +839,13 @@ async def _monitor_register_process(process: subprocess.Popen, log_file: Path):
                 if not line:
                     continue
 
-                # 写入文件并立即 flush
+                # 写入文件并立即 flush，超过上限时轮转
                 f.write(f"{line}\n")
                 f.flush()
+                if f.tell() >= REGISTER_LOG_MAX_BYTES:
+                    f.close()
+                    await asyncio.to_thread(_rotate_register_log)
+                    f = open(log_file, 'a', encoding='utf-8')
                 # 同时输出到 logger（便于调试）
                 logger.info(f"[注册机] {line}")
                 line_count += 1
@@ -786,6 +869,8 @@ async def _monitor_register_process(process: subprocess.Popen, log_file: Path):
                 if stats_updated and ws_manager.active_connections:
                     # 推送完整状态更新
                     asyncio.create_task(ws_manager.send_status_update(_register_status.copy()))
+        finally:
+            f.close()
 
         # 推送剩余的日志
         if log_buffer and ws_manager.active_connections:
@@ -837,9 +922,9 @@ async def _parse_register_log(line: str, broadcast: bool = False) -> bool:
                 from app.services.grok.token import token_manager
                 from app.models.grok_models import TokenType
                 
-                # 异步添加 Token
-                await token_manager.add_token([sso], TokenType.NORMAL)
-                logger.info(f"[注册监测] 已自动同步新 Token: {sso[:15]}...")
+                # 异步添加 Token（已由文件监听导入时跳过）
+                if await token_manager.add_token([sso], TokenType.NORMAL):
+                    logger.info(f"[注册监测] 已自动同步新 Token: {sso[:15]}...")
         except Exception as e:
             logger.error(f"[注册监测] 自动同步 Token 失败: {e}")
 
@@ -969,39 +1054,3 @@ async def websocket_register_updates(websocket: WebSocket):
         logger.error(f"[WebSocket] 错误: {e}")
     finally:
         ws_manager.disconnect(websocket)
-
-
-async def auto_import_generated_tokens():
-    """自动将 keys/grok.txt 中的 Token 导入到系统中（用于启动时同步）"""
-    try:
-        keys_file = KEYS_DIR / "grok.txt"
-        if not keys_file.exists():
-            return
-
-        tokens = []
-        with open(keys_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    tokens.append(line)
-
-        if not tokens:
-            return
-
-        # 导入到 token_manager
-        from app.services.grok.token import token_manager
-        from app.models.grok_models import TokenType
-
-        # 获取当前已有的 tokens 避免重复
-        current_tokens = token_manager.get_tokens()
-        normal_tokens = current_tokens.get(TokenType.NORMAL.value, {})
-        super_tokens = current_tokens.get(TokenType.SUPER.value, {})
-        
-        new_tokens = [t for t in tokens if t not in normal_tokens and t not in super_tokens]
-        
-        if new_tokens:
-            await token_manager.add_token(new_tokens, TokenType.NORMAL)
-            logger.info(f"[启动自检] 自动同步已导入 {len(new_tokens)} 个新生成 Token")
-    except Exception as e:
-        logger.error(f"[启动自检] 自动同步 Token 失败: {e}")
-
@@ -0,0 +1,83 @@
+"""批量任务API路由 - 仿 OpenAI Batch API 的离线补全接口"""
+
+import hashlib
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse
+
+from app.core.auth import auth_manager
+from app.core.exception import GrokApiException
+from app.core.logger import logger
+from app.services.batch import batch_manager, BatchJob
+
+
+router = APIRouter(prefix="/batches", tags=["批量任务"])
+
+
+def _not_found(batch_id: str) -> HTTPException:
+    return HTTPException(
+        status_code=404,
+        detail={"error": {"message": f"批量任务不存在: {batch_id}", "type": "invalid_request_error", "code": "batch_not_found"}}
+    )
+
+
+def _owner(auth_info: Dict[str, Any]) -> Optional[str]:
+    """API Key摘要（不在任务元数据中保存明文Key；开发模式下为None）"""
+    key = auth_info.get("key")
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest() if key else None
+
+
+def _get_job(batch_id: str, auth_info: Dict[str, Any]) -> BatchJob:
+    """获取当前Key创建的任务（其他Key的任务同样返回404，不暴露任务是否存在）"""
+    job = batch_manager.get(batch_id)
+    if job is None or job.owner != _owner(auth_info):
+        raise _not_found(batch_id)
+    return job
+
+
+@router.post("")
+async def create_batch(request: Request, auth_info: Dict[str, Any] = Depends(auth_manager.verify)) -> Dict[str, Any]:
+    """创建批量任务
+
+    请求体为 JSONL，每行 {"custom_id": "...", "method": "POST", "url": "/v1/chat/completions", "body": {...}}，
+    按流读取写入磁盘，不在内存中缓存整个文件。
+    """
+    try:
+        job = await batch_manager.create(request.stream(), owner=_owner(auth_info))
+        return job.to_dict()
+    except GrokApiException as e:
+        raise HTTPException(
+            status_code=e.status_code or 400,
+            detail={"error": {"message": e.message, "type": "invalid_request_error", "code": e.error_code}}
+        )
+
+
+@router.get("")
+async def list_batches(auth_info: Dict[str, Any] = Depends(auth_manager.verify)) -> Dict[str, Any]:
+    """当前Key创建的批量任务列表"""
+    return {"object": "list", "data": [job.to_dict() for job in batch_manager.list(_owner(auth_info))]}
+
+
+@router.get("/{batch_id}")
+async def get_batch(batch_id: str, auth_info: Dict[str, Any] = Depends(auth_manager.verify)) -> Dict[str, Any]:
+    """批量任务状态与进度"""
+    return _get_job(batch_id, auth_info).to_dict()
+
+
+@router.post("/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, auth_info: Dict[str, Any] = Depends(auth_manager.verify)) -> Dict[str, Any]:
+    """取消批量任务（已发出的请求完成后停止）"""
+    job = _get_job(batch_id, auth_info)
+    await batch_manager.cancel(job)
+    logger.info(f"[Batch] 取消任务: {batch_id}")
+    return job.to_dict()
+
+
+@router.get("/{batch_id}/output")
+async def get_batch_output(batch_id: str, auth_info: Dict[str, Any] = Depends(auth_manager.verify)):
+    """下载结果文件（JSONL，执行中可下载已完成部分）"""
+    path = batch_manager.output_path(_get_job(batch_id, auth_info))
+    if not path.exists():
+        raise _not_found(batch_id)
+    return FileResponse(path=str(path), media_type="application/jsonl", filename=f"{batch_id}_output.jsonl")
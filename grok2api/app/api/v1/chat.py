@@ -1,6 +1,7 @@
 """聊天API路由 - OpenAI兼容的聊天接口"""
 
 import time
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import Optional, Dict, Any
 from fastapi.responses import StreamingResponse
@@ -9,13 +10,72 @@ from app.core.auth import auth_manager
 from app.core.exception import GrokApiException
 from app.core.logger import logger
 from app.services.grok.client import GrokClient
+from app.models.grok_models import Models
 from app.models.openai_schema import OpenAIChatRequest
 from app.services.request_stats import request_stats
+from app.services.response_cache import response_cache
 from app.services.request_logger import request_logger
 
 
 router = APIRouter(prefix="/chat", tags=["聊天"])
 
+# 常量
+DISCONNECT_POLL_INTERVAL = 0.5  # 客户端断开检测间隔（秒）
+CLIENT_CLOSED_REQUEST = 499     # 客户端主动断开（沿用nginx的499状态码）
+STREAM_BUFFER_SIZE = 64         # 上游读取与下游发送之间的缓冲块数
+_STREAM_END = object()          # 上游读取结束标记
+
+
+async def _wait_disconnect(request: Request) -> None:
+    """轮询直到客户端断开连接"""
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """流式响应：无论内容迭代是否开始，响应结束时都关闭上游流（释放会话与Token租约）"""
+
+    def __init__(self, content, upstream, **kwargs):
+        super().__init__(content, **kwargs)
+        self.upstream = upstream
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.upstream.aclose()
+
+
+async def _pump(upstream, queue: asyncio.Queue) -> None:
+    """持续读取上游流写入队列，结束（含异常与取消）时写入结束标记"""
+    try:
+        async for chunk in upstream:
+            await queue.put(chunk)
+    except asyncio.CancelledError:
+        # 客户端已断开，积压的数据块不再发送
+        while not queue.empty():
+            queue.get_nowait()
+        raise
+    finally:
+        await queue.put(_STREAM_END)
+
+
+async def _cancel_on_disconnect(request: Request, task: asyncio.Task) -> None:
+    """客户端断开时取消上游读取任务"""
+    await _wait_disconnect(request)
+    task.cancel()
+
+
+async def _cancel_pending(task: asyncio.Future) -> None:
+    """取消任务并等待其清理完成"""
+    if task.done():
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
 
 @router.post("/completions", response_model=None)
 async def chat_completions(
@@ -35,8 +95,27 @@ async def chat_completions(
     try:
         logger.info(f"[Chat] 收到聊天请求: {key_name} @ {ip}")
 
-        # 调用Grok客户端
-        result = await GrokClient.openai_to_grok(body.model_dump())
+        request_data = body.model_dump()
+
+        # 响应缓存（按Key开启，精确匹配）
+        cache_key = None
+        cached = None
+        if response_cache.enabled_for(auth_info):
+            if cache_key := response_cache.make_key(auth_info.get("key"), request_data):
+                cached = response_cache.get(cache_key)
+                # 流式结果不写入缓存，未命中时不计入miss（否则命中率被不可缓存的请求拉低）
+                if cached is not None or not body.stream:
+                    quota = Models.get_model_info(model).get("cost", {}).get("multiplier", 1)
+                    await request_stats.record_cache(cached is not None, quota)
+
+        if cached:
+            logger.info(f"[Chat] 命中响应缓存: {key_name} @ {ip}")
+            result = response_cache.replay(cached, body.stream)
+        else:
+            # 调用Grok客户端
+            result = await GrokClient.openai_to_grok(request_data)
+            if cache_key and not body.stream:
+                response_cache.put(cache_key, result.choices[0].message.content, result.model)
         
         # 记录成功统计
         await request_stats.record_request(model, success=True)
@@ -44,16 +123,40 @@ async def chat_completions(
         # 流式响应
         if body.stream:
             async def stream_wrapper():
+                stream_status = 200
+                stream_error = ""
+                # 单个读取任务持续消费上游，单个监视任务在客户端断开时取消它
+                queue = asyncio.Queue(maxsize=STREAM_BUFFER_SIZE)
+                pump_task = asyncio.create_task(_pump(result, queue))
+                watch_task = asyncio.create_task(_cancel_on_disconnect(request, pump_task))
                 try:
-                    async for chunk in result:
+                    while (chunk := await queue.get()) is not _STREAM_END:
                         yield chunk
+                    await asyncio.wait({pump_task})
+                    if pump_task.cancelled():
+                        stream_status = CLIENT_CLOSED_REQUEST
+                    else:
+                        pump_task.result()
+                except (asyncio.CancelledError, GeneratorExit):
+                    stream_status = CLIENT_CLOSED_REQUEST
+                    raise
                 finally:
+                    watch_task.cancel()
+                    if stream_status == CLIENT_CLOSED_REQUEST:
+                        # 关闭上游响应与会话并释放Token租约
+                        cancel_start = time.time()
+                        await _cancel_pending(pump_task)
+                        await result.aclose()
+                        stream_error = "客户端断开连接"
+                        logger.info(f"[Chat] 客户端断开，已取消上游流: {key_name} @ {ip} (清理耗时{(time.time() - cancel_start) * 1000:.0f}ms)")
+
                     # 流式结束记录日志
                     duration = time.time() - start_time
-                    await request_logger.add_log(ip, model, duration, 200, key_name)
+                    await request_logger.add_log(ip, model, duration, stream_status, key_name, error=stream_error)
 
-            return StreamingResponse(
+            return ClosingStreamingResponse(
                 content=stream_wrapper(),
+                upstream=result,
                 media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
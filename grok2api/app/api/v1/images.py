@@ -1,19 +1,33 @@
 """图片服务API - 提供缓存的图片和视频文件"""
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from typing import Optional
 
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, RedirectResponse
+
+from app.core.config import setting
 from app.core.logger import logger
-from app.services.grok.cache import image_cache_service, video_cache_service
+from app.services.grok import imaging
+from app.services.grok.cache import MIME_TYPES, DEFAULT_MIME, image_cache_service, image_variant_service, video_cache_service
 
 
 router = APIRouter()
 
 
 @router.get("/images/{img_path:path}")
-async def get_image(img_path: str):
-    """获取缓存的图片或视频
-    
+async def get_image(
+    img_path: str,
+    request: Request,
+    w: int = Query(0, ge=0, le=imaging.MAX_DIMENSION, description="最大宽度（0为不限制）"),
+    h: int = Query(0, ge=0, le=imaging.MAX_DIMENSION, description="最大高度（0为不限制）"),
+    fmt: Optional[str] = Query(None, alias="format", pattern="^(auto|avif|webp|jpeg|png)$"),
+    q: Optional[int] = Query(None, ge=1, le=100, description="压缩质量"),
+):
+    """获取缓存的图片或视频（图片仍在后台下载时等待下载完成）
+
+    图片支持派生版本：w/h 按比例缩小，format 转码（auto 按 Accept 头选择 avif/webp），q 压缩质量。
+    w/h/q 归档到有限档位，匿名请求无法生成任意数量的派生图。
+
     Args:
         img_path: 文件路径（格式：users-xxx-generated-xxx-image.jpg）
     """
@@ -23,24 +37,35 @@ async def get_image(img_path: str):
 
         # 判断类型
         is_video = any(original_path.lower().endswith(ext) for ext in ['.mp4', '.webm', '.mov', '.avi'])
-        
+        headers = {
+            "Cache-Control": "public, max-age=86400",
+            "Access-Control-Allow-Origin": "*"
+        }
+
         if is_video:
             cache_path = video_cache_service.get_cached(original_path)
             media_type = "video/mp4"
         else:
-            cache_path = image_cache_service.get_cached(original_path)
-            media_type = "image/jpeg"
+            cache_path = await image_cache_service.wait_cached(original_path)
+            if cache_path is None:
+                # 下载失败：回退上游原始地址（与流式输出失败时的回退一致）
+                logger.warning(f"[MediaAPI] 缓存失败，回退原始地址: {original_path}")
+                return RedirectResponse(setting.assets_url(original_path.lstrip('/')), status_code=302)
+            media_type = MIME_TYPES.get(cache_path.suffix.lower(), DEFAULT_MIME)
+
+            w, h, q = image_variant_service.quantize(w, h, q)
+            target = image_variant_service.negotiate(fmt, request.headers.get("accept", ""), bool(w or h))
+            if fmt in (None, "auto"):
+                headers["Vary"] = "Accept"
+            if imaging.AVAILABLE and (w or h or target):
+                try:
+                    cache_path, media_type = await image_variant_service.get_variant(cache_path, w, h, target, q)
+                except Exception as e:
+                    logger.warning(f"[MediaAPI] 生成派生图失败，返回原图: {e}")
 
         if cache_path and cache_path.exists():
             logger.debug(f"[MediaAPI] 返回缓存: {cache_path}")
-            return FileResponse(
-                path=str(cache_path),
-                media_type=media_type,
-                headers={
-                    "Cache-Control": "public, max-age=86400",
-                    "Access-Control-Allow-Origin": "*"
-                }
-            )
+            return FileResponse(path=str(cache_path), media_type=media_type, headers=headers)
 
         # 文件不存在
         logger.warning(f"[MediaAPI] 未找到: {original_path}")
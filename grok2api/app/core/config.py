@@ -1,6 +1,7 @@
 """配置管理器 - 管理应用配置的读写"""
 
 import toml
+import asyncio
 from pathlib import Path
 from typing import Dict, Any, Optional, Literal
 
@@ -8,12 +9,19 @@ from typing import Dict, Any, Optional, Literal
 # 默认配置
 DEFAULT_GROK = {
     "api_key": "",
+    "upstream_base_url": "https://grok.com",  # Grok上游地址（压测时可指向 benchmark/mock_upstream.py）
+    "assets_base_url": "https://assets.grok.com",  # Grok资源地址
     "proxy_url": "",
     "proxy_pool_url": "",
     "proxy_pool_interval": 300,
     "proxy_pool_scheme": "https",
     "proxy_pool_username": "",
     "proxy_pool_password": "",
+    "proxy_pool_size": 4,  # 代理池预取的代理数
+    "proxy_pool_strategy": "least_loaded",  # 代理选择策略: least_loaded/round_robin（同一Token固定同一代理）
+    "proxy_max_forbidden": 2,  # 代理累计403次数达到该值后隔离
+    "proxy_max_error_rate": 0.5,  # 代理EWMA错误率达到该值后隔离
+    "proxy_quarantine_seconds": 300,  # 代理隔离秒数
     "cache_proxy_url": "",
     "cf_clearance": "",
     "x_statsig_id": "",
@@ -26,7 +34,25 @@ DEFAULT_GROK = {
     "stream_first_response_timeout": 30,
     "stream_chunk_timeout": 120,
     "stream_total_timeout": 600,
+    "stream_timeout_failover": 1,  # 首次响应超时（上游未返回任何数据）时换Token重试的次数（0=关闭）
     "retry_status_codes": [401, 429],  # 可重试的HTTP状态码
+    "token_select_strategy": "least_loaded",  # Token选择策略: least_loaded/p2c/weighted/first
+    "token_wait_timeout": 0,  # 无可用Token时排队等待的最长秒数（0=不等待，立即失败）
+    "limit_refresh_enabled": True,  # 后台按冷却到期时间主动刷新Token限额
+    "limit_refresh_budget": 6,  # 后台刷新每分钟最多检查的Token数
+    "limit_refresh_stale_seconds": 3600,  # 超过该秒数未检查的Token视为陈旧
+    "conversation_affinity": True,  # 多轮对话命中已有上游会话时只发送新增消息（未命中或失败时完整重放）
+    "conversation_ttl": 3600,  # 会话映射保留秒数
+    "conversation_cache_size": 10000,  # 会话映射最大条数（LRU淘汰）
+    "response_cache_default": False,  # 全局Key与匿名访问是否启用响应缓存（多Key在管理页按Key开启）
+    "response_cache_ttl": 3600,  # 响应缓存保留秒数
+    "response_cache_max_entries": 1000,  # 响应缓存最大条数
+    "response_cache_max_mb": 64,  # 响应缓存内存上限（MB）
+    "batch_max_concurrency": 32,  # 批量任务最大并发（实际并发不超过当前可用Token数）
+    "batch_max_retries": 3,  # 批量请求遇到限流/无可用Token时的重试次数
+    "batch_retry_delay": 10,  # 批量任务遇到限流后暂停派发的秒数
+    "batch_pool_empty_timeout": 600,  # 批量任务持续无可用Token超过该秒数时标记失败（0=一直等待）
+    "key_import_interval": 2,  # 检查注册输出 keys/grok.txt 新增Token的间隔秒数（0=仅启动时导入）
 }
 
 DEFAULT_GLOBAL = {
@@ -36,6 +62,16 @@ DEFAULT_GLOBAL = {
     "admin_password": "admin",
     "admin_username": "admin",
     "image_cache_max_size_mb": 512,
+    "image_variant_cache_max_size_mb": 256,  # 缩放/转码派生图缓存上限（MB，独立于原图缓存）
+    "image_variant_quality": 80,  # 派生图默认压缩质量（1-100）
+    "image_variant_sizes": [64, 128, 256, 512, 1024, 2048],  # 派生图宽高档位，请求的 w/h 向上取到档位（像素）
+    "image_auto_format": False,  # 未指定参数的 /images 请求也按 Accept 头转码为 avif/webp
+    "image_worker_processes": 2,  # 图片处理进程数
+    "image_normalize": False,  # 上传前规范化输入图片（缩小、去除元数据、重新压缩）
+    "image_normalize_max_dimension": 2048,  # 规范化后最长边（像素）
+    "image_normalize_quality": 85,  # 规范化JPEG压缩质量（1-100）
+    "image_normalize_min_kb": 256,  # 小于该大小（KB）的图片不做规范化
+    "image_normalize_cache_mb": 32,  # 规范化结果缓存内存上限（MB）
     "video_cache_max_size_mb": 1024,
     "max_upload_concurrency": 20,  # 最大并发上传数
     "max_request_concurrency": 50,  # 最大并发请求数
@@ -126,8 +162,8 @@ class ConfigManager:
             if section in config:
                 config[section].update(data)
         
-        async with aiofiles.open(self.config_path, "w", encoding="utf-8") as f:
-            await f.write(toml.dumps(config))
+        from app.core.storage import atomic_write
+        await asyncio.to_thread(atomic_write, self.config_path, toml.dumps(config).encode("utf-8"))
     
     async def _save_storage(self, updates: Dict[str, Dict[str, Any]]) -> None:
         """保存到存储"""
@@ -165,6 +201,16 @@ class ConfigManager:
         
         await self.reload()
     
+    def grok_url(self, path: str) -> str:
+        """拼接Grok上游接口地址"""
+        base = self.grok_config.get("upstream_base_url") or DEFAULT_GROK["upstream_base_url"]
+        return f"{base.rstrip('/')}{path}"
+
+    def assets_url(self, path: str) -> str:
+        """拼接Grok资源地址"""
+        base = self.grok_config.get("assets_base_url") or DEFAULT_GROK["assets_base_url"]
+        return f"{base.rstrip('/')}/{path.lstrip('/')}"
+
     async def get_proxy_async(self, proxy_type: Literal["service", "cache"] = "service") -> str:
         """异步获取代理URL（支持代理池）
         
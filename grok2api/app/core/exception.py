@@ -26,6 +26,7 @@ GROK_STATUS_MAP = {
     "JSON_ERROR": status.HTTP_502_BAD_GATEWAY,
     "API_ERROR": status.HTTP_502_BAD_GATEWAY,
     "STREAM_ERROR": status.HTTP_502_BAD_GATEWAY,
+    "STREAM_TIMEOUT": status.HTTP_504_GATEWAY_TIMEOUT,
     "NO_RESPONSE": status.HTTP_502_BAD_GATEWAY,
     "TOKEN_SAVE_ERROR": status.HTTP_500_INTERNAL_SERVER_ERROR,
     "NO_AVAILABLE_TOKEN": status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -39,6 +40,7 @@ GROK_TYPE_MAP = {
     "JSON_ERROR": "api_error",
     "API_ERROR": "api_error",
     "STREAM_ERROR": "api_error",
+    "STREAM_TIMEOUT": "api_error",
     "NO_RESPONSE": "api_error",
     "TOKEN_SAVE_ERROR": "api_error",
     "NO_AVAILABLE_TOKEN": "api_error",
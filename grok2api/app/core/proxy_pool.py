@@ -1,13 +1,48 @@
-"""代理池管理器 - 从URL动态获取代理IP"""
+"""代理池管理器 - 从URL动态获取代理IP
+
+代理池模式下预取多个代理，按EWMA延迟、错误率和403次数评估健康度，异常代理自动隔离；
+同一Token固定使用同一代理，单个代理被封不影响其他Token。
+"""
 
 import asyncio
 import aiohttp
 import time
-from typing import Optional, List
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any
+from urllib.parse import urlparse
 from app.core.logger import logger
 from app.core.proxy_secret import KdlSecretProxy
 
 
+# 常量
+EWMA_ALPHA = 0.2        # EWMA平滑系数
+MIN_SAMPLES = 5         # 按错误率隔离前的最少请求数
+FETCH_TIMEOUT = 10      # 代理池API超时（秒）
+
+
+@dataclass(slots=True)
+class ProxyEntry:
+    """代理池中的单个代理及其健康统计"""
+    url: str
+    fetched_at: float
+    latency: float = 0.0            # EWMA延迟（秒）
+    error_rate: float = 0.0         # EWMA错误率
+    forbidden: int = 0              # 403次数
+    requests: int = 0
+    quarantined_until: float = 0.0
+    generation: int = 0             # 获取批次编号，同一地址重新获取后递增
+
+    def healthy(self, now: float, ttl: float) -> bool:
+        return self.quarantined_until <= now and now - self.fetched_at < ttl
+
+
+@dataclass(slots=True)
+class ProxyLease:
+    """一次分配的代理及其代数（403时只作废该代，已换新代的调用方直接用新代理重试）"""
+    url: Optional[str]
+    generation: int = 0
+
+
 class ProxyPool:
     """代理池管理器"""
     
@@ -15,14 +50,21 @@ class ProxyPool:
         self._pool_url: Optional[str] = None
         self._static_proxy: Optional[str] = None
         self._current_proxy: Optional[str] = None
-        self._last_fetch_time: float = 0
-        self._fetch_interval: int = 300  # 5分钟刷新一次
+        self._fetch_interval: int = 300  # 代理有效期（秒），到期后轮换
         self._enabled: bool = False
-        self._lock = asyncio.Lock()
         self._secret_provider: Optional[KdlSecretProxy] = None
         self._pool_scheme: str = "https"
         self._pool_username: str = ""
         self._pool_password: str = ""
+
+        # 多代理池
+        self._entries: Dict[str, ProxyEntry] = {}
+        self._pins: Dict[str, str] = {}  # Token -> 代理URL
+        self._rr_index = 0
+        self._generation = 0
+        self._refill_task: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._stats: Dict[str, int] = {"fetched": 0, "retired": 0, "quarantined": 0, "fetch_errors": 0}
     
     def configure(
         self,
@@ -37,8 +79,8 @@ class ProxyPool:
         
         Args:
             proxy_url: 静态代理URL（socks5h://xxx 或 http://xxx）
-            proxy_pool_url: 代理池API URL，返回单个代理地址
-            proxy_pool_interval: 代理池刷新间隔（秒）
+            proxy_pool_url: 代理池API URL，每次请求返回一个或多个（按行分隔）代理地址
+            proxy_pool_interval: 单个代理的有效期（秒）
             proxy_pool_scheme: 代理池返回ip:port时使用的协议
             proxy_pool_username: 代理池鉴权用户名
             proxy_pool_password: 代理池鉴权密码
@@ -62,9 +104,11 @@ class ProxyPool:
         self._pool_url = pool_url
         self._fetch_interval = proxy_pool_interval
         self._enabled = bool(self._pool_url)
+        self._entries.clear()
+        self._pins.clear()
         
         if self._enabled:
-            logger.info(f"[ProxyPool] 代理池已启用: {self._pool_url}, 刷新间隔: {self._fetch_interval}s")
+            logger.info(f"[ProxyPool] 代理池已启用: {self._pool_url}, 池大小: {self._pool_size()}, 有效期: {self._fetch_interval}s")
         elif self._secret_provider or self._static_proxy:
             if self._secret_provider:
                 logger.info("[ProxyPool] 使用KDL动态代理")
@@ -73,83 +117,234 @@ class ProxyPool:
             self._current_proxy = self._static_proxy
         else:
             logger.info("[ProxyPool] 未配置代理")
+
+    @staticmethod
+    def _config(key: str, default: Any) -> Any:
+        from app.core.config import setting
+        return setting.grok_config.get(key, default)
+
+    def _pool_size(self) -> int:
+        return max(int(self._config("proxy_pool_size", 4)), 1)
     
-    async def get_proxy(self) -> Optional[str]:
+    @property
+    def rotatable(self) -> bool:
+        """403时是否可换代理（代理池或KDL动态代理）"""
+        return self._enabled or self._secret_provider is not None
+
+    async def get_proxy(self, key: Optional[str] = None) -> Optional[str]:
         """获取代理地址
         
+        Args:
+            key: 固定代理的标识（通常为Token），同一标识在代理健康时始终返回同一代理
+        
         Returns:
             代理URL或None
         """
+        return (await self.acquire(key)).url
+
+    async def acquire(self, key: Optional[str] = None) -> ProxyLease:
+        """分配代理租约（含代数，403时交给 invalidate）"""
         # 如果未启用代理池，返回静态代理
         if not self._enabled:
-            return await self._get_static_proxy()
-        
-        # 检查是否需要刷新
+            return await self._static_lease()
+
         now = time.time()
-        if not self._current_proxy or (now - self._last_fetch_time) >= self._fetch_interval:
-            async with self._lock:
-                # 双重检查
-                if not self._current_proxy or (now - self._last_fetch_time) >= self._fetch_interval:
-                    await self._fetch_proxy()
-        
-        return self._current_proxy
+        if key and (pinned := self._entries.get(self._pins.get(key, ""))):
+            if pinned.healthy(now, self._fetch_interval):
+                return ProxyLease(pinned.url, pinned.generation)
+
+        healthy = self._healthy(now)
+        if len(healthy) < self._pool_size():
+            self._schedule_refill()
+        if not healthy:
+            # 池中无可用代理时等待补充完成（所有调用方共享同一次补充）
+            await asyncio.shield(self._refill_task)
+            healthy = self._healthy(time.time())
+            if not healthy:
+                return await self._static_lease()
+
+        entry = self._select(healthy)
+        if key:
+            self._pins[key] = entry.url
+        self._current_proxy = entry.url
+        return ProxyLease(entry.url, entry.generation)
     
-    async def force_refresh(self) -> Optional[str]:
-        """强制刷新代理（用于403错误重试）
+    async def invalidate(self, lease: ProxyLease, key: Optional[str] = None) -> ProxyLease:
+        """租约遇到403：只作废签发它的那一代代理，返回用于重试的新租约
         
-        Returns:
-            新的代理URL或None
-        """
-        if not self._enabled:
-            if self._secret_provider:
-                return await self._secret_provider.force_refresh()
-            return self._static_proxy
+        同一代理上并发的403只计入当前代；代理已被隔离或KDL令牌已刷新时，
+        调用方直接拿到新代理重试，不会再触发新的获取。
         
-        async with self._lock:
-            await self._fetch_proxy()
+        Args:
+            lease: 遇到403的租约
+            key: 固定代理的标识
+        """
+        entry = self._entries.get(lease.url or "")
+        if entry is not None:
+            if entry.generation == lease.generation and entry.quarantined_until <= time.time():
+                self.report(lease.url, False, status=403)
+            return await self.acquire(key)
+
+        if self._secret_provider:
+            url = await self._secret_provider.force_refresh(lease.generation)
+            return ProxyLease(url, self._secret_provider.generation)
+        return await self.acquire(key)
+
+    def report(self, proxy: Optional[str], ok: bool, latency: Optional[float] = None,
+               status: Optional[int] = None) -> None:
+        """上报一次请求结果，更新代理健康度（403或错误率过高时隔离）
         
-        return self._current_proxy
-    
-    async def _fetch_proxy(self):
-        """从代理池URL获取新的代理"""
+        Args:
+            proxy: 本次使用的代理
+            ok: 请求是否成功（代理层面）
+            latency: 响应延迟（秒）
+            status: HTTP状态码
+        """
+        entry = self._entries.get(proxy or "")
+        if entry is None:
+            return
+
+        entry.requests += 1
+        entry.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - entry.error_rate)
+        if ok and latency is not None:
+            entry.latency = latency if entry.latency == 0 else entry.latency + EWMA_ALPHA * (latency - entry.latency)
+        if status == 403:
+            entry.forbidden += 1
+
+        max_forbidden = self._config("proxy_max_forbidden", 2)
+        max_error_rate = self._config("proxy_max_error_rate", 0.5)
+        if entry.forbidden >= max_forbidden or (entry.requests >= MIN_SAMPLES and entry.error_rate >= max_error_rate):
+            self._quarantine(entry)
+
+    def _quarantine(self, entry: ProxyEntry) -> None:
+        """隔离代理并解除固定到该代理的Token"""
+        if entry.quarantined_until > time.time():
+            return
+        entry.quarantined_until = time.time() + self._config("proxy_quarantine_seconds", 300)
+        self._stats["quarantined"] += 1
+        self._pins = {k: url for k, url in self._pins.items() if url != entry.url}
+        if self._current_proxy == entry.url:
+            self._current_proxy = None
+        logger.warning(f"[ProxyPool] 隔离代理: {self._mask(entry.url)} (403: {entry.forbidden}, 错误率: {entry.error_rate:.2f})")
+        self._schedule_refill()
+
+    def _healthy(self, now: float) -> List[ProxyEntry]:
+        return [e for e in self._entries.values() if e.healthy(now, self._fetch_interval)]
+
+    def _select(self, healthy: List[ProxyEntry]) -> ProxyEntry:
+        """按策略选择代理：round_robin轮询，least_loaded选固定Token最少、错误率和延迟最低的代理"""
+        if self._config("proxy_pool_strategy", "least_loaded") == "round_robin":
+            self._rr_index = (self._rr_index + 1) % len(healthy)
+            return healthy[self._rr_index]
+
+        load: Dict[str, int] = {}
+        for url in self._pins.values():
+            load[url] = load.get(url, 0) + 1
+        return min(healthy, key=lambda e: (load.get(e.url, 0), round(e.error_rate, 1), e.latency))
+
+    # === 预取 ===
+
+    def _schedule_refill(self) -> None:
+        """后台补充代理（同一时间只有一个补充任务）"""
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self) -> None:
+        """清理过期/隔离到期的代理，并发获取新代理补足池大小"""
+        now = time.time()
+        for url, entry in list(self._entries.items()):
+            if now - entry.fetched_at >= self._fetch_interval or 0 < entry.quarantined_until <= now:
+                del self._entries[url]
+                self._stats["retired"] += 1
+        self._pins = {k: url for k, url in self._pins.items() if url in self._entries}
+
+        missing = self._pool_size() - len(self._healthy(now))
+        if missing <= 0:
+            return
+        results = await asyncio.gather(*(self._fetch_proxy() for _ in range(missing)))
+        for proxies in results:
+            for proxy in proxies:
+                if proxy not in self._entries:
+                    self._generation += 1
+                    self._entries[proxy] = ProxyEntry(proxy, time.time(), generation=self._generation)
+                    self._stats["fetched"] += 1
+                    logger.info(f"[ProxyPool] 成功获取新代理: {self._mask(proxy)}")
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """共享的代理池API会话"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT))
+        return self._session
+
+    async def _fetch_proxy(self) -> List[str]:
+        """从代理池URL获取新代理（响应可按行返回多个）"""
         try:
             logger.debug(f"[ProxyPool] 正在从代理池获取新代理: {self._pool_url}")
-            
-            timeout = aiohttp.ClientTimeout(total=10)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(self._pool_url) as response:
-                    if response.status == 200:
-                        proxy_text = await response.text()
-                        proxy = self._normalize_proxy(proxy_text.strip())
-                        if not self._validate_proxy(proxy):
-                            proxy = self._build_pool_proxy(proxy)
-                        
-                        # 验证代理格式
-                        if self._validate_proxy(proxy):
-                            self._current_proxy = proxy
-                            self._last_fetch_time = time.time()
-                            logger.info(f"[ProxyPool] 成功获取新代理: {proxy}")
-                        else:
-                            logger.error(f"[ProxyPool] 代理格式无效: {proxy}")
-                            # 降级到静态代理
-                            if not self._current_proxy:
-                                self._current_proxy = await self._get_static_proxy()
-                    else:
-                        logger.error(f"[ProxyPool] 获取代理失败: HTTP {response.status}")
-                        # 降级到静态代理
-                        if not self._current_proxy:
-                            self._current_proxy = await self._get_static_proxy()
-        
+            async with self._get_session().get(self._pool_url) as response:
+                if response.status != 200:
+                    logger.error(f"[ProxyPool] 获取代理失败: HTTP {response.status}")
+                    self._stats["fetch_errors"] += 1
+                    return []
+                proxy_text = await response.text()
+
+            proxies = []
+            for line in proxy_text.splitlines():
+                proxy = self._normalize_proxy(line.strip())
+                if not self._validate_proxy(proxy):
+                    proxy = self._build_pool_proxy(proxy)
+                if self._validate_proxy(proxy):
+                    proxies.append(proxy)
+                elif proxy:
+                    logger.error(f"[ProxyPool] 代理格式无效: {proxy}")
+            if not proxies:
+                self._stats["fetch_errors"] += 1
+            return proxies
+
         except asyncio.TimeoutError:
             logger.error("[ProxyPool] 获取代理超时")
-            if not self._current_proxy:
-                self._current_proxy = await self._get_static_proxy()
-        
         except Exception as e:
             logger.error(f"[ProxyPool] 获取代理异常: {e}")
-            # 降级到静态代理
-            if not self._current_proxy:
-                self._current_proxy = await self._get_static_proxy()
+        self._stats["fetch_errors"] += 1
+        return []
+
+    async def close(self) -> None:
+        """停止补充任务并关闭会话"""
+        if self._refill_task and not self._refill_task.done():
+            self._refill_task.cancel()
+            await asyncio.gather(self._refill_task, return_exceptions=True)
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    # === 统计 ===
+
+    @staticmethod
+    def _mask(proxy: str) -> str:
+        """隐藏代理鉴权信息"""
+        parsed = urlparse(proxy)
+        return f"{parsed.scheme}://{parsed.hostname}:{parsed.port}" if parsed.hostname else proxy
+
+    def get_stats(self) -> Dict[str, Any]:
+        """代理池深度、轮换次数与各代理健康度"""
+        now = time.time()
+        return {
+            "enabled": self._enabled,
+            "size": self._pool_size() if self._enabled else 0,
+            "depth": len(self._healthy(now)),
+            "pinned_tokens": len(self._pins),
+            **self._stats,
+            "proxies": [
+                {
+                    "proxy": self._mask(e.url),
+                    "latency_ms": round(e.latency * 1000),
+                    "error_rate": round(e.error_rate, 3),
+                    "forbidden": e.forbidden,
+                    "requests": e.requests,
+                    "age": int(now - e.fetched_at),
+                    "quarantined": e.quarantined_until > now,
+                }
+                for e in self._entries.values()
+            ],
+        }
     
     def _validate_proxy(self, proxy: str) -> bool:
         """验证代理格式
@@ -201,10 +396,12 @@ class ProxyPool:
         scheme = self._pool_scheme or "https"
         return f"{scheme}://{auth}{raw}"
 
-    async def _get_static_proxy(self) -> Optional[str]:
+    async def _static_lease(self) -> ProxyLease:
+        """静态代理或KDL动态代理的租约（KDL以令牌刷新次数为代数）"""
         if self._secret_provider:
-            return await self._secret_provider.get_proxy()
-        return self._static_proxy
+            url = await self._secret_provider.get_proxy()
+            return ProxyLease(url, self._secret_provider.generation)
+        return ProxyLease(self._static_proxy)
     
     def get_current_proxy(self) -> Optional[str]:
         """获取当前使用的代理（同步方法）
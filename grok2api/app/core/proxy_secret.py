@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import asyncio
 import json
 import time
 from dataclasses import dataclass
@@ -37,6 +38,8 @@ class KdlSecretProxy:
         self._secret_token: Optional[str] = None
         self._expire_seconds: float = 0.0
         self._issued_at: float = 0.0
+        self._generation: int = 0
+        self._refresh_task: Optional[asyncio.Task] = None
         self._load_cache()
 
     @classmethod
@@ -75,8 +78,15 @@ class KdlSecretProxy:
             return None
         return self._build_proxy_url(self._secret_token)
 
-    async def force_refresh(self) -> Optional[str]:
-        await self._refresh_token(force=True)
+    @property
+    def generation(self) -> int:
+        """Incremented on every successful token refresh."""
+        return self._generation
+
+    async def force_refresh(self, generation: Optional[int] = None) -> Optional[str]:
+        """Refresh after a block; a stale generation reuses the token refreshed since."""
+        if generation is None or generation == self._generation:
+            await self._refresh_token(force=True)
         if not self._secret_token:
             return None
         return self._build_proxy_url(self._secret_token)
@@ -119,9 +129,14 @@ class KdlSecretProxy:
             logger.warning(f"[Proxy] failed to save kdl cache: {e}")
 
     async def _refresh_token(self, force: bool = False) -> None:
+        """Single-flight refresh: concurrent callers share one in-flight fetch."""
         if not force and self._is_token_valid():
             return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch_token())
+        await asyncio.shield(self._refresh_task)
 
+    async def _fetch_token(self) -> None:
         try:
             async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
                 async with session.post(
@@ -143,6 +158,7 @@ class KdlSecretProxy:
             self._secret_token = token
             self._expire_seconds = expire
             self._issued_at = time.time()
+            self._generation += 1
             self._save_cache()
         except Exception as e:
             logger.error(f"[Proxy] kdl token parse failed: {e}")
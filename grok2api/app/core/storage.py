@@ -1,20 +1,164 @@
-"""存储抽象层 - 支持文件、MySQL和Redis存储"""
+"""存储抽象层 - 支持文件、SQLite、MySQL和Redis存储"""
 
 import os
+import time
 import orjson
 import toml
 import asyncio
+import sqlite3
 import warnings
 import aiofiles
+import portalocker
 from pathlib import Path
-from typing import Dict, Any, Optional, Literal
+from typing import Dict, Any, Optional, Literal, List, Tuple
 from abc import ABC, abstractmethod
 from urllib.parse import urlparse, unquote
 
 from app.core.logger import logger
 
 
-StorageMode = Literal["file", "mysql", "redis"]
+StorageMode = Literal["file", "sqlite", "mysql", "redis"]
+
+
+# Token变更记录: (Token类型, SSO, 数据)，数据为None表示删除
+TokenChange = Tuple[str, str, Optional[Dict[str, Any]]]
+
+JOURNAL_COMPACT_MIN = 1024 * 1024  # 变更日志超过该大小且超过快照大小时压缩（字节）
+SYNC_INTERVAL = 1.0  # 多进程增量同步的最短间隔（秒）
+
+
+def atomic_write(path: Path, content: bytes) -> None:
+    """原子写入：写临时文件并fsync后重命名，读取方不会看到空文件或半个文件"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class TokenJournal:
+    """Token快照 + 追加式变更日志（同步方法，在线程中调用）
+
+    token.json 为紧凑JSON快照，token.journal 每行一条变更。加载时回放日志，
+    日志超过快照大小时重写快照并清空日志。日志文件同时作为多进程锁。
+    """
+
+    def __init__(self, snapshot: Path):
+        self.snapshot = snapshot
+        self.path = snapshot.with_suffix(".journal")
+        self._offset = 0                      # 已应用到内存的日志长度
+        self._snapshot_id: Optional[Tuple[int, int]] = None
+
+    def _stat_id(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.snapshot.stat()
+            return st.st_ino, st.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _open_locked(self, flags: int):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(self.path, "a+b")
+        portalocker.lock(f, flags)
+        return f
+
+    @staticmethod
+    def _parse(line: bytes) -> Optional[TokenChange]:
+        try:
+            token_type, sso, value = orjson.loads(line)
+        except (orjson.JSONDecodeError, ValueError, TypeError):
+            return None
+        return token_type, sso, value
+
+    def read_changes(self) -> Optional[List[TokenChange]]:
+        """读取其他进程追加的变更；快照被重写或日志被截断时返回None（需完整重新加载）"""
+        f = self._open_locked(portalocker.LOCK_SH)
+        try:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if self._stat_id() != self._snapshot_id or size < self._offset:
+                return None
+            changes = []
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._offset += len(line)
+                if change := self._parse(line):
+                    changes.append(change)
+            return changes
+        finally:
+            portalocker.unlock(f)
+            f.close()
+
+    def load(self) -> Dict[str, Any]:
+        """读取快照并回放日志"""
+        f = self._open_locked(portalocker.LOCK_SH)
+        try:
+            data = orjson.loads(self.snapshot.read_bytes()) if self.snapshot.exists() else {}
+            data.setdefault("ssoNormal", {})
+            data.setdefault("ssoSuper", {})
+            f.seek(0)
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 写入中断留下的半行
+                offset += len(line)
+                if change := self._parse(line):
+                    token_type, sso, value = change
+                    pool = data.setdefault(token_type, {})
+                    if value is None:
+                        pool.pop(sso, None)
+                    else:
+                        pool[sso] = value
+            self._offset = offset
+            self._snapshot_id = self._stat_id()
+            return data
+        finally:
+            portalocker.unlock(f)
+            f.close()
+
+    def append(self, changes: List[TokenChange], data: Dict[str, Any]) -> None:
+        """追加变更（fsync），日志过大时用 data 压缩"""
+        if not changes:
+            return
+        f = self._open_locked(portalocker.LOCK_EX)
+        try:
+            f.seek(0, os.SEEK_END)
+            start = f.tell()
+            if start:
+                f.seek(start - 1)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")  # 隔开上次中断的半行
+            f.write(b"".join(orjson.dumps(change) + b"\n" for change in changes))
+            f.flush()
+            os.fsync(f.fileno())
+            end = f.tell()
+            if start == self._offset:
+                self._offset = end  # 期间无其他进程写入
+
+            snapshot_size = self.snapshot.stat().st_size if self.snapshot.exists() else 0
+            if end > max(snapshot_size, JOURNAL_COMPACT_MIN):
+                self._compact_locked(f, data)
+        finally:
+            portalocker.unlock(f)
+            f.close()
+
+    def compact(self, data: Dict[str, Any]) -> None:
+        """重写快照并清空日志"""
+        f = self._open_locked(portalocker.LOCK_EX)
+        try:
+            self._compact_locked(f, data)
+        finally:
+            portalocker.unlock(f)
+            f.close()
+
+    def _compact_locked(self, f, data: Dict[str, Any]) -> None:
+        atomic_write(self.snapshot, orjson.dumps(data))
+        f.truncate(0)
+        self._offset = 0
+        self._snapshot_id = self._stat_id()
 
 
 class BaseStorage(ABC):
@@ -35,6 +179,14 @@ class BaseStorage(ABC):
         """保存token数据"""
         pass
 
+    async def save_token_changes(self, changes: List[TokenChange], data: Dict[str, Any]) -> None:
+        """保存部分Token变更（默认保存全量数据）"""
+        await self.save_tokens(data)
+
+    async def load_token_changes(self) -> Optional[List[TokenChange]]:
+        """读取其他进程写入的Token变更（None表示需完整重新加载，不支持同步的存储返回空）"""
+        return []
+
     @abstractmethod
     async def load_config(self) -> Dict[str, Any]:
         """加载配置数据"""
@@ -55,13 +207,15 @@ class FileStorage(BaseStorage):
         self.config_file = data_dir / "setting.toml"
         self._token_lock = asyncio.Lock()
         self._config_lock = asyncio.Lock()
+        self._journal = TokenJournal(self.token_file)
+        self._last_poll = 0.0
 
     async def init_db(self) -> None:
         """初始化文件存储"""
         self.data_dir.mkdir(parents=True, exist_ok=True)
 
         if not self.token_file.exists():
-            await self._write(self.token_file, orjson.dumps({"ssoNormal": {}, "ssoSuper": {}}, option=orjson.OPT_INDENT_2).decode())
+            await self._write(self.token_file, orjson.dumps({"ssoNormal": {}, "ssoSuper": {}}).decode())
             logger.info("[Storage] 创建token文件")
 
         if not self.config_file.exists():
@@ -78,29 +232,8 @@ class FileStorage(BaseStorage):
             return await f.read()
 
     async def _write(self, path: Path, content: str) -> None:
-        """写入文件"""
-        async with aiofiles.open(path, "w", encoding="utf-8") as f:
-            await f.write(content)
-
-    async def _load_json(self, path: Path, default: Dict, lock: asyncio.Lock) -> Dict[str, Any]:
-        """加载JSON"""
-        try:
-            async with lock:
-                if not path.exists():
-                    return default
-                return orjson.loads(await self._read(path))
-        except Exception as e:
-            logger.error(f"[Storage] 加载{path.name}失败: {e}")
-            return default
-
-    async def _save_json(self, path: Path, data: Dict, lock: asyncio.Lock) -> None:
-        """保存JSON"""
-        try:
-            async with lock:
-                await self._write(path, orjson.dumps(data, option=orjson.OPT_INDENT_2).decode())
-        except Exception as e:
-            logger.error(f"[Storage] 保存{path.name}失败: {e}")
-            raise
+        """原子写入文件"""
+        await asyncio.to_thread(atomic_write, path, content.encode("utf-8"))
 
     async def _load_toml(self, path: Path, default: Dict, lock: asyncio.Lock) -> Dict[str, Any]:
         """加载TOML"""
@@ -123,12 +256,40 @@ class FileStorage(BaseStorage):
             raise
 
     async def load_tokens(self) -> Dict[str, Any]:
-        """加载token"""
-        return await self._load_json(self.token_file, {"ssoNormal": {}, "ssoSuper": {}}, self._token_lock)
+        """加载token（快照 + 回放变更日志）"""
+        try:
+            async with self._token_lock:
+                return await asyncio.to_thread(self._journal.load)
+        except Exception as e:
+            logger.error(f"[Storage] 加载{self.token_file.name}失败: {e}")
+            return {"ssoNormal": {}, "ssoSuper": {}}
 
     async def save_tokens(self, data: Dict[str, Any]) -> None:
-        """保存token"""
-        await self._save_json(self.token_file, data, self._token_lock)
+        """保存token（重写快照）"""
+        try:
+            async with self._token_lock:
+                await asyncio.to_thread(self._journal.compact, data)
+        except Exception as e:
+            logger.error(f"[Storage] 保存{self.token_file.name}失败: {e}")
+            raise
+
+    async def save_token_changes(self, changes: List[TokenChange], data: Dict[str, Any]) -> None:
+        """追加token变更到日志"""
+        try:
+            async with self._token_lock:
+                await asyncio.to_thread(self._journal.append, changes, data)
+        except Exception as e:
+            logger.error(f"[Storage] 写入{self._journal.path.name}失败: {e}")
+            raise
+
+    async def load_token_changes(self) -> Optional[List[TokenChange]]:
+        """读取其他进程追加到变更日志的token变更"""
+        now = time.monotonic()
+        if now - self._last_poll < SYNC_INTERVAL:
+            return []
+        self._last_poll = now
+        async with self._token_lock:
+            return await asyncio.to_thread(self._journal.read_changes)
 
     async def load_config(self) -> Dict[str, Any]:
         """加载配置"""
@@ -139,6 +300,157 @@ class FileStorage(BaseStorage):
         await self._save_toml(self.config_file, data, self._config_lock)
 
 
+class SqliteStorage(BaseStorage):
+    """SQLite存储（WAL模式，每个Token一行，适合单机多worker）
+
+    每次写入事务递增全局序号并写入变更行的 seq，删除的Token保留 data 为 NULL 的墓碑行，
+    其他进程按 seq 增量读取变更。配置仍保存在 setting.toml。
+    """
+
+    def __init__(self, database_url: str, data_dir: Path):
+        self.data_dir = data_dir
+        self.db_path = Path(self._parse_path(database_url)) if database_url else data_dir / "grok2api.db"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = asyncio.Lock()
+        self._seq = 0          # 已同步到内存的最大序号
+        self._last_poll = 0.0
+        self._file = FileStorage(data_dir)
+
+    @staticmethod
+    def _parse_path(url: str) -> str:
+        """sqlite:///data/x.db（相对路径）或 sqlite:////abs/x.db"""
+        return url[len("sqlite:///"):] if url.startswith("sqlite:///") else url
+
+    async def init_db(self) -> None:
+        """初始化SQLite"""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        await self._run(self._create_tables)
+        await self._file.init_db()
+        logger.info(f"[Storage] SQLite: {self.db_path}")
+
+        if not await self._run(lambda: self._conn.execute("SELECT 1 FROM tokens LIMIT 1").fetchone()):
+            file_data = await self._file.load_tokens()
+            if file_data.get("ssoNormal") or file_data.get("ssoSuper"):
+                await self.save_tokens(file_data)
+                logger.info("[Storage] tokens数据已从文件导入SQLite")
+
+    def _create_tables(self) -> None:
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tokens (
+                sso TEXT PRIMARY KEY,
+                token_type TEXT NOT NULL,
+                status TEXT,
+                cooldown_until INTEGER,
+                remaining INTEGER,
+                heavy_remaining INTEGER,
+                created_time INTEGER,
+                data TEXT,
+                seq INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tokens_status ON tokens(token_type, status);
+            CREATE INDEX IF NOT EXISTS idx_tokens_cooldown ON tokens(cooldown_until);
+            CREATE INDEX IF NOT EXISTS idx_tokens_remaining ON tokens(token_type, remaining);
+            CREATE INDEX IF NOT EXISTS idx_tokens_seq ON tokens(seq);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('seq', 0);
+        """)
+
+    async def _run(self, func, *args):
+        """在线程中执行（单连接串行）"""
+        async with self._lock:
+            return await asyncio.to_thread(func, *args)
+
+    @staticmethod
+    def _row(token_type: str, sso: str, data: Optional[Dict[str, Any]], seq: int) -> Tuple:
+        if data is None:
+            return sso, token_type, None, None, None, None, None, None, seq
+        return (sso, token_type, data.get("status", "active"), data.get("cooldownUntil"),
+                data.get("remainingQueries", -1), data.get("heavyremainingQueries", -1),
+                data.get("createdTime"), orjson.dumps(data).decode(), seq)
+
+    def _write_sync(self, changes: List[TokenChange], replace_all: bool) -> None:
+        """在一个事务内写入变更（replace_all 时把未写入的行标记为删除）"""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            prev = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+            seq = prev + 1
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'seq'", (seq,))
+            conn.executemany(
+                "INSERT INTO tokens (sso, token_type, status, cooldown_until, remaining, heavy_remaining, "
+                "created_time, data, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(sso) DO UPDATE SET token_type = excluded.token_type, status = excluded.status, "
+                "cooldown_until = excluded.cooldown_until, remaining = excluded.remaining, "
+                "heavy_remaining = excluded.heavy_remaining, created_time = excluded.created_time, "
+                "data = excluded.data, seq = excluded.seq",
+                [self._row(t, sso, data, seq) for t, sso, data in changes],
+            )
+            if replace_all:
+                conn.execute("UPDATE tokens SET status = NULL, data = NULL, seq = ? "
+                             "WHERE seq < ? AND data IS NOT NULL", (seq, seq))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if prev == self._seq:
+            self._seq = seq  # 期间无其他进程写入
+
+    def _load_sync(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"ssoNormal": {}, "ssoSuper": {}}
+        self._seq = self._conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+        for token_type, sso, raw in self._conn.execute(
+                "SELECT token_type, sso, data FROM tokens WHERE data IS NOT NULL"):
+            data.setdefault(token_type, {})[sso] = orjson.loads(raw)
+        return data
+
+    def _changes_sync(self) -> List[TokenChange]:
+        rows = self._conn.execute(
+            "SELECT token_type, sso, data, seq FROM tokens WHERE seq > ? ORDER BY seq", (self._seq,)).fetchall()
+        if rows:
+            self._seq = rows[-1][3]
+        return [(t, sso, orjson.loads(raw) if raw else None) for t, sso, raw, _ in rows]
+
+    async def load_tokens(self) -> Dict[str, Any]:
+        """加载token"""
+        return await self._run(self._load_sync)
+
+    async def save_tokens(self, data: Dict[str, Any]) -> None:
+        """保存全部token（不在data中的行标记为删除）"""
+        changes = [(t, sso, item) for t, pool in data.items() for sso, item in pool.items()]
+        await self._run(self._write_sync, changes, True)
+
+    async def save_token_changes(self, changes: List[TokenChange], data: Dict[str, Any]) -> None:
+        """按行写入token变更"""
+        if changes:
+            await self._run(self._write_sync, changes, False)
+
+    async def load_token_changes(self) -> List[TokenChange]:
+        """读取其他进程写入的token变更（按seq索引增量查询）"""
+        now = time.monotonic()
+        if now - self._last_poll < SYNC_INTERVAL:
+            return []
+        self._last_poll = now
+        return await self._run(self._changes_sync)
+
+    async def load_config(self) -> Dict[str, Any]:
+        """加载配置"""
+        return await self._file.load_config()
+
+    async def save_config(self, data: Dict[str, Any]) -> None:
+        """保存配置"""
+        await self._file.save_config(data)
+
+    async def close(self) -> None:
+        """关闭连接"""
+        if self._conn:
+            await self._run(self._conn.close)
+            self._conn = None
+            logger.info("[Storage] SQLite已关闭")
+
+
 class MysqlStorage(BaseStorage):
     """MySQL存储"""
 
@@ -417,7 +729,7 @@ class StorageManager:
         url = os.getenv("DATABASE_URL", "")
         data_dir = Path(__file__).parents[2] / "data"
 
-        classes = {"mysql": MysqlStorage, "redis": RedisStorage, "file": FileStorage}
+        classes = {"mysql": MysqlStorage, "redis": RedisStorage, "sqlite": SqliteStorage, "file": FileStorage}
 
         if mode in ("mysql", "redis") and not url:
             raise ValueError(f"{mode.upper()}模式需要DATABASE_URL")
@@ -165,6 +165,15 @@ class ApiKeyManager:
                 return True
         return False
 
+    async def update_key_cache(self, key: str, enabled: bool) -> bool:
+        """更新 Key 的响应缓存开关"""
+        for k in self._keys:
+            if k["key"] == key:
+                k["response_cache"] = enabled
+                await self._save_data()
+                return True
+        return False
+
     def validate_key(self, key: str) -> Optional[Dict]:
         """验证 Key，返回 Key 信息"""
         # 1. 检查全局配置的 Key (作为默认 admin key)
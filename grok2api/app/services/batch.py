@@ -0,0 +1,432 @@
+"""批量补全服务 - 仿 OpenAI Batch API 的离线任务队列
+
+输入为 JSONL（每行 {"custom_id": ..., "body": {OpenAI聊天请求}}），结果逐行写入
+output.jsonl。并发按当前可用Token数调整，遇到限流时退避重试；任务状态保存在
+data/batches/<id>/ 下，服务重启后跳过已完成的行继续执行。
+"""
+
+import os
+import time
+import uuid
+import asyncio
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+import orjson
+
+from app.core.config import setting
+from app.core.exception import GrokApiException
+from app.core.logger import logger
+from app.models.openai_schema import OpenAIChatRequest
+from app.services.grok.client import GrokClient
+from app.services.grok.token import token_manager
+from app.services.request_stats import request_stats
+
+
+# 常量
+BATCH_DIR = Path(__file__).parents[2] / "data" / "batches"
+INPUT_FILE = "input.jsonl"
+OUTPUT_FILE = "output.jsonl"
+META_FILE = "batch.json"
+COMPLETION_URL = "/v1/chat/completions"
+RATE_LIMIT_CODES = ("NO_AVAILABLE_TOKEN",)  # 需退避重试的错误码（另含HTTP 429）
+POOL_EMPTY_WAIT = 5.0                       # 无可用Token时的等待间隔（秒）
+CAPACITY_TTL = 1.0                          # 可用Token数的缓存时间（秒）
+META_SAVE_EVERY = 20                        # 每写出该数量的结果保存一次元数据
+
+# 任务状态
+STATUS_IN_PROGRESS = "in_progress"
+STATUS_COMPLETED = "completed"
+STATUS_CANCELLING = "cancelling"
+STATUS_CANCELLED = "cancelled"
+STATUS_FAILED = "failed"
+ACTIVE_STATUSES = (STATUS_IN_PROGRESS, STATUS_CANCELLING)
+
+
+class BatchJob:
+    """单个批量任务"""
+
+    def __init__(self, meta: Dict[str, Any], batch_dir: Path = BATCH_DIR):
+        self.meta = meta
+        self.dir = batch_dir / meta["id"]
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_event = asyncio.Event()  # 取消时唤醒等待并发的调度循环
+
+    @property
+    def id(self) -> str:
+        return self.meta["id"]
+
+    @property
+    def owner(self) -> Optional[str]:
+        """创建任务的API Key摘要（开发模式下为None）"""
+        return self.meta.get("owner")
+
+    def counts(self) -> Dict[str, int]:
+        return self.meta["request_counts"]
+
+    def save_meta(self) -> None:
+        """原子写入任务元数据"""
+        tmp = self.dir / f"{META_FILE}.tmp"
+        tmp.write_bytes(orjson.dumps(self.meta))
+        os.replace(tmp, self.dir / META_FILE)
+
+    def to_dict(self) -> Dict[str, Any]:
+        meta = {k: v for k, v in self.meta.items() if k != "owner"}
+        return {**meta, "object": "batch"}
+
+
+class BatchManager:
+    """批量任务管理器（单例）"""
+
+    _instance: Optional['BatchManager'] = None
+
+    def __new__(cls) -> 'BatchManager':
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        self.batch_dir = BATCH_DIR
+        self._jobs: Dict[str, BatchJob] = {}
+        self._capacity: Dict[str, tuple] = {}  # 模型 -> (可用Token数, 计算时间)
+        self._backoff_until = 0.0              # 限流退避截止时间（monotonic）
+        self._initialized = True
+
+    # === 任务管理 ===
+
+    async def create(self, chunks: AsyncIterator[bytes], owner: Optional[str] = None,
+                     metadata: Optional[Dict[str, Any]] = None) -> BatchJob:
+        """流式写入输入文件并启动任务（文件读写在线程中执行，不阻塞事件循环）
+
+        Args:
+            owner: 创建任务的API Key摘要，查询与取消时按此隔离
+        """
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        job_dir = self.batch_dir / batch_id
+        await asyncio.to_thread(job_dir.mkdir, parents=True, exist_ok=True)
+
+        total = 0
+        tail = b""
+        f = await asyncio.to_thread(open, job_dir / INPUT_FILE, "wb")
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                total += sum(1 for line in lines if line.strip())
+        finally:
+            await asyncio.to_thread(f.close)
+        if tail.strip():
+            total += 1
+
+        if total == 0:
+            await asyncio.to_thread(self._remove_dir, job_dir)
+            raise GrokApiException("批量任务输入为空", "INVALID_BATCH", status_code=400)
+
+        meta = {
+            "id": batch_id,
+            "endpoint": COMPLETION_URL,
+            "status": STATUS_IN_PROGRESS,
+            "created_at": int(time.time()),
+            "completed_at": None,
+            "request_counts": {"total": total, "completed": 0, "failed": 0},
+            "metadata": metadata or {},
+            "owner": owner,
+        }
+        job = BatchJob(meta, self.batch_dir)
+        await asyncio.to_thread(job.save_meta)
+        self._jobs[batch_id] = job
+        self._start(job)
+        logger.info(f"[Batch] 创建任务: {batch_id} ({total}条)")
+        return job
+
+    def get(self, batch_id: str) -> Optional[BatchJob]:
+        return self._jobs.get(batch_id)
+
+    def list(self, owner: Optional[str] = None) -> List[BatchJob]:
+        """指定API Key创建的任务（按创建时间倒序）"""
+        jobs = [job for job in self._jobs.values() if job.owner == owner]
+        return sorted(jobs, key=lambda job: job.meta["created_at"], reverse=True)
+
+    def output_path(self, job: BatchJob) -> Path:
+        return job.dir / OUTPUT_FILE
+
+    async def cancel(self, job: BatchJob) -> None:
+        """取消任务（已发出的请求完成后停止）"""
+        if job.meta["status"] != STATUS_IN_PROGRESS:
+            return
+        job.meta["status"] = STATUS_CANCELLING
+        job.cancel_event.set()
+        await asyncio.to_thread(job.save_meta)
+
+    async def resume(self) -> None:
+        """加载任务元数据，继续执行未完成的任务"""
+        if not self.batch_dir.exists():
+            return
+        for meta_path in self.batch_dir.glob(f"*/{META_FILE}"):
+            try:
+                job = BatchJob(orjson.loads(meta_path.read_bytes()), self.batch_dir)
+            except Exception as e:
+                logger.warning(f"[Batch] 读取任务失败: {meta_path.parent.name} - {e}")
+                continue
+            self._jobs[job.id] = job
+            if job.meta["status"] in ACTIVE_STATUSES:
+                logger.info(f"[Batch] 恢复任务: {job.id}")
+                self._start(job)
+
+    async def shutdown(self) -> None:
+        """停止执行中的任务（状态保留，下次启动时恢复）"""
+        tasks = [job.task for job in self._jobs.values() if job.task and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _start(self, job: BatchJob) -> None:
+        job.task = asyncio.create_task(self._run(job))
+
+    @staticmethod
+    def _remove_dir(path: Path) -> None:
+        for child in path.iterdir():
+            child.unlink()
+        path.rmdir()
+
+    # === 调度 ===
+
+    def _concurrency(self, model: str) -> int:
+        """按当前可用Token数确定并发（每个可用Token一个请求），受配置上限约束"""
+        cached = self._capacity.get(model)
+        now = time.monotonic()
+        if cached is None or now - cached[1] > CAPACITY_TTL:
+            cached = (token_manager.available_count(model), now)
+            self._capacity[model] = cached
+        limit = setting.grok_config.get("batch_max_concurrency", 32)
+        return min(cached[0], limit)
+
+    def _backoff(self) -> None:
+        """遇到限流时暂停派发"""
+        delay = setting.grok_config.get("batch_retry_delay", 10)
+        self._backoff_until = max(self._backoff_until, time.monotonic() + delay)
+
+    @staticmethod
+    def _scan_output(job: BatchJob, output: Path) -> Set[int]:
+        """读取已写出的结果，返回已完成的输入行号并重算计数（用于重启续跑）"""
+        done = set()
+        counts = job.counts()
+        counts["completed"] = counts["failed"] = 0
+        if not output.exists():
+            return done
+        valid_end = 0
+        with open(output, "r+b") as f:
+            for line in f:
+                try:
+                    result = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    break  # 上次中断时写了一半的行，截断后重新执行
+                valid_end += len(line)
+                done.add(result["line"])
+                counts["completed" if result.get("error") is None else "failed"] += 1
+            f.truncate(valid_end)
+        return done
+
+    async def _wait_capacity(self, job: BatchJob, active: Set[asyncio.Task], model: str) -> bool:
+        """等待退避结束且并发低于可用Token数
+
+        任务被取消时立即返回False；持续无可用Token（且没有进行中的请求）超过
+        batch_pool_empty_timeout 秒时将任务标记为失败并返回False。
+        """
+        empty_timeout = setting.grok_config.get("batch_pool_empty_timeout", 600)
+        empty_since = None
+
+        while job.meta["status"] == STATUS_IN_PROGRESS:
+            active.difference_update([task for task in active if task.done()])
+            wait = self._backoff_until - time.monotonic()
+            capacity = self._concurrency(model)
+            if wait <= 0 and len(active) < capacity:
+                return True
+
+            timeout = wait if wait > 0 else POOL_EMPTY_WAIT
+            if capacity == 0 and not active:
+                now = time.monotonic()
+                empty_since = empty_since or now
+                left = empty_since + empty_timeout - now
+                if empty_timeout and left <= 0:
+                    job.meta["status"] = STATUS_FAILED
+                    job.meta["errors"] = {"message": f"无可用Token超过{empty_timeout}秒: {model}"}
+                    logger.warning(f"[Batch] 无可用Token，任务失败: {job.id} ({model})")
+                    return False
+                if empty_timeout:
+                    timeout = min(timeout, left)
+            else:
+                empty_since = None
+
+            cancelled = asyncio.ensure_future(job.cancel_event.wait())
+            try:
+                await asyncio.wait({*active, cancelled}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                cancelled.cancel()
+        return False
+
+    async def _run(self, job: BatchJob) -> None:
+        """执行任务：逐行读取输入，按可用Token数并发派发，结果由写出任务统一落盘"""
+        output = self.output_path(job)
+        done = await asyncio.to_thread(self._scan_output, job, output)
+        active: Set[asyncio.Task] = set()
+        results: asyncio.Queue = asyncio.Queue()
+        src = out = writer = None
+
+        try:
+            src = await asyncio.to_thread(open, job.dir / INPUT_FILE, "rb")
+            out = await asyncio.to_thread(open, output, "ab")
+            writer = asyncio.create_task(self._write_results(job, out, results))
+
+            line_no = 0
+            while job.meta["status"] == STATUS_IN_PROGRESS:
+                raw = await asyncio.to_thread(src.readline)
+                if not raw:
+                    break
+                if not raw.strip():
+                    continue
+                line_no += 1
+                if line_no in done:
+                    continue
+
+                item = self._parse_line(raw, line_no)
+                body, error = self._validate(item)
+                if error is not None:
+                    # 无效行不占用并发，直接写出错误结果
+                    results.put_nowait(self._result(item, None, {"code": "invalid_request", "message": error}))
+                    continue
+
+                if not await self._wait_capacity(job, active, body.model):
+                    break
+                active.add(asyncio.create_task(self._execute(item, body, results)))
+
+            if active:
+                await asyncio.gather(*active)
+
+            if job.meta["status"] != STATUS_FAILED:
+                job.meta["status"] = STATUS_CANCELLED if job.meta["status"] == STATUS_CANCELLING else STATUS_COMPLETED
+                job.meta["completed_at"] = int(time.time())
+            counts = job.counts()
+            logger.info(f"[Batch] 任务结束: {job.id} {job.meta['status']} (成功{counts['completed']}, 失败{counts['failed']})")
+
+        except asyncio.CancelledError:
+            for task in active:
+                task.cancel()
+            await asyncio.gather(*active, return_exceptions=True)
+            raise
+        except Exception as e:
+            logger.error(f"[Batch] 任务异常: {job.id} - {e}")
+            job.meta["status"] = STATUS_FAILED
+            job.meta["errors"] = {"message": str(e)}
+        finally:
+            if writer is not None:
+                # 写完已产生的结果再保存元数据，保证计数与输出文件一致
+                results.put_nowait(None)
+                await asyncio.gather(writer, return_exceptions=True)
+            for f in (src, out):
+                if f is not None:
+                    await asyncio.to_thread(f.close)
+            await asyncio.to_thread(job.save_meta)
+
+    async def _write_results(self, job: BatchJob, out, results: asyncio.Queue) -> None:
+        """结果写出任务：在线程中追加写入输出文件并更新计数，每 META_SAVE_EVERY 条保存一次元数据
+
+        队列中的 None 表示任务结束；同一时刻积压的结果合并为一次写入。
+        """
+        unsaved = 0
+        finished = False
+        while not finished:
+            records = [await results.get()]
+            while not results.empty():
+                records.append(results.get_nowait())
+            if records[-1] is None:
+                finished = True
+                records.pop()
+            if not records:
+                continue
+
+            await asyncio.to_thread(self._append, out, b"".join(orjson.dumps(record) + b"\n" for record in records))
+            counts = job.counts()
+            for record in records:
+                counts["completed" if record["error"] is None else "failed"] += 1
+
+            unsaved += len(records)
+            if unsaved >= META_SAVE_EVERY and not finished:
+                unsaved = 0
+                await asyncio.to_thread(job.save_meta)
+
+    @staticmethod
+    def _append(out, data: bytes) -> None:
+        out.write(data)
+        out.flush()
+
+    @staticmethod
+    def _parse_line(raw: bytes, line_no: int) -> Dict[str, Any]:
+        """解析输入行（格式错误时记录error，派发前写出错误结果）"""
+        try:
+            item = orjson.loads(raw)
+            if not isinstance(item, dict):
+                raise ValueError("not an object")
+        except Exception as e:
+            item = {"error": f"无效的JSON: {e}"}
+        item["line"] = line_no
+        return item
+
+    @staticmethod
+    def _validate(item: Dict[str, Any]) -> tuple:
+        """校验输入行，返回 (请求体, 错误信息)"""
+        if error := item.get("error"):
+            return None, error
+        if item.get("url", COMPLETION_URL) != COMPLETION_URL:
+            return None, f"不支持的接口: {item.get('url')}"
+        try:
+            return OpenAIChatRequest(**{**(item.get("body") or {}), "stream": False}), None
+        except Exception as e:
+            return None, f"无效的请求: {e}"
+
+    @staticmethod
+    def _result(item: Dict[str, Any], response: Optional[Dict[str, Any]], error: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": item.get("custom_id"),
+            "line": item["line"],
+            "response": response,
+            "error": error,
+        }
+
+    async def _execute(self, item: Dict[str, Any], body: OpenAIChatRequest, results: asyncio.Queue) -> None:
+        """执行单个请求并提交结果（限流时退避重试）"""
+        retries = setting.grok_config.get("batch_max_retries", 3)
+        response, error = None, None
+
+        attempt = 0
+        while True:
+            try:
+                result = await GrokClient.openai_to_grok(body.model_dump())
+                response = {"status_code": 200, "body": result.model_dump()}
+                break
+            except GrokApiException as e:
+                status = (e.context or {}).get("status")
+                if (e.error_code in RATE_LIMIT_CODES or status == 429) and attempt < retries:
+                    attempt += 1
+                    self._backoff()
+                    await asyncio.sleep(setting.grok_config.get("batch_retry_delay", 10))
+                    continue
+                response = {"status_code": e.status_code or 500, "body": None}
+                error = {"code": e.error_code or "grok_api_error", "message": e.message}
+                break
+            except Exception as e:
+                response = {"status_code": 500, "body": None}
+                error = {"code": "internal_error", "message": str(e)}
+                break
+
+        await request_stats.record_request(body.model, success=error is None)
+        results.put_nowait(self._result(item, response, error))
+
+
+# 全局实例
+batch_manager = BatchManager()
@@ -2,12 +2,15 @@
 
 import asyncio
 import base64
+import os
+import time
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 from curl_cffi.requests import AsyncSession
 
 from app.core.config import setting
 from app.core.logger import logger
+from app.services.grok import imaging
 from app.services.grok.statsig import get_dynamic_headers
 
 
@@ -17,7 +20,10 @@ MIME_TYPES = {
     '.gif': 'image/gif', '.webp': 'image/webp', '.bmp': 'image/bmp',
 }
 DEFAULT_MIME = 'image/jpeg'
-ASSETS_URL = "https://assets.grok.com"
+PART_SUFFIX = '.part'        # 下载中标记（写入完成后原子重命名为缓存文件）
+WAIT_POLL_INTERVAL = 0.1     # 等待其他进程下载时的轮询间隔（秒）
+DEFAULT_VARIANT_SIZES = [64, 128, 256, 512, 1024, 2048]  # 派生图宽高档位（像素）
+VARIANT_QUALITY_STEP = 10    # 派生图质量取整步长
 
 
 class CacheService:
@@ -29,6 +35,7 @@ class CacheService:
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         self.timeout = timeout
         self._cleanup_lock = asyncio.Lock()
+        self._inflight: Dict[str, asyncio.Task] = {}  # 缓存文件名 -> 进行中的下载（同一文件只下载一次）
 
     def _get_path(self, file_path: str) -> Path:
         """转换文件路径为缓存路径"""
@@ -53,13 +60,70 @@ class CacheService:
             "Cookie": f"{auth_token};{cf}" if cf else auth_token
         }
 
+    def prefetch(self, file_path: str, auth_token: str, timeout: Optional[float] = None) -> asyncio.Task:
+        """后台下载文件（已在下载时复用同一任务），任务独立于调用方，调用方结束后仍会完成"""
+        cache_path = self._get_path(file_path)
+        task = self._inflight.get(cache_path.name)
+        if task is None:
+            # 下载中标记，供其他进程的 /images 请求等待
+            if not cache_path.exists():
+                try:
+                    cache_path.with_name(cache_path.name + PART_SUFFIX).touch()
+                except OSError:
+                    pass
+            task = asyncio.create_task(self._download(file_path, auth_token, timeout))
+            self._inflight[cache_path.name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_path.name, None))
+        return task
+
     async def download(self, file_path: str, auth_token: str, timeout: Optional[float] = None) -> Optional[Path]:
-        """下载并缓存文件"""
+        """下载并缓存文件（等待中取消不会中断共享的下载任务）"""
         cache_path = self._get_path(file_path)
         if cache_path.exists():
             self._log("debug", "文件已缓存")
             return cache_path
+        return await asyncio.shield(self.prefetch(file_path, auth_token, timeout))
+
+    async def wait_cached(self, file_path: str, timeout: Optional[float] = None) -> Optional[Path]:
+        """读取缓存，文件仍在下载时等待下载完成（本进程等待下载任务，其他进程的下载按标记轮询）"""
+        cache_path = self._get_path(file_path)
+        if cache_path.exists():
+            return cache_path
+
+        timeout = timeout or self.timeout
+        if task := self._inflight.get(cache_path.name):
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        part = cache_path.with_name(cache_path.name + PART_SUFFIX)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if cache_path.exists():
+                return cache_path
+            try:
+                if time.time() - part.stat().st_mtime > timeout:
+                    return None  # 遗留的标记（下载进程已退出）
+            except FileNotFoundError:
+                return cache_path if cache_path.exists() else None
+            await asyncio.sleep(WAIT_POLL_INTERVAL)
+        return None
 
+    async def _download(self, file_path: str, auth_token: str, timeout: Optional[float] = None) -> Optional[Path]:
+        """下载文件写入缓存（写入临时文件后原子重命名，读取方不会读到不完整的文件）"""
+        cache_path = self._get_path(file_path)
+        if cache_path.exists():
+            return cache_path
+        part = cache_path.with_name(cache_path.name + PART_SUFFIX)
+        try:
+            return await self._fetch(file_path, auth_token, cache_path, part, timeout)
+        finally:
+            part.unlink(missing_ok=True)
+
+    async def _fetch(self, file_path: str, auth_token: str, cache_path: Path, part: Path,
+                     timeout: Optional[float] = None) -> Optional[Path]:
+        """请求上游并写入缓存（含重试）"""
         # 外层重试：可配置状态码（401/429等）
         retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
         MAX_OUTER_RETRY = 3
@@ -78,7 +142,7 @@ class CacheService:
                         self._log("debug", f"使用代理: {proxy.split('@')[-1] if '@' in proxy else proxy}")
 
                     async with AsyncSession() as session:
-                        url = f"{ASSETS_URL}{file_path}"
+                        url = setting.assets_url(file_path)
                         if outer_retry == 0 and retry_403_count == 0:
                             self._log("debug", f"下载: {url}")
                         
@@ -115,7 +179,8 @@ class CacheService:
                                 return None
                         
                         response.raise_for_status()
-                        await asyncio.to_thread(cache_path.write_bytes, response.content)
+                        await asyncio.to_thread(part.write_bytes, response.content)
+                        await asyncio.to_thread(os.replace, part, cache_path)
                         
                         if outer_retry > 0 or retry_403_count > 0:
                             self._log("info", f"重试成功！")
@@ -161,7 +226,7 @@ class CacheService:
 
                 # 获取文件信息 (path, size, mtime)
                 files = [(f, (s := f.stat()).st_size, s.st_mtime) 
-                        for f in self.cache_dir.glob("*") if f.is_file()]
+                        for f in self.cache_dir.glob("*") if f.is_file() and f.suffix != PART_SUFFIX]
                 total = sum(size for _, size, _ in files)
 
                 if total <= max_bytes:
@@ -213,7 +278,7 @@ class ImageCache(CacheService):
             if not cache_path:
                 return None
 
-            result = self.to_base64(cache_path)
+            result = await asyncio.to_thread(self.to_base64, cache_path)
             
             # 清理临时文件
             try:
@@ -227,6 +292,76 @@ class ImageCache(CacheService):
             return None
 
 
+class ImageVariantCache(CacheService):
+    """图片派生版本缓存（缩放/转码）
+
+    派生图在进程池中生成，与原图分目录存放并使用独立的容量上限（image_variant_cache_max_size_mb）；
+    命中时刷新修改时间，超限时按最久未使用清理。
+    """
+
+    def __init__(self):
+        super().__init__("image_variant")
+
+    @staticmethod
+    def quantize(width: int, height: int, quality: Optional[int]) -> Tuple[int, int, Optional[int]]:
+        """派生参数归档到有限档位，限制单张原图可生成的派生图数量
+
+        宽高向上取到 image_variant_sizes 中的档位（超出最大档位按最大档位），质量按 VARIANT_QUALITY_STEP 取整。
+        """
+        sizes = sorted(int(size) for size in setting.global_config.get("image_variant_sizes", DEFAULT_VARIANT_SIZES))
+
+        def snap(value: int) -> int:
+            if not value or not sizes:
+                return value
+            return next((size for size in sizes if size >= value), sizes[-1])
+
+        if quality is not None:
+            quality = max(VARIANT_QUALITY_STEP, round(quality / VARIANT_QUALITY_STEP) * VARIANT_QUALITY_STEP)
+        return snap(width), snap(height), quality
+
+    @staticmethod
+    def negotiate(fmt: Optional[str], accept: str, resize: bool) -> Optional[str]:
+        """确定输出格式：显式格式优先；auto、缩放请求或开启 image_auto_format 时按 Accept 选择 avif/webp
+
+        Returns:
+            格式名，None 表示保持原格式
+        """
+        if fmt and fmt != "auto":
+            return fmt if imaging.supports(fmt) else None
+        if fmt == "auto" or resize or setting.global_config.get("image_auto_format", False):
+            for candidate in ("avif", "webp"):
+                if f"image/{candidate}" in accept and imaging.supports(candidate):
+                    return candidate
+        return None
+
+    async def get_variant(self, source: Path, width: int, height: int, fmt: Optional[str],
+                          quality: Optional[int] = None) -> Tuple[Path, str]:
+        """获取（必要时生成）派生图
+
+        Returns:
+            (文件路径, MIME)
+        """
+        fmt = fmt or imaging.SUFFIX_FORMATS.get(source.suffix.lower(), "jpeg")
+        quality = quality or int(setting.global_config.get("image_variant_quality", 80))
+        path = self.cache_dir / f"{source.name}.{width}x{height}q{quality}.{fmt}"
+        mime = imaging.FORMATS[fmt][1]
+
+        if path.exists():
+            os.utime(path)
+            return path, mime
+
+        task = self._inflight.get(path.name)
+        if task is None:
+            task = asyncio.create_task(
+                imaging.run(imaging.render_variant, str(source), str(path), width, height, fmt, quality)
+            )
+            self._inflight[path.name] = task
+            task.add_done_callback(lambda _: self._inflight.pop(path.name, None))
+            task.add_done_callback(lambda _: asyncio.create_task(self._safe_cleanup()))
+        await asyncio.shield(task)
+        return path, mime
+
+
 class VideoCache(CacheService):
     """视频缓存服务"""
 
@@ -240,4 +375,5 @@ class VideoCache(CacheService):
 
 # 全局实例
 image_cache_service = ImageCache()
+image_variant_service = ImageVariantCache()
 video_cache_service = VideoCache()
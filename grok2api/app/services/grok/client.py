@@ -1,27 +1,141 @@
 """Grok API 客户端 - 处理OpenAI到Grok的请求转换和响应处理"""
 
 import asyncio
+import time
+import uuid
 import orjson
-from typing import Dict, List, Tuple, Any, Optional
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Tuple, Any, Optional, Union
 from curl_cffi.requests import AsyncSession as curl_AsyncSession
 
 from app.core.config import setting
 from app.core.logger import logger
 from app.models.grok_models import Models
+from app.models.openai_schema import OpenAIChatCompletionResponse
+from app.services.grok.conversation import (
+    ConversationTurn, conversation_store, split_turn, CONTINUE_PATH
+)
+from app.services.grok.delta import Delta, DeltaStream, DELTA_ERROR, DELTA_FINISH
 from app.services.grok.processer import GrokResponseProcessor
 from app.services.grok.statsig import get_dynamic_headers
-from app.services.grok.token import token_manager
-from app.services.grok.upload import ImageUploadManager
+from app.services.grok.token import token_manager, TokenLease
+from app.services.grok.upload import ImageUploadManager, PreparedImage
 from app.services.grok.create import PostCreateManager
 from app.core.exception import GrokApiException
 
 
 # 常量
-API_ENDPOINT = "https://grok.com/rest/app-chat/conversations/new"
+API_PATH = "/rest/app-chat/conversations/new"
 TIMEOUT = 120
 BROWSER = "chrome133a"
 MAX_RETRY = 3
 MAX_UPLOADS = 20  # 提高并发上传限制以支持更高并发
+CONTINUE_FALLBACK_CODES = ("HTTP_ERROR", "NETWORK_ERROR", "MAX_RETRIES_EXCEEDED", "NO_RESPONSE", "API_ERROR")
+FAN_OUT_BUFFER_SIZE = 64  # 多候选流合并输出的缓冲块数
+
+
+class FailoverStream(DeltaStream):
+    """流式超时换Token包装：首次响应超时（上游未返回任何数据）时，换Token重新发起请求"""
+
+    def __init__(self, stream, reopen: Callable[[bool], Awaitable[Any]], failovers: int, model: str):
+        super().__init__()
+        self._stream = stream
+        self._reopen = reopen
+        self._failovers = failovers
+        self._model = model
+        self._deltas = self._iter_deltas()
+
+    def deltas(self) -> AsyncIterator[Delta]:
+        return self._deltas
+
+    async def _iter_deltas(self) -> AsyncGenerator[Delta, None]:
+        while True:
+            try:
+                async for delta in self._stream.deltas():
+                    yield delta
+                return
+            except GrokApiException as e:
+                if e.error_code != "STREAM_TIMEOUT":
+                    raise
+                reason = e.message
+
+            await self._stream.aclose()
+            self._failovers -= 1
+            logger.warning(f"[Client] {reason}，切换Token重试 (剩余{self._failovers}次)")
+            try:
+                self._stream = await self._reopen(self._failovers > 0)
+            except GrokApiException as e:
+                logger.error(f"[Client] 超时切换失败: {e.message}")
+                yield Delta(DELTA_ERROR, f"处理错误: {e.message}", self._model, finish="error", code=e.error_code)
+                return
+
+    async def aclose(self) -> None:
+        """关闭当前上游流"""
+        try:
+            await self._close_sse()
+            await self._deltas.aclose()
+        except RuntimeError:
+            pass
+        finally:
+            await self._stream.aclose()
+
+
+class FanOutStream(DeltaStream):
+    """多候选流：并发读取各候选的上游流，增量事件按候选序号标记 index 后交错合并
+
+    直接迭代时输出共用同一 id 的SSE块，全部候选结束后输出一次 [DONE]。
+    """
+
+    def __init__(self, streams: List[DeltaStream], model: str):
+        super().__init__(len(streams))
+        self._streams = streams
+        self._model = model
+        self._tasks: List[asyncio.Task] = []
+        self._deltas = self._merge()
+
+    def deltas(self) -> AsyncIterator[Delta]:
+        return self._deltas
+
+    async def _merge(self) -> AsyncGenerator[Delta, None]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=FAN_OUT_BUFFER_SIZE)
+
+        async def pump(index: int, stream: DeltaStream) -> None:
+            finished = False
+            try:
+                async for delta in stream.deltas():
+                    delta.index = index
+                    finished = finished or delta.kind in (DELTA_FINISH, DELTA_ERROR)
+                    await queue.put(delta)
+            except GrokApiException as e:
+                logger.warning(f"[Client] 候选{index}处理失败: {e.message}")
+                await queue.put(Delta(DELTA_ERROR, f"处理错误: {e.message}", self._model, finish="error",
+                                      code=e.error_code, index=index))
+                finished = True
+            if not finished:
+                # 上游未给出结束事件时补齐，保证 [DONE] 按候选数输出
+                await queue.put(Delta(DELTA_FINISH, model=self._model, finish="stop", index=index))
+            await queue.put(None)
+
+        self._tasks = [asyncio.create_task(pump(i, stream)) for i, stream in enumerate(self._streams)]
+        pending = len(self._tasks)
+        while pending:
+            delta = await queue.get()
+            if delta is None:
+                pending -= 1
+                continue
+            yield delta
+
+    async def aclose(self) -> None:
+        """关闭全部候选的上游流"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            await self._close_sse()
+            await self._deltas.aclose()
+        except RuntimeError:
+            pass
+        finally:
+            await asyncio.gather(*(stream.aclose() for stream in self._streams), return_exceptions=True)
 
 
 class GrokClient:
@@ -43,7 +157,8 @@ class GrokClient:
     async def openai_to_grok(request: dict):
         """转换OpenAI请求为Grok请求"""
         model = request["model"]
-        content, images = GrokClient._extract_content(request["messages"])
+        messages = request["messages"]
+        content, images = GrokClient._extract_content(messages)
         stream = request.get("stream", False)
         
         # 获取模型信息
@@ -55,17 +170,149 @@ class GrokClient:
         if is_video and len(images) > 1:
             logger.warning(f"[Client] 视频模型仅支持1张图片，已截取前1张")
             images = images[:1]
-        
-        return await GrokClient._retry(model, content, images, grok_model, mode, is_video, stream)
+
+        failovers = setting.grok_config.get("stream_timeout_failover", 1) if stream else 0
+        n = request.get("n") or 1
+        if n > 1:
+            # 多候选各自新开会话，不参与会话亲和
+            return await GrokClient._fan_out(n, model, content, images, grok_model, mode, is_video, stream, failovers)
+
+        # 会话亲和：消息前缀命中已有上游会话时只发送新增消息
+        affinity = conversation_store.enabled() and not is_video
+        turn = conversation_store.begin(messages) if affinity else None
+
+        result = None
+        if turn and turn.ref:
+            result = await GrokClient._continue(turn, model, grok_model, mode, stream, failovers > 0, len(content.encode()))
+        if result is None:
+            if turn:
+                turn.ref = None
+            result = await GrokClient._retry(model, content, images, grok_model, mode, is_video, stream, failovers > 0, turn)
+        if failovers > 0:
+            async def reopen(failover: bool):
+                # 换Token后无法续聊原会话，完整重放
+                retry_turn = ConversationTurn(messages) if affinity else None
+                return await GrokClient._retry(model, content, images, grok_model, mode, is_video, True, failover, retry_turn)
+            return FailoverStream(result, reopen, failovers, model)
+        return result
 
     @staticmethod
-    async def _retry(model: str, content: str, images: List[str], grok_model: str, mode: str, is_video: bool, stream: bool):
+    async def _fan_out(n: int, model: str, content: str, images: List[str], grok_model: str, mode: str,
+                       is_video: bool, stream: bool, failovers: int):
+        """多候选：图片只下载/规范化一次，并发发起n个上游会话（按负载分配到不同Token）并合并结果
+
+        上游文件归属上传账号，各候选仍需用各自的Token上传。部分候选失败时返回成功的候选，全部失败时抛出首个错误。
+        """
+        prepared = await GrokClient._prepare_images(images)
+
+        async def candidate():
+            result = await GrokClient._retry(model, content, prepared, grok_model, mode, is_video, stream, failovers > 0)
+            if failovers > 0:
+                async def reopen(failover: bool):
+                    return await GrokClient._retry(model, content, prepared, grok_model, mode, is_video, True, failover)
+                return FailoverStream(result, reopen, failovers, model)
+            return result
+
+        results = await asyncio.gather(*(candidate() for _ in range(n)), return_exceptions=True)
+        succeeded = [r for r in results if not isinstance(r, BaseException)]
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if not succeeded:
+            raise errors[0]
+        for i, result in enumerate(results):
+            if isinstance(result, BaseException):
+                logger.warning(f"[Client] 多候选部分失败: 候选{i} ({len(errors)}/{n}) - {result}")
+
+        if stream:
+            return FanOutStream(succeeded, model)
+        return GrokClient._merge_responses(succeeded)
+
+    @staticmethod
+    def _merge_responses(responses: List[OpenAIChatCompletionResponse]) -> OpenAIChatCompletionResponse:
+        """合并多个候选的非流式响应：新建响应对象，choices 按顺序重新编号，usage 逐项求和"""
+        usage = None
+        for response in responses:
+            for key, value in (response.usage or {}).items():
+                if isinstance(value, (int, float)):
+                    usage = usage or {}
+                    usage[key] = usage.get(key, 0) + value
+
+        return OpenAIChatCompletionResponse(
+            id=f"chatcmpl-{uuid.uuid4()}",
+            created=int(time.time()),
+            model=responses[0].model,
+            choices=[choice.model_copy(update={"index": i})
+                     for i, response in enumerate(responses) for choice in response.choices[:1]],
+            usage=usage,
+        )
+
+    @staticmethod
+    async def _prepare_images(images: List[str]) -> List[PreparedImage]:
+        """并发准备图片上传数据（下载与规范化只做一次，失败的图片跳过）"""
+        async def prepare_limited(image):
+            async with GrokClient._get_upload_semaphore():
+                return await ImageUploadManager.prepare(image)
+
+        results = await asyncio.gather(*(prepare_limited(image) for image in images), return_exceptions=True)
+        prepared = []
+        for result in results:
+            if isinstance(result, PreparedImage):
+                prepared.append(result)
+            elif isinstance(result, Exception):
+                logger.warning(f"[Client] 图片准备失败: {result}")
+        return prepared
+
+    @staticmethod
+    async def _continue(turn: ConversationTurn, model: str, grok_model: str, mode: str, stream: bool,
+                        failover: bool, full_size: int):
+        """在已有上游会话中续聊（使用会话所属Token，只发送新增消息）
+
+        Returns:
+            响应结果；会话Token不可用或续聊失败时返回None，由调用方完整重放
+        """
+        ref = turn.ref
+        lease = await token_manager.acquire_sso(ref.sso, model)
+        if lease is None:
+            conversation_store.record_fallback(ref, "会话Token不可用")
+            return None
+
+        try:
+            _, new_messages = split_turn(turn.messages)
+            content, images = GrokClient._extract_content(new_messages, len(new_messages) > 1)
+            img_ids, img_uris = await GrokClient._upload(images, lease.auth_token)
+
+            payload = GrokClient._build_payload(content, grok_model, mode, img_ids, img_uris)
+            payload["parentResponseId"] = ref.response_id
+            path = CONTINUE_PATH.format(conversation_id=ref.conversation_id)
+            result = await GrokClient._request(payload, lease, model, stream, failover=failover, turn=turn, path=path)
+
+            if not stream:
+                lease.release()
+            conversation_store.record_payload(len(content.encode()), full_size)
+            logger.debug(f"[Client] 续聊会话: {ref.conversation_id}")
+            return result
+
+        except GrokApiException as e:
+            lease.release()
+            if e.error_code not in CONTINUE_FALLBACK_CODES:
+                raise
+            conversation_store.record_fallback(ref, e.message)
+            return None
+
+        except Exception:
+            lease.release()
+            raise
+
+    @staticmethod
+    async def _retry(model: str, content: str, images: List[Union[str, PreparedImage]], grok_model: str, mode: str, is_video: bool, stream: bool,
+                     failover: bool = False, turn: Optional[ConversationTurn] = None):
         """重试请求"""
         last_err = None
 
         for i in range(MAX_RETRY):
+            lease = None
             try:
-                token = await token_manager.get_token(model)
+                lease = await token_manager.acquire(model)
+                token = lease.auth_token
                 img_ids, img_uris = await GrokClient._upload(images, token)
 
                 # 视频模型创建会话
@@ -74,9 +321,16 @@ class GrokClient:
                     post_id = await GrokClient._create_post(img_ids[0], img_uris[0], token)
 
                 payload = GrokClient._build_payload(content, grok_model, mode, img_ids, img_uris, is_video, post_id)
-                return await GrokClient._request(payload, token, model, stream, post_id)
+                result = await GrokClient._request(payload, lease, model, stream, post_id, failover, turn)
+
+                # 流式租约由流句柄关闭时释放
+                if not stream:
+                    lease.release()
+                return result
 
             except GrokApiException as e:
+                if lease:
+                    lease.release()
                 last_err = e
                 # 检查是否可重试
                 if e.error_code not in ["HTTP_ERROR", "NO_AVAILABLE_TOKEN"]:
@@ -92,11 +346,16 @@ class GrokClient:
                     logger.warning(f"[Client] 失败(状态:{status}), 重试 {i+1}/{MAX_RETRY}")
                     await asyncio.sleep(0.5)
 
+            except Exception:
+                if lease:
+                    lease.release()
+                raise
+
         raise last_err or GrokApiException("请求失败", "REQUEST_ERROR")
 
     @staticmethod
-    def _extract_content(messages: List[Dict]) -> Tuple[str, List[str]]:
-        """提取文本和图片，保留角色结构"""
+    def _extract_content(messages: List[Dict], with_roles: bool = True) -> Tuple[str, List[str]]:
+        """提取文本和图片，保留角色结构（with_roles=False 时不加角色前缀）"""
         formatted_messages = []
         images = []
 
@@ -127,14 +386,14 @@ class GrokClient:
             # 合并该消息的文本并添加角色前缀
             msg_text = "".join(text_parts).strip()
             if msg_text:
-                formatted_messages.append(f"{role_prefix}：{msg_text}")
+                formatted_messages.append(f"{role_prefix}：{msg_text}" if with_roles else msg_text)
         
         # 用换行符连接所有消息
         return "\n".join(formatted_messages), images
 
     @staticmethod
-    async def _upload(urls: List[str], token: str) -> Tuple[List[str], List[str]]:
-        """并发上传图片"""
+    async def _upload(urls: List[Union[str, PreparedImage]], token: str) -> Tuple[List[str], List[str]]:
+        """并发上传图片（Base64、URL或已准备的图片）"""
         if not urls:
             return [], []
         
@@ -147,7 +406,7 @@ class GrokClient:
         ids, uris = [], []
         for url, result in zip(urls, results):
             if isinstance(result, Exception):
-                logger.warning(f"[Client] 上传失败: {url} - {result}")
+                logger.warning(f"[Client] 上传失败: {getattr(url, 'filename', url)} - {result}")
             elif isinstance(result, tuple) and len(result) == 2:
                 fid, furi = result
                 if fid:
@@ -172,7 +431,7 @@ class GrokClient:
         """构建请求载荷"""
         # 视频模型特殊处理
         if is_video and img_uris:
-            img_msg = f"https://grok.com/imagine/{post_id}" if post_id else f"https://assets.grok.com/post/{img_uris[0]}"
+            img_msg = f"https://grok.com/imagine/{post_id}" if post_id else setting.assets_url(f"post/{img_uris[0]}")
             return {
                 "temporary": True,
                 "modelName": "grok-3",
@@ -209,10 +468,12 @@ class GrokClient:
         }
 
     @staticmethod
-    async def _request(payload: dict, token: str, model: str, stream: bool, post_id: str = None):
-        """发送请求"""
-        if not token:
+    async def _request(payload: dict, lease: TokenLease, model: str, stream: bool, post_id: str = None, failover: bool = False,
+                       turn: Optional[ConversationTurn] = None, path: str = API_PATH):
+        """发送请求（path 为续聊接口时向已有会话追加消息）"""
+        if not lease:
             raise GrokApiException("认证令牌缺失", "NO_AUTH_TOKEN")
+        token = lease.auth_token
 
         # 外层重试：可配置状态码（401/429等）
         retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
@@ -227,17 +488,19 @@ class GrokClient:
                 # 异步获取代理
                 from app.core.proxy_pool import proxy_pool
                 
-                # 如果是403重试且使用代理池，强制刷新代理
-                if retry_403_count > 0 and proxy_pool._enabled:
+                # 如果是403重试且代理可轮换，作废本次租约所属的那一代代理
+                if retry_403_count > 0 and proxy_pool.rotatable:
                     logger.info(f"[Client] 403重试 {retry_403_count}/{max_403_retries}，刷新代理...")
-                    proxy = await proxy_pool.force_refresh()
+                    proxy_lease = await proxy_pool.invalidate(proxy_lease, lease.sso)
                 else:
-                    proxy = await setting.get_proxy_async("service")
+                    # 同一Token固定使用同一代理
+                    proxy_lease = await proxy_pool.acquire(lease.sso)
+                proxy = proxy_lease.url
                 
                 proxies = {"http": proxy, "https": proxy} if proxy else None
                 
                 # 构建请求头（放在循环内以支持重试新Token）
-                headers = GrokClient._build_headers(token)
+                headers = GrokClient._build_headers(token, path)
                 if model == "grok-imagine-0.9":
                     file_attachments = payload.get("fileAttachments", [])
                     ref_id = post_id or (file_attachments[0] if file_attachments else "")
@@ -246,9 +509,10 @@ class GrokClient:
 
                 # 创建会话并执行请求
                 session = curl_AsyncSession(impersonate=BROWSER)
+                started = asyncio.get_event_loop().time()
                 try:
                     response = await session.post(
-                        API_ENDPOINT,
+                        setting.grok_url(path),
                         headers=headers,
                         data=orjson.dumps(payload),
                         timeout=TIMEOUT,
@@ -256,8 +520,12 @@ class GrokClient:
                         proxies=proxies
                     )
                     
-                    # 内层403重试：仅当有代理池时触发
-                    if response.status_code == 403 and proxy_pool._enabled:
+                    if response.status_code != 403:
+                        proxy_pool.report(proxy, response.status_code < 500,
+                                          asyncio.get_event_loop().time() - started)
+
+                    # 内层403重试：仅当代理可轮换时触发
+                    if response.status_code == 403 and proxy_pool.rotatable:
                         retry_403_count += 1
                         if retry_403_count <= max_403_retries:
                             logger.warning(f"[Client] 遇到403错误，正在重试 ({retry_403_count}/{max_403_retries})...")
@@ -277,14 +545,20 @@ class GrokClient:
                         else:
                             logger.error(f"[Client] {response.status_code}错误，已重试{outer_retry}次，放弃")
                             try:
-                                GrokClient._handle_error(response, token)
+                                GrokClient._handle_error(response, token, lease.generation, model)
                             finally:
                                 await session.close()
                     
+                    # 续聊会话不存在或已失效：不计入Token失败，由调用方回退完整重放
+                    if path != API_PATH and response.status_code in (400, 404):
+                        await session.close()
+                        raise GrokApiException(f"会话不可用: {response.status_code}", "HTTP_ERROR",
+                                               {"status": response.status_code})
+
                     # 检查其他响应状态
                     if response.status_code != 200:
                         try:
-                            GrokClient._handle_error(response, token)
+                            GrokClient._handle_error(response, token, lease.generation, model)
                         finally:
                             await session.close()
                     
@@ -296,21 +570,25 @@ class GrokClient:
                     
                     # 处理响应
                     if stream:
-                        # 流式响应由迭代器负责关闭 session
-                        result = GrokResponseProcessor.process_stream(response, token, session)
+                        # 流式响应由流句柄负责关闭 session 并释放租约
+                        result = GrokResponseProcessor.process_stream(response, lease, session, started, failover, turn)
                     else:
                         # 普通响应处理完立即关闭 session
                         try:
-                            result = await GrokResponseProcessor.process_normal(response, token, model)
+                            result = await GrokResponseProcessor.process_normal(response, lease, model, started, turn)
                         finally:
                             await session.close()
                     
                     asyncio.create_task(GrokClient._update_limits(token, model))
                     return result
                     
+                except GrokApiException:
+                    # 抛出前已关闭会话（curl会话重复关闭会报错）
+                    raise
                 except Exception as e:
                     await session.close()
                     if "RequestsError" in str(type(e)):
+                        proxy_pool.report(proxy, False)
                         logger.error(f"[Client] 网络错误: {e}")
                         raise GrokApiException(f"网络错误: {e}", "NETWORK_ERROR") from e
                     raise
@@ -319,16 +597,16 @@ class GrokClient:
 
 
     @staticmethod
-    def _build_headers(token: str) -> Dict[str, str]:
+    def _build_headers(token: str, path: str = API_PATH) -> Dict[str, str]:
         """构建请求头"""
-        headers = get_dynamic_headers("/rest/app-chat/conversations/new")
+        headers = get_dynamic_headers(path)
         cf = setting.grok_config.get("cf_clearance", "")
         headers["Cookie"] = f"{token};{cf}" if cf else token
         return headers
 
     @staticmethod
-    def _handle_error(response, token: str):
-        """处理错误"""
+    def _handle_error(response, token: str, generation: Optional[int] = None, model: Optional[str] = None):
+        """处理错误（429只冷却该模型所属的限额桶）"""
         if response.status_code == 403:
             msg = "您的IP被拦截，请尝试以下方法之一: 1.更换IP 2.使用代理 3.配置CF值"
             data = {"cf_blocked": True, "status": 403}
@@ -341,8 +619,8 @@ class GrokClient:
                 data = response.text
                 msg = data[:200] if data else "未知错误"
         
-        asyncio.create_task(token_manager.record_failure(token, response.status_code, msg))
-        asyncio.create_task(token_manager.apply_cooldown(token, response.status_code))
+        asyncio.create_task(token_manager.record_failure(token, response.status_code, msg, generation))
+        asyncio.create_task(token_manager.apply_cooldown(token, response.status_code, generation, model))
         raise GrokApiException(
             f"请求失败: {response.status_code} - {msg}",
             "HTTP_ERROR",
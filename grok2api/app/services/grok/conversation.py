@@ -0,0 +1,168 @@
+"""Grok 会话亲和 - 将消息前缀映射到上游会话，后续轮次只发送新增消息"""
+
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from app.core.config import setting
+from app.core.logger import logger
+
+
+# 常量
+CONTINUE_PATH = "/rest/app-chat/conversations/{conversation_id}/responses"
+THINK_PATTERN = re.compile(r"<think>.*?</think>", re.S)
+SPACE_PATTERN = re.compile(r"\s+")
+
+
+@dataclass(slots=True)
+class ConversationRef:
+    """上游会话引用"""
+    conversation_id: str
+    response_id: str                 # 上一轮模型回复ID（续聊时作为 parentResponseId）
+    sso: str                         # 会话所属Token
+    expires_at: float = 0.0
+
+
+def _message_parts(msg: Dict[str, Any]) -> Tuple[str, List[str]]:
+    """消息文本与图片地址"""
+    content = msg.get("content") or ""
+    if not isinstance(content, list):
+        return str(content), []
+    texts, images = [], []
+    for item in content:
+        if item.get("type") == "text":
+            texts.append(item.get("text", ""))
+        elif item.get("type") == "image_url":
+            if url := item.get("image_url", {}).get("url"):
+                images.append(url)
+    return "".join(texts), images
+
+
+def prefix_key(messages: List[Dict[str, Any]]) -> str:
+    """消息前缀的规范化哈希
+
+    助手消息去掉 <think> 思考过程，所有文本折叠空白，避免客户端回传时的格式差异导致未命中。
+    """
+    canonical = []
+    for msg in messages:
+        role = msg.get("role", "user")
+        text, images = _message_parts(msg)
+        if role == "assistant":
+            text = THINK_PATTERN.sub("", text)
+        canonical.append((role, SPACE_PATTERN.sub(" ", text).strip(), images))
+    return hashlib.blake2b(orjson.dumps(canonical), digest_size=16).hexdigest()
+
+
+def split_turn(messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """按最后一条助手消息切分为 (已有前缀, 新增消息)"""
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("role") == "assistant":
+            return messages[:i + 1], messages[i + 1:]
+    return [], messages
+
+
+class ConversationTurn:
+    """一次对话请求的会话上下文
+
+    续聊时 ref 为命中的上游会话；流处理成功结束后调用 complete() 记录本轮回复，
+    下一轮请求携带该回复时即可命中。
+    """
+
+    def __init__(self, messages: List[Dict[str, Any]], ref: Optional[ConversationRef] = None):
+        self.messages = messages
+        self.ref = ref
+
+    def complete(self, conversation_id: Optional[str], response_id: Optional[str], sso: str, replies: List[str]) -> None:
+        """记录本轮会话（replies 为客户端可能回传的回复文本，如最终回复与流式拼接文本）"""
+        conversation_id = conversation_id or (self.ref.conversation_id if self.ref else None)
+        if not conversation_id or not response_id:
+            return
+        ref = ConversationRef(conversation_id, response_id, sso)
+        keys = {prefix_key(self.messages + [{"role": "assistant", "content": reply}]) for reply in replies}
+        for key in keys:
+            conversation_store.put(key, ref)
+
+
+class ConversationStore:
+    """会话映射存储（单例，LRU + TTL）"""
+
+    _instance: Optional['ConversationStore'] = None
+
+    def __new__(cls) -> 'ConversationStore':
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        self._entries: "OrderedDict[str, ConversationRef]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "fallbacks": 0, "bytes_sent": 0, "bytes_saved": 0}
+        self._initialized = True
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(setting.grok_config.get("conversation_affinity", True))
+
+    def get(self, key: str) -> Optional[ConversationRef]:
+        """查找会话（过期则删除）"""
+        ref = self._entries.get(key)
+        if ref is None:
+            return None
+        if ref.expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return ref
+
+    def put(self, key: str, ref: ConversationRef) -> None:
+        """记录会话（超出容量时淘汰最久未使用的映射）"""
+        ref.expires_at = time.time() + setting.grok_config.get("conversation_ttl", 3600)
+        self._entries[key] = ref
+        self._entries.move_to_end(key)
+        max_entries = max(setting.grok_config.get("conversation_cache_size", 10000), 1)
+        while len(self._entries) > max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, ref: ConversationRef) -> None:
+        """删除指向该会话的所有映射（续聊失败时调用）"""
+        for key in [k for k, v in self._entries.items() if v.conversation_id == ref.conversation_id]:
+            del self._entries[key]
+
+    def begin(self, messages: List[Dict[str, Any]]) -> ConversationTurn:
+        """查找消息前缀对应的上游会话，返回本轮会话上下文"""
+        prefix, _ = split_turn(messages)
+        ref = self.get(prefix_key(prefix)) if prefix else None
+        if prefix:
+            self._stats["hits" if ref else "misses"] += 1
+        return ConversationTurn(messages, ref)
+
+    def record_payload(self, sent: int, full: int) -> None:
+        """记录续聊发送的字节数与相比完整重放节省的字节数"""
+        self._stats["bytes_sent"] += sent
+        self._stats["bytes_saved"] += max(full - sent, 0)
+
+    def record_fallback(self, ref: ConversationRef, reason: str) -> None:
+        """续聊失败回退为完整重放"""
+        self._stats["fallbacks"] += 1
+        self.invalidate(ref)
+        logger.info(f"[Conversation] 续聊失败，回退完整重放: {reason}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """会话亲和统计"""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self._entries),
+            "hit_rate": round(self._stats["hits"] / lookups * 100, 1) if lookups else 0,
+        }
+
+
+# 全局实例
+conversation_store = ConversationStore()
@@ -12,7 +12,7 @@ from app.core.logger import logger
 
 
 # 常量
-ENDPOINT = "https://grok.com/rest/media/post/create"
+ENDPOINT_PATH = "/rest/media/post/create"
 TIMEOUT = 30
 BROWSER = "chrome133a"
 
@@ -41,7 +41,7 @@ class PostCreateManager:
         try:
             # 构建请求
             data = {
-                "media_url": f"https://assets.grok.com/{file_uri}",
+                "media_url": setting.assets_url(file_uri),
                 "media_type": "MEDIA_POST_TYPE_IMAGE"
             }
             
@@ -64,19 +64,20 @@ class PostCreateManager:
                     # 异步获取代理（支持代理池）
                     from app.core.proxy_pool import proxy_pool
                     
-                    # 如果是403重试且使用代理池，强制刷新代理
-                    if retry_403_count > 0 and proxy_pool._enabled:
+                    # 如果是403重试且代理可轮换，作废本次租约所属的那一代代理
+                    if retry_403_count > 0 and proxy_pool.rotatable:
                         logger.info(f"[PostCreate] 403重试 {retry_403_count}/{max_403_retries}，刷新代理...")
-                        proxy = await proxy_pool.force_refresh()
+                        proxy_lease = await proxy_pool.invalidate(proxy_lease, None)
                     else:
-                        proxy = await setting.get_proxy_async("service")
+                        proxy_lease = await proxy_pool.acquire(None)
+                    proxy = proxy_lease.url
                     
                     proxies = {"http": proxy, "https": proxy} if proxy else None
 
                     # 发送请求
                     async with AsyncSession() as session:
                         response = await session.post(
-                            ENDPOINT,
+                            setting.grok_url(ENDPOINT_PATH),
                             headers=headers,
                             json=data,
                             impersonate=BROWSER,
@@ -84,8 +85,8 @@ class PostCreateManager:
                             proxies=proxies
                         )
 
-                        # 内层403重试：仅当有代理池时触发
-                        if response.status_code == 403 and proxy_pool._enabled:
+                        # 内层403重试：仅当代理可轮换时触发
+                        if response.status_code == 403 and proxy_pool.rotatable:
                             retry_403_count += 1
                             
                             if retry_403_count <= max_403_retries:
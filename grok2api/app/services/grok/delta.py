@@ -0,0 +1,167 @@
+"""Grok 增量事件 - 上游响应的类型化中间表示，供SSE、非流式与MCP共用"""
+
+import time
+import uuid
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional, Tuple
+
+import orjson
+
+from app.core.config import setting
+from app.core.exception import GrokApiException
+
+
+# 增量类型
+DELTA_TEXT = "text"                      # 正文
+DELTA_THINKING = "thinking"              # 思考过程（含搜索结果）
+DELTA_IMAGE = "image"                    # 生成图片（Markdown）
+DELTA_VIDEO_PROGRESS = "video_progress"  # 视频生成进度
+DELTA_VIDEO = "video"                    # 生成视频（HTML）
+DELTA_MESSAGE = "message"                # 上游给出的完整最终回复（非流式优先使用）
+DELTA_FINISH = "finish"                  # 正常结束或超时结束
+DELTA_ERROR = "error"                    # 错误结束
+
+DEFAULT_MODEL = "grok-4-mini-thinking-tahoe"
+SSE_DONE = "data: [DONE]\n\n"
+
+
+@dataclass(slots=True)
+class Delta:
+    """增量事件"""
+    kind: str
+    text: str = ""
+    model: Optional[str] = None      # 产生该事件时的模型名
+    progress: int = 0                # 视频进度（DELTA_VIDEO_PROGRESS）
+    finish: Optional[str] = None     # SSE结束原因（DELTA_FINISH/DELTA_ERROR）
+    code: Optional[str] = None       # 错误码（DELTA_ERROR）
+    index: int = 0                   # 候选序号（n>1 多候选合并输出时区分 choices）
+
+
+class DeltaStream:
+    """增量事件流基类
+
+    子类实现 deltas() 并在初始化时调用基类 __init__；直接迭代时输出 OpenAI 格式的 SSE 文本，
+    MCP 等内部调用方可直接消费 deltas()，无需先编码再解析JSON。
+    """
+
+    def __init__(self, candidates: int = 1):
+        self._sse = None
+        self._candidates = candidates
+
+    def deltas(self) -> AsyncIterator[Delta]:
+        raise NotImplementedError
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        if self._sse is None:
+            self._sse = encode_sse(self.deltas(), setting.grok_config.get("show_thinking", True), self._candidates)
+        return await anext(self._sse)
+
+    async def _close_sse(self) -> None:
+        if self._sse is not None:
+            try:
+                await self._sse.aclose()
+            except RuntimeError:
+                # 迭代仍在其他任务中进行，由底层连接关闭结束
+                pass
+
+
+def encode_chunk(content: str, model: Optional[str] = None, finish: Optional[str] = None,
+                 chunk_id: Optional[str] = None, index: int = 0) -> str:
+    """生成SSE响应块（字段与 OpenAIChatCompletionChunkResponse 一致）"""
+    return "data: " + orjson.dumps({
+        "id": chunk_id or f"chatcmpl-{uuid.uuid4()}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model or DEFAULT_MODEL,
+        "system_fingerprint": None,
+        "choices": [{
+            "index": index,
+            "delta": {"role": "assistant", "content": content} if content else {},
+            "finish_reason": finish,
+        }],
+    }).decode() + "\n\n"
+
+
+async def encode_sse(deltas: AsyncIterator[Delta], show_thinking: bool = True, candidates: int = 1) -> AsyncIterator[str]:
+    """增量事件 -> SSE文本（思考过程以 <think> 标签包裹）
+
+    结束/错误事件后不提前返回，让上游生成器自然结束并释放资源。
+    多候选交错输出时按 Delta.index 分别维护思考状态，全部候选结束后输出一次 [DONE]。
+    """
+    chunk_id = f"chatcmpl-{uuid.uuid4()}"
+    in_think = set()
+    video_started = set()
+    finished = 0
+
+    async for delta in deltas:
+        kind = delta.kind
+        index = delta.index
+        if kind == DELTA_TEXT:
+            text = delta.text
+            if index in in_think:
+                text = f"\n</think>\n{text}"
+                in_think.discard(index)
+            yield encode_chunk(text, delta.model, chunk_id=chunk_id, index=index)
+        elif kind == DELTA_THINKING:
+            if not show_thinking:
+                continue
+            text = delta.text if index in in_think else f"<think>\n{delta.text}"
+            in_think.add(index)
+            yield encode_chunk(text, delta.model, chunk_id=chunk_id, index=index)
+        elif kind == DELTA_VIDEO_PROGRESS:
+            if not show_thinking:
+                continue
+            if index not in video_started:
+                text = f"<think>视频已生成{delta.progress}%\n"
+                video_started.add(index)
+            elif delta.progress < 100:
+                text = f"视频已生成{delta.progress}%\n"
+            else:
+                text = f"视频已生成{delta.progress}%</think>\n"
+            yield encode_chunk(text, delta.model, chunk_id=chunk_id, index=index)
+        elif kind == DELTA_IMAGE:
+            yield encode_chunk(f"{delta.text}\n", delta.model, chunk_id=chunk_id, index=index)
+        elif kind == DELTA_VIDEO:
+            yield encode_chunk(delta.text, delta.model, chunk_id=chunk_id, index=index)
+        elif kind in (DELTA_ERROR, DELTA_FINISH):
+            yield encode_chunk(delta.text if kind == DELTA_ERROR else "", delta.model, delta.finish or "stop", chunk_id, index)
+            finished += 1
+            if finished == candidates:
+                yield SSE_DONE
+
+
+async def collect(deltas: AsyncIterator[Delta], model: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """聚合增量事件为完整回复
+
+    上游给出最终回复（DELTA_MESSAGE）时以其为准，否则按收到的正文拼接；
+    思考过程与视频进度不计入。
+
+    Returns:
+        (内容, 模型名)
+    """
+    parts = []
+    message = None
+    media = []
+
+    async for delta in deltas:
+        kind = delta.kind
+        if kind == DELTA_TEXT:
+            parts.append(delta.text)
+        elif kind == DELTA_MESSAGE:
+            message = delta.text
+            model = delta.model or model
+        elif kind == DELTA_IMAGE:
+            media.append(f"\n{delta.text}")
+        elif kind == DELTA_VIDEO:
+            # 视频响应只包含视频本身
+            return delta.text, model or "grok-imagine-0.9"
+        elif kind == DELTA_ERROR:
+            raise GrokApiException(delta.text, delta.code or "PROCESS_ERROR")
+
+    if message is None and not parts and not media:
+        raise GrokApiException("无响应数据", "NO_RESPONSE")
+    content = message if message is not None else "".join(parts)
+    return content + "".join(media), model
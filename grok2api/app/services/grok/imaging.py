@@ -0,0 +1,103 @@
+"""图片处理 - 缩放、转码与压缩
+
+处理函数在进程池中执行，不占用事件循环与GIL；Pillow 未安装时 AVAILABLE 为 False，调用方应回退原图。
+工作进程由 forkserver（Windows 为 spawn）创建，只导入本模块（不在模块级导入配置等服务端依赖）。
+"""
+
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from importlib.util import find_spec
+from io import BytesIO
+from typing import Any, Callable, Optional, Tuple
+
+
+AVAILABLE = find_spec("PIL") is not None
+MAX_DIMENSION = 4096  # 缩放边长上限（像素）
+FORMATS = {  # 格式名 -> (Pillow格式, MIME)
+    "avif": ("AVIF", "image/avif"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+SUFFIX_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp", ".avif": "avif"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+@cache
+def supports(fmt: str) -> bool:
+    """当前 Pillow 是否支持编码该格式"""
+    if not AVAILABLE or fmt not in FORMATS:
+        return False
+    from PIL import features
+    return fmt in ("jpeg", "png") or bool(features.check(fmt))
+
+
+async def run(func: Callable[..., Any], *args: Any) -> Any:
+    """在图片处理进程池中执行"""
+    global _pool
+    if _pool is None:
+        from app.core.config import setting
+        workers = max(1, int(setting.global_config.get("image_worker_processes", 2)))
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+    return await asyncio.get_running_loop().run_in_executor(_pool, func, *args)
+
+
+def shutdown() -> None:
+    """关闭图片处理进程池（未排队的任务取消）"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def render_variant(src: str, dst: str, width: int, height: int, fmt: str, quality: int) -> None:
+    """生成派生图：按比例缩放到不超过 width x height（0为不限制，不放大），转码为 fmt 后原子写入 dst"""
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)
+        if width or height:
+            img.thumbnail((width or MAX_DIMENSION, height or MAX_DIMENSION), Image.Resampling.LANCZOS)
+        pil_format = FORMATS[fmt][0]
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        tmp = f"{dst}.part"
+        img.save(tmp, pil_format, quality=quality)
+    os.replace(tmp, dst)
+
+
+def normalize(data: bytes, max_dimension: int, quality: int) -> Optional[Tuple[bytes, str]]:
+    """上传前规范化：按方向旋正、缩小到最长边不超过 max_dimension、去除元数据并重新压缩
+
+    有透明通道时输出PNG，否则输出JPEG；动图或结果不比原图小时返回None（沿用原图）。
+
+    Returns:
+        (图片数据, MIME) 或 None
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as img:
+        if getattr(img, "n_frames", 1) > 1:
+            return None
+        resized = max(img.size) > max_dimension
+        img = ImageOps.exif_transpose(img)
+        if resized:
+            img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+        out = BytesIO()
+        if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+            img.save(out, "PNG", optimize=True)
+            mime = "image/png"
+        else:
+            img.convert("RGB").save(out, "JPEG", quality=quality, optimize=True)
+            mime = "image/jpeg"
+
+    result = out.getvalue()
+    if not resized and len(result) >= len(data):
+        return None
+    return result, mime
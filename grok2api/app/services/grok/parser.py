@@ -0,0 +1,80 @@
+"""Grok 响应行解析 - 区分文本增量与少见事件，过滤标签预编译为单个正则"""
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, Union
+
+import orjson
+
+
+# 行类型
+LINE_EMPTY = "empty"        # 空行或无response的行
+LINE_TOKEN = "token"        # 纯文本增量
+LINE_RESPONSE = "response"  # 其他事件（模型响应/图片/视频/搜索卡片等）
+LINE_ERROR = "error"        # 上游错误
+LINE_CONVERSATION = "conversation"  # 新会话信息（conversationId）
+
+# 出现下列字段之一的行属于少见事件，其余带字符串token的行都是文本增量
+EVENT_KEYS = frozenset({
+    "userResponse",
+    "modelResponse",
+    "imageAttachmentInfo",
+    "streamingImageGenerationResponse",
+    "streamingVideoGenerationResponse",
+    "toolUsageCardId",
+    "webSearchResults",
+})
+
+
+@lru_cache(maxsize=16)
+def _compile_tags(filtered_tags: str) -> Optional[re.Pattern]:
+    """将逗号分隔的过滤标签编译为单个正则（空标签忽略）"""
+    tags = [tag.strip() for tag in filtered_tags.split(",") if tag.strip()]
+    if not tags:
+        return None
+    return re.compile("|".join(re.escape(tag) for tag in sorted(tags, key=len, reverse=True)))
+
+
+class GrokLineParser:
+    """上游NDJSON行解析器
+
+    绝大多数行是 {"result":{"response":{"token":"...","isThinking":false,...}}} 形式的
+    文本增量，处理方据行类型跳过图片/视频/模型事件的检查。整行解码仍交给 orjson：
+    实测按字节预扫描（前缀+关键字匹配）在CPython中并不比 orjson 解码整行更快。
+    """
+
+    def __init__(self, filtered_tags: str = ""):
+        self._tags = _compile_tags(filtered_tags or "")
+
+    def is_filtered(self, token: str) -> bool:
+        """token是否包含过滤标签"""
+        return self._tags is not None and self._tags.search(token) is not None
+
+    @staticmethod
+    def parse(line: Union[bytes, str]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """解析一行上游数据
+
+        Returns:
+            (行类型, 数据)：LINE_TOKEN/LINE_RESPONSE 返回 response 字典，
+            LINE_ERROR 返回 error 字典，LINE_CONVERSATION 返回 conversation 字典，
+            LINE_EMPTY 返回 None
+
+        新会话的数据包在 result.response 中；续聊接口的数据直接位于 result 下。
+        """
+        if not line:
+            return LINE_EMPTY, None
+
+        data = orjson.loads(line)
+        if error := data.get("error"):
+            return LINE_ERROR, error
+
+        result = data.get("result") or {}
+        if conversation := result.get("conversation"):
+            return LINE_CONVERSATION, conversation
+
+        grok_resp = result.get("response", result)
+        if not grok_resp:
+            return LINE_EMPTY, None
+        if isinstance(grok_resp.get("token"), str) and EVENT_KEYS.isdisjoint(grok_resp):
+            return LINE_TOKEN, grok_resp
+        return LINE_RESPONSE, grok_resp
@@ -4,7 +4,7 @@ import orjson
 import uuid
 import time
 import asyncio
-from typing import AsyncGenerator, Tuple, Any
+from typing import AsyncGenerator, AsyncIterator, Optional, Tuple, Any
 
 from app.core.config import setting
 from app.core.exception import GrokApiException
@@ -12,12 +12,17 @@ from app.core.logger import logger
 from app.models.openai_schema import (
     OpenAIChatCompletionResponse,
     OpenAIChatCompletionChoice,
-    OpenAIChatCompletionMessage,
-    OpenAIChatCompletionChunkResponse,
-    OpenAIChatCompletionChunkChoice,
-    OpenAIChatCompletionChunkMessage
+    OpenAIChatCompletionMessage
 )
 from app.services.grok.cache import image_cache_service, video_cache_service
+from app.services.grok.delta import (
+    Delta, DeltaStream, collect,
+    DELTA_TEXT, DELTA_THINKING, DELTA_IMAGE, DELTA_VIDEO_PROGRESS, DELTA_VIDEO,
+    DELTA_MESSAGE, DELTA_FINISH, DELTA_ERROR,
+)
+from app.services.grok.conversation import ConversationTurn
+from app.services.grok.parser import GrokLineParser, LINE_RESPONSE, LINE_ERROR, LINE_EMPTY, LINE_CONVERSATION
+from app.services.grok.token import token_manager, TokenLease
 
 
 class StreamTimeoutManager:
@@ -31,20 +36,19 @@ class StreamTimeoutManager:
         self.last_chunk_time = self.start_time
         self.first_received = False
     
-    def check_timeout(self) -> Tuple[bool, str]:
-        """检查超时"""
+    def next_deadline(self) -> Tuple[float, str]:
+        """距最近一个超时期限的剩余秒数及对应的超时说明"""
         now = asyncio.get_event_loop().time()
         
-        if not self.first_received and now - self.start_time > self.first_timeout:
-            return True, f"首次响应超时({self.first_timeout}秒)"
-        
-        if self.total_timeout > 0 and now - self.start_time > self.total_timeout:
-            return True, f"总超时({self.total_timeout}秒)"
+        if not self.first_received:
+            deadlines = [(self.start_time + self.first_timeout - now, f"首次响应超时({self.first_timeout}秒)")]
+        else:
+            deadlines = [(self.last_chunk_time + self.chunk_timeout - now, f"数据块超时({self.chunk_timeout}秒)")]
         
-        if self.first_received and now - self.last_chunk_time > self.chunk_timeout:
-            return True, f"数据块超时({self.chunk_timeout}秒)"
+        if self.total_timeout > 0:
+            deadlines.append((self.start_time + self.total_timeout - now, f"总超时({self.total_timeout}秒)"))
         
-        return False, ""
+        return min(deadlines)
     
     def mark_received(self):
         """标记收到数据"""
@@ -56,88 +60,103 @@ class StreamTimeoutManager:
         return asyncio.get_event_loop().time() - self.start_time
 
 
-class GrokResponseProcessor:
-    """Grok响应处理器"""
+class UpstreamStream(DeltaStream):
+    """上游流式响应句柄
 
-    @staticmethod
-    async def process_normal(response, auth_token: str, model: str = None) -> OpenAIChatCompletionResponse:
-        """处理非流式响应"""
-        response_closed = False
-        try:
-            async for chunk in response.aiter_lines():
-                if not chunk:
-                    continue
+    持有上游响应、会话与Token租约。deltas() 产生类型化增量，直接迭代得到SSE文本。
+    aclose()无论迭代是否开始都会关闭连接并释放租约，避免客户端在流开始前断开时
+    租约与会话泄漏。
+    """
 
-                data = orjson.loads(chunk)
-
-                # 错误检查
-                if error := data.get("error"):
-                    raise GrokApiException(
-                        f"API错误: {error.get('message', '未知错误')}",
-                        "API_ERROR",
-                        {"code": error.get("code")}
-                    )
-
-                grok_resp = data.get("result", {}).get("response", {})
-                
-                # 视频响应
-                if video_resp := grok_resp.get("streamingVideoGenerationResponse"):
-                    if video_url := video_resp.get("videoUrl"):
-                        content = await GrokResponseProcessor._build_video_content(video_url, auth_token)
-                        result = GrokResponseProcessor._build_response(content, model or "grok-imagine-0.9")
-                        response_closed = True
-                        response.close()
-                        return result
-
-                # 模型响应
-                model_response = grok_resp.get("modelResponse")
-                if not model_response:
-                    continue
+    def __init__(self, response, lease: TokenLease, session: Any = None, started: float = None, failover: bool = False,
+                 turn: Optional[ConversationTurn] = None):
+        super().__init__()
+        self.response = response
+        self.lease = lease
+        self.session = session
+        self.turn = turn
+        self._closed = False
+        self._deltas = GrokResponseProcessor._iter_deltas(self, started, failover)
 
-                if error_msg := model_response.get("error"):
-                    raise GrokApiException(f"模型错误: {error_msg}", "MODEL_ERROR")
+    def deltas(self) -> AsyncIterator[Delta]:
+        return self._deltas
 
-                # 构建内容
-                content = model_response.get("message", "")
-                model_name = model_response.get("model")
+    async def close(self) -> None:
+        """关闭上游响应与会话并释放Token租约（可重复调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        self.lease.release()
+
+        if hasattr(self.response, 'close'):
+            try:
+                self.response.close()
+                logger.debug("[Processor] 响应已关闭")
+            except Exception as e:
+                logger.warning(f"[Processor] 关闭失败: {e}")
+
+        if self.session:
+            try:
+                await self.session.close()
+                logger.debug("[Processor] 会话已关闭")
+            except Exception as e:
+                logger.warning(f"[Processor] 关闭会话失败: {e}")
 
-                # 处理图片
-                if images := model_response.get("generatedImageUrls"):
-                    content = await GrokResponseProcessor._append_images(content, images, auth_token)
+    async def aclose(self) -> None:
+        """结束迭代并释放资源"""
+        try:
+            await self._close_sse()
+            await self._deltas.aclose()
+        except RuntimeError:
+            # 迭代仍在其他任务中进行：直接关闭连接，读取随之结束
+            pass
+        finally:
+            await self.close()
 
-                result = GrokResponseProcessor._build_response(content, model_name)
-                response_closed = True
-                response.close()
-                return result
 
-            raise GrokApiException("无响应数据", "NO_RESPONSE")
+class GrokResponseProcessor:
+    """Grok响应处理器"""
 
-        except orjson.JSONDecodeError as e:
-            logger.error(f"[Processor] JSON解析失败: {e}")
-            raise GrokApiException(f"JSON解析失败: {e}", "JSON_ERROR") from e
+    @staticmethod
+    async def process_normal(response, lease: TokenLease, model: str = None, started: float = None,
+                             turn: Optional[ConversationTurn] = None) -> OpenAIChatCompletionResponse:
+        """处理非流式响应（聚合增量事件，与流式共用解析逻辑）"""
+        stream = UpstreamStream(response, lease, started=started, turn=turn)
+        try:
+            content, model_name = await collect(stream.deltas(), model)
+        except GrokApiException:
+            raise
         except Exception as e:
             logger.error(f"[Processor] 处理错误: {type(e).__name__}: {e}")
             raise GrokApiException(f"响应处理错误: {e}", "PROCESS_ERROR") from e
         finally:
-            if not response_closed and hasattr(response, 'close'):
-                try:
-                    response.close()
-                except Exception as e:
-                    logger.warning(f"[Processor] 关闭响应失败: {e}")
+            await stream.aclose()
+        return GrokResponseProcessor._build_response(content, model_name)
 
     @staticmethod
-    async def process_stream(response, auth_token: str, session: Any = None) -> AsyncGenerator[str, None]:
-        """处理流式响应"""
+    def process_stream(response, lease: TokenLease, session: Any = None, started: float = None, failover: bool = False,
+                       turn: Optional[ConversationTurn] = None) -> UpstreamStream:
+        """处理流式响应
+        
+        Args:
+            failover: 首次响应超时（上游未返回任何数据）时抛出STREAM_TIMEOUT，由调用方换Token重试
+            turn: 会话上下文，成功结束后记录上游会话供下一轮续聊
+        """
+        return UpstreamStream(response, lease, session, started, failover, turn)
+
+    @staticmethod
+    async def _iter_deltas(stream: UpstreamStream, started: float = None, failover: bool = False) -> AsyncGenerator[Delta, None]:
+        """逐行解析上游响应并生成增量事件"""
+        response = stream.response
+        auth_token = stream.lease.auth_token
+
         # 状态变量
         is_image = False
         is_thinking = False
         thinking_finished = False
         model = None
-        filtered_tags = setting.grok_config.get("filtered_tags", "").split(",")
-        video_progress_started = False
+        parser = GrokLineParser(setting.grok_config.get("filtered_tags", ""))
         last_video_progress = -1
-        response_closed = False
-        show_thinking = setting.grok_config.get("show_thinking", True)
 
         # 超时管理
         timeout_mgr = StreamTimeoutManager(
@@ -146,31 +165,59 @@ class GrokResponseProcessor:
             total_timeout=setting.grok_config.get("stream_total_timeout", 600)
         )
 
-        def make_chunk(content: str, finish: str = None):
-            """生成响应块"""
-            chunk_data = OpenAIChatCompletionChunkResponse(
-                id=f"chatcmpl-{uuid.uuid4()}",
-                created=int(time.time()),
-                model=model or "grok-4-mini-thinking-tahoe",
-                choices=[OpenAIChatCompletionChunkChoice(
-                    index=0,
-                    delta=OpenAIChatCompletionChunkMessage(
-                        role="assistant",
-                        content=content
-                    ) if content else {},
-                    finish_reason=finish
-                )]
-            )
-            return f"data: {chunk_data.model_dump_json()}\n\n"
+        # 健康度统计（outcome为None表示客户端中断，不计入Token健康度）
+        started = started or timeout_mgr.start_time
+        first_at = None
+        chars = 0
+        outcome = None
+
+        # 会话亲和：记录上游会话ID、回复ID与客户端可见的回复文本
+        conversation_id = None
+        response_id = None
+        message = None
+        parts = []
+        media = []
+
+        def make_delta(kind: str, text: str = "", **kwargs) -> Delta:
+            """生成增量事件"""
+            nonlocal first_at, chars
+            if text:
+                chars += len(text)
+                if first_at is None:
+                    first_at = asyncio.get_event_loop().time()
+                if kind == DELTA_TEXT:
+                    parts.append(text)
+                elif kind == DELTA_IMAGE:
+                    media.append(f"\n{text}")
+            return Delta(kind, text, model, **kwargs)
+
+        def complete_turn() -> None:
+            """成功结束时记录会话（客户端可能回传最终回复或流式拼接文本）"""
+            if stream.turn is None:
+                return
+            images = "".join(media)
+            replies = ["".join(parts) + images]
+            if message is not None:
+                replies.append(message + images)
+            stream.turn.complete(conversation_id, response_id, stream.lease.sso, replies)
 
         try:
-            async for chunk in response.aiter_lines():
-                # 超时检查
-                is_timeout, timeout_msg = timeout_mgr.check_timeout()
-                if is_timeout:
+            lines = response.aiter_lines()
+            while True:
+                # 看门狗：每次读取都与最近的超时期限竞争，上游完全静默时也能触发超时
+                left, timeout_msg = timeout_mgr.next_deadline()
+                try:
+                    chunk = await asyncio.wait_for(anext(lines), timeout=max(left, 0))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
                     logger.warning(f"[Processor] {timeout_msg}")
-                    yield make_chunk("", "stop")
-                    yield "data: [DONE]\n\n"
+                    outcome = False
+                    # 仅在上游尚未返回任何数据（首次响应超时）时换Token重试
+                    if failover and not timeout_mgr.first_received:
+                        await token_manager.apply_cooldown(auth_token, 504, stream.lease.generation)
+                        raise GrokApiException(timeout_msg, "STREAM_TIMEOUT")
+                    yield make_delta(DELTA_FINISH, finish="stop")
                     return
 
                 logger.debug(f"[Processor] 收到数据块: {len(chunk)} bytes")
@@ -178,109 +225,87 @@ class GrokResponseProcessor:
                     continue
 
                 try:
-                    data = orjson.loads(chunk)
+                    kind, grok_resp = parser.parse(chunk)
 
                     # 错误检查
-                    if error := data.get("error"):
-                        error_msg = error.get('message', '未知错误')
+                    if kind == LINE_ERROR:
+                        error_msg = grok_resp.get('message', '未知错误')
                         logger.error(f"[Processor] API错误: {error_msg}")
-                        yield make_chunk(f"Error: {error_msg}", "stop")
-                        yield "data: [DONE]\n\n"
+                        outcome = False
+                        yield make_delta(DELTA_ERROR, f"Error: {error_msg}", finish="stop", code="API_ERROR")
                         return
 
-                    grok_resp = data.get("result", {}).get("response", {})
-                    logger.debug(f"[Processor] 解析响应: {len(grok_resp)} bytes")
-                    if not grok_resp:
+                    if kind == LINE_EMPTY:
+                        continue
+
+                    if kind == LINE_CONVERSATION:
+                        conversation_id = grok_resp.get("conversationId")
                         continue
                     
                     timeout_mgr.mark_received()
 
-                    # 更新模型
-                    if user_resp := grok_resp.get("userResponse"):
-                        if m := user_resp.get("model"):
-                            model = m
-
-                    # 视频处理
-                    if video_resp := grok_resp.get("streamingVideoGenerationResponse"):
-                        progress = video_resp.get("progress", 0)
-                        v_url = video_resp.get("videoUrl")
-                        
-                        # 进度更新
-                        if progress > last_video_progress:
-                            last_video_progress = progress
-                            if show_thinking:
-                                if not video_progress_started:
-                                    content = f"<think>视频已生成{progress}%\n"
-                                    video_progress_started = True
-                                elif progress < 100:
-                                    content = f"视频已生成{progress}%\n"
-                                else:
-                                    content = f"视频已生成{progress}%</think>\n"
-                                yield make_chunk(content)
-                        
-                        # 视频URL
-                        if v_url:
-                            logger.debug("[Processor] 视频生成完成")
-                            video_content = await GrokResponseProcessor._build_video_content(v_url, auth_token)
-                            yield make_chunk(video_content)
-                        
-                        continue
+                    # 文本增量行不含模型/视频/图片事件，跳过这些检查
+                    if kind == LINE_RESPONSE:
+                        # 更新模型
+                        if user_resp := grok_resp.get("userResponse"):
+                            if m := user_resp.get("model"):
+                                model = m
+
+                        # 视频处理
+                        if video_resp := grok_resp.get("streamingVideoGenerationResponse"):
+                            progress = video_resp.get("progress", 0)
+                            v_url = video_resp.get("videoUrl")
+
+                            # 进度更新
+                            if progress > last_video_progress:
+                                last_video_progress = progress
+                                yield make_delta(DELTA_VIDEO_PROGRESS, progress=progress)
+
+                            # 视频URL
+                            if v_url:
+                                logger.debug("[Processor] 视频生成完成")
+                                video_content = await GrokResponseProcessor._build_video_content(v_url, auth_token)
+                                outcome = True
+                                yield make_delta(DELTA_VIDEO, video_content)
 
-                    # 图片模式
-                    if grok_resp.get("imageAttachmentInfo"):
-                        is_image = True
+                            continue
+
+                        # 图片模式
+                        if grok_resp.get("imageAttachmentInfo"):
+                            is_image = True
+
+                        # 模型最终回复
+                        if model_resp := grok_resp.get("modelResponse"):
+                            if error_msg := model_resp.get("error"):
+                                outcome = False
+                                yield make_delta(DELTA_ERROR, f"模型错误: {error_msg}", finish="stop", code="MODEL_ERROR")
+                                return
+
+                            message = model_resp.get("message", "")
+                            response_id = model_resp.get("responseId") or response_id
+                            yield Delta(DELTA_MESSAGE, message, model_resp.get("model") or model)
+                            if images := model_resp.get("generatedImageUrls"):
+                                for content in await GrokResponseProcessor._images_markdown(images, auth_token):
+                                    yield make_delta(DELTA_IMAGE, content)
+                                outcome = True
+                                complete_turn()
+                                yield make_delta(DELTA_FINISH, finish="stop")
+                                return
+                            continue
 
                     token = grok_resp.get("token", "")
 
-                    # 图片处理
+                    # 图片生成过程中的文本原样输出
                     if is_image:
-                        if model_resp := grok_resp.get("modelResponse"):
-                            image_mode = setting.global_config.get("image_mode", "url")
-                            content = ""
-
-                            for img in model_resp.get("generatedImageUrls", []):
-                                try:
-                                    if image_mode == "base64":
-                                        # Base64模式 - 分块发送
-                                        base64_str = await image_cache_service.download_base64(f"/{img}", auth_token)
-                                        if base64_str:
-                                            # 分块发送大数据
-                                            if not base64_str.startswith("data:"):
-                                                parts = base64_str.split(",", 1)
-                                                if len(parts) == 2:
-                                                    yield make_chunk(f"![Generated Image](data:{parts[0]},")
-                                                    # 8KB分块
-                                                    for i in range(0, len(parts[1]), 8192):
-                                                        yield make_chunk(parts[1][i:i+8192])
-                                                    yield make_chunk(")\n")
-                                                else:
-                                                    yield make_chunk(f"![Generated Image]({base64_str})\n")
-                                            else:
-                                                yield make_chunk(f"![Generated Image]({base64_str})\n")
-                                        else:
-                                            yield make_chunk(f"![Generated Image](https://assets.grok.com/{img})\n")
-                                    else:
-                                        # URL模式
-                                        await image_cache_service.download_image(f"/{img}", auth_token)
-                                        img_path = img.replace('/', '-')
-                                        base_url = setting.global_config.get("base_url", "")
-                                        img_url = f"{base_url}/images/{img_path}" if base_url else f"/images/{img_path}"
-                                        content += f"![Generated Image]({img_url})\n"
-                                except Exception as e:
-                                    logger.warning(f"[Processor] 处理图片失败: {e}")
-                                    content += f"![Generated Image](https://assets.grok.com/{img})\n"
-
-                            yield make_chunk(content.strip(), "stop")
-                            return
-                        elif token:
-                            yield make_chunk(token)
+                        if token:
+                            yield make_delta(DELTA_TEXT, token)
 
                     # 对话处理
                     else:
                         if isinstance(token, list):
                             continue
 
-                        if any(tag in token for tag in filtered_tags if token):
+                        if token and parser.is_filtered(token):
                             continue
 
                         current_is_thinking = grok_resp.get("isThinking", False)
@@ -289,86 +314,64 @@ class GrokResponseProcessor:
                         if thinking_finished and current_is_thinking:
                             continue
 
-                        # 搜索结果处理
+                        # 搜索结果处理（只在思考过程中展示）
                         if grok_resp.get("toolUsageCardId"):
-                            if web_search := grok_resp.get("webSearchResults"):
-                                if current_is_thinking:
-                                    if show_thinking:
-                                        for result in web_search.get("results", []):
-                                            title = result.get("title", "")
-                                            url = result.get("url", "")
-                                            preview = result.get("preview", "")
-                                            preview_clean = preview.replace("\n", "") if isinstance(preview, str) else ""
-                                            token += f'\n- [{title}]({url} "{preview_clean}")'
-                                        token += "\n"
-                                    else:
-                                        continue
-                                else:
-                                    continue
-                            else:
+                            web_search = grok_resp.get("webSearchResults")
+                            if not web_search or not current_is_thinking:
                                 continue
+                            for result in web_search.get("results", []):
+                                title = result.get("title", "")
+                                url = result.get("url", "")
+                                preview = result.get("preview", "")
+                                preview_clean = preview.replace("\n", "") if isinstance(preview, str) else ""
+                                token += f'\n- [{title}]({url} "{preview_clean}")'
+                            token += "\n"
 
                         if token:
-                            content = token
-
-                            if message_tag == "header":
-                                content = f"\n\n{token}\n\n"
-
-                            # Thinking状态切换
-                            should_skip = False
-                            if not is_thinking and current_is_thinking:
-                                if show_thinking:
-                                    content = f"<think>\n{content}"
-                                else:
-                                    should_skip = True
-                            elif is_thinking and not current_is_thinking:
-                                if show_thinking:
-                                    content = f"\n</think>\n{content}"
+                            content = f"\n\n{token}\n\n" if message_tag == "header" else token
+
+                            # Thinking状态切换（<think>标签由SSE编码负责）
+                            if is_thinking and not current_is_thinking:
                                 thinking_finished = True
-                            elif current_is_thinking:
-                                if not show_thinking:
-                                    should_skip = True
+                            yield make_delta(DELTA_THINKING if current_is_thinking else DELTA_TEXT, content)
 
-                            if not should_skip:
-                                yield make_chunk(content)
-                            
                             is_thinking = current_is_thinking
 
                 except (orjson.JSONDecodeError, UnicodeDecodeError) as e:
                     logger.warning(f"[Processor] 解析失败: {e}")
                     continue
+                except GrokApiException:
+                    raise
                 except Exception as e:
                     logger.warning(f"[Processor] 处理出错: {e}")
                     continue
 
-            yield make_chunk("", "stop")
-            yield "data: [DONE]\n\n"
+            outcome = True
+            if last_video_progress < 0:
+                complete_turn()
             logger.info(f"[Processor] 流式完成，耗时: {timeout_mgr.duration():.2f}秒")
+            yield make_delta(DELTA_FINISH, finish="stop")
 
+        except GrokApiException:
+            raise
         except Exception as e:
             logger.error(f"[Processor] 严重错误: {e}")
-            yield make_chunk(f"处理错误: {e}", "error")
-            yield "data: [DONE]\n\n"
+            outcome = False
+            yield make_delta(DELTA_ERROR, f"处理错误: {e}", finish="error", code="PROCESS_ERROR")
         finally:
-            if not response_closed and hasattr(response, 'close'):
-                try:
-                    response.close()
-                    logger.debug("[Processor] 响应已关闭")
-                except Exception as e:
-                    logger.warning(f"[Processor] 关闭失败: {e}")
-            
-            if session:
-                try:
-                    await session.close()
-                    logger.debug("[Processor] 会话已关闭")
-                except Exception as e:
-                    logger.warning(f"[Processor] 关闭会话失败: {e}")
+            if outcome is not None:
+                ttfb = first_at - started if first_at is not None else None
+                # 吞吐只统计文本对话，图片/视频流的进度输出不代表Token速度
+                is_text = not is_image and last_video_progress < 0
+                duration = asyncio.get_event_loop().time() - first_at if first_at is not None and is_text else None
+                token_manager.record_result(auth_token, outcome, ttfb, duration, chars, stream.lease.generation)
+            await stream.close()
 
     @staticmethod
     async def _build_video_content(video_url: str, auth_token: str) -> str:
         """构建视频内容"""
         logger.debug(f"[Processor] 检测到视频: {video_url}")
-        full_url = f"https://assets.grok.com/{video_url}"
+        full_url = setting.assets_url(video_url)
         
         try:
             cache_path = await video_cache_service.download_video(f"/{video_url}", auth_token)
@@ -383,32 +386,32 @@ class GrokResponseProcessor:
         return f'<video src="{full_url}" controls="controls" width="500" height="300"></video>\n'
 
     @staticmethod
-    async def _append_images(content: str, images: list, auth_token: str) -> str:
-        """追加图片到内容"""
-        image_mode = setting.global_config.get("image_mode", "url")
-        
+    async def _images_markdown(images: list, auth_token: str) -> list:
+        """生成全部图片的Markdown（并发下载）
+
+        url模式立即返回本地缓存链接，图片在后台并发下载，/images 请求等待下载完成；
+        base64模式并发下载编码，失败时回退原始地址。
+        """
+        if setting.global_config.get("image_mode", "url") == "base64":
+            return await asyncio.gather(*(GrokResponseProcessor._image_base64(img, auth_token) for img in images))
+
+        base_url = setting.global_config.get("base_url", "")
+        result = []
         for img in images:
-            try:
-                if image_mode == "base64":
-                    base64_str = await image_cache_service.download_base64(f"/{img}", auth_token)
-                    if base64_str:
-                        content += f"\n![Generated Image]({base64_str})"
-                    else:
-                        content += f"\n![Generated Image](https://assets.grok.com/{img})"
-                else:
-                    cache_path = await image_cache_service.download_image(f"/{img}", auth_token)
-                    if cache_path:
-                        img_path = img.replace('/', '-')
-                        base_url = setting.global_config.get("base_url", "")
-                        img_url = f"{base_url}/images/{img_path}" if base_url else f"/images/{img_path}"
-                        content += f"\n![Generated Image]({img_url})"
-                    else:
-                        content += f"\n![Generated Image](https://assets.grok.com/{img})"
-            except Exception as e:
-                logger.warning(f"[Processor] 处理图片失败: {e}")
-                content += f"\n![Generated Image](https://assets.grok.com/{img})"
-        
-        return content
+            image_cache_service.prefetch(f"/{img}", auth_token)
+            img_path = img.replace('/', '-')
+            result.append(f"![Generated Image]({base_url}/images/{img_path})")
+        return result
+
+    @staticmethod
+    async def _image_base64(img: str, auth_token: str) -> str:
+        """生成Base64图片Markdown，失败时回退原始地址"""
+        try:
+            if base64_str := await image_cache_service.download_base64(f"/{img}", auth_token):
+                return f"![Generated Image]({base64_str})"
+        except Exception as e:
+            logger.warning(f"[Processor] 处理图片失败: {e}")
+        return f"![Generated Image]({setting.assets_url(img)})"
 
     @staticmethod
     def _build_response(content: str, model: str) -> OpenAIChatCompletionResponse:
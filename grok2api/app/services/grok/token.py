@@ -1,23 +1,30 @@
 """Grok Token 管理器 - 单例模式的Token负载均衡和状态管理"""
 
+import os
 import orjson
 import time
+import heapq
+import random
 import asyncio
 import aiofiles
 import portalocker
 from pathlib import Path
+from collections import deque
+from dataclasses import dataclass, field
 from curl_cffi.requests import AsyncSession
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 
 from app.models.grok_models import TokenType, Models
 from app.core.exception import GrokApiException
 from app.core.logger import logger
 from app.core.config import setting
+from app.core.storage import TokenChange, TokenJournal
+from app.services.grok.token_index import TokenIndex
 from app.services.grok.statsig import get_dynamic_headers
 
 
 # 常量
-RATE_LIMIT_API = "https://grok.com/rest/rate-limits"
+RATE_LIMIT_PATH = "/rest/rate-limits"
 TIMEOUT = 30
 BROWSER = "chrome133a"
 MAX_FAILURES = 3
@@ -29,6 +36,109 @@ COOLDOWN_REQUESTS = 5              # 普通失败冷却请求数
 COOLDOWN_429_WITH_QUOTA = 3600     # 429+有额度冷却1小时（秒）
 COOLDOWN_429_NO_QUOTA = 36000      # 429+无额度冷却10小时（秒）
 
+# 等待队列常量
+TOKEN_WAIT_POLL = 1.0              # 排队等待时的兜底轮询间隔（秒），用于感知其他进程的变更
+
+# 选择策略常量
+SELECT_STRATEGIES = ("least_loaded", "p2c", "weighted", "first")
+UNKNOWN_QUOTA_WEIGHT = 20          # 未使用Token（额度未知）按此剩余次数参与加权
+
+# 健康度常量
+HEALTH_ALPHA = 0.3                 # EWMA平滑系数
+HEALTH_TTFB_REF = 3.0              # 首字节参考耗时（秒），等于该值时延迟得分为0.5
+HEALTH_THROUGHPUT_REF = 50.0       # 吞吐参考值（字符/秒），达到即不扣分
+HEALTH_MIN_SCORE = 0.05            # 最低得分，避免Token被完全饿死
+COOLDOWN_FACTOR_MIN = 0.25         # 自适应冷却倍数下限
+COOLDOWN_FACTOR_MAX = 4.0          # 自适应冷却倍数上限
+
+# 后台限额刷新常量
+LIMIT_REFRESH_TICK = 5             # 调度检查间隔（秒）
+RATE_LIMIT_DEMAND_TTL = 3600       # 最近该秒数内有请求的限额桶才参与后台刷新（秒）
+LIMIT_REFRESH_LOCK = "limit_refresher.lock"  # 主机级刷新锁文件名（与Token文件同目录）
+
+
+@dataclass
+class TokenHealth:
+    """Token健康度（EWMA统计）"""
+    ttfb: Optional[float] = None        # 首字节耗时（秒）
+    throughput: Optional[float] = None  # 流吞吐（字符/秒，仅文本对话）
+    success_rate: float = 1.0           # 成功率
+    samples: int = 0                    # 样本数
+    cooldown_factor: float = 1.0        # 自适应冷却倍数
+    generation: int = 0                 # 冷却代数（每次进入冷却+1）
+    recovering: bool = False            # 冷却结束后尚未观察到新租约的结果
+
+    @staticmethod
+    def _ewma(old: Optional[float], value: float) -> float:
+        return value if old is None else old + HEALTH_ALPHA * (value - old)
+
+    def observe(self, success: bool, ttfb: Optional[float] = None, throughput: Optional[float] = None,
+                generation: Optional[int] = None) -> None:
+        """记录一次请求结果
+        
+        Args:
+            generation: 请求分配时的冷却代数；冷却前已在途请求的迟到结果不参与冷却倍数调整
+        """
+        self.samples += 1
+        self.success_rate = self._ewma(self.success_rate, 1.0 if success else 0.0)
+        if ttfb is not None:
+            self.ttfb = self._ewma(self.ttfb, ttfb)
+        if throughput is not None:
+            self.throughput = self._ewma(self.throughput, throughput)
+
+        if self.recovering and generation == self.generation:
+            self.settle(success)
+
+    def settle(self, success: bool) -> None:
+        """冷却后首个新租约的结果决定冷却倍数收缩或增长"""
+        self.recovering = False
+        factor = self.cooldown_factor * (0.5 if success else 2.0)
+        self.cooldown_factor = min(COOLDOWN_FACTOR_MAX, max(COOLDOWN_FACTOR_MIN, factor))
+
+    def enter_cooldown(self) -> None:
+        """进入新一轮冷却"""
+        self.generation += 1
+        self.recovering = True
+
+    def score(self) -> float:
+        """综合得分（0~1，越高越健康）"""
+        value = self.success_rate
+        if self.ttfb is not None:
+            value *= HEALTH_TTFB_REF / (HEALTH_TTFB_REF + self.ttfb)
+        if self.throughput is not None:
+            value *= 0.5 + 0.5 * min(1.0, self.throughput / HEALTH_THROUGHPUT_REF)
+        return max(HEALTH_MIN_SCORE, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "score": round(self.score(), 3),
+            "ttfb": round(self.ttfb, 3) if self.ttfb is not None else None,
+            "throughput": round(self.throughput, 1) if self.throughput is not None else None,
+            "success_rate": round(self.success_rate, 3),
+            "samples": self.samples,
+            "cooldown_factor": round(self.cooldown_factor, 2)
+        }
+
+
+@dataclass
+class TokenLease:
+    """Token并发租约（release()可重复调用，仅首次生效）"""
+    sso: str
+    manager: "GrokTokenManager" = field(repr=False)
+    generation: int = 0                 # 分配时的冷却代数
+    released: bool = False
+
+    @property
+    def auth_token(self) -> str:
+        return f"sso-rw={self.sso};sso={self.sso}"
+
+    def release(self) -> None:
+        """释放租约"""
+        if self.released:
+            return
+        self.released = True
+        self.manager.release_token(self.sso)
+
 
 class GrokTokenManager:
     """Token管理器（单例）"""
@@ -53,12 +163,32 @@ class GrokTokenManager:
         
         # 批量保存队列
         self._save_pending = False  # 标记是否有待保存的数据
+        self._dirty: Dict[str, None] = {}  # 待写入变更日志的Token（有序去重）
+        self._full_save = False  # 是否需要重写完整快照
+        self._journal: Optional[TokenJournal] = None
+        self._index = TokenIndex()  # 管理后台列表的二级索引与统计
         self._save_task = None  # 后台保存任务
         self._shutdown = False  # 关闭标志
         
         # 冷却状态
         self._cooldown_counts: Dict[str, int] = {}  # Token -> 剩余冷却次数
         self._request_counter = 0  # 全局请求计数器
+
+        # 等待队列（按模型类别区分 normal/heavy）
+        self._waiters: Dict[str, deque] = {}  # 模型类别 -> 等待者队列 [(模型, Future)]
+        self._cooldown_wakeup: Optional[asyncio.TimerHandle] = None  # 冷却到期唤醒定时器
+
+        # 并发租约
+        self._inflight: Dict[str, int] = {}  # Token -> 进行中的请求数
+
+        # 健康度
+        self._health: Dict[str, TokenHealth] = {}  # Token -> 健康度统计
+
+        # 后台限额刷新
+        self._refresh_queue: list[Tuple[float, str, str]] = []  # (到期时间, Token, 限额桶) 最小堆
+        self._bucket_demand: Dict[str, float] = {}  # 限额桶 -> 最近请求时间（后台只刷新有请求的桶）
+        self._refresher_task: Optional[asyncio.Task] = None
+        self._refresher_lock_file = None  # 主机级刷新锁（多worker只有持锁进程执行刷新）
         
         # 刷新状态
         self._refresh_lock = False  # 刷新锁
@@ -71,55 +201,78 @@ class GrokTokenManager:
         """设置存储实例"""
         self._storage = storage
 
+    def _get_journal(self) -> TokenJournal:
+        """Token文件的快照 + 变更日志（随 token_file 变化重建）"""
+        if self._journal is None or self._journal.snapshot != self.token_file:
+            self._journal = TokenJournal(self.token_file)
+        return self._journal
+
     async def _load_data(self) -> None:
-        """异步加载Token数据（支持多进程）"""
+        """异步加载Token数据（快照 + 回放变更日志，支持多进程）"""
         default = {TokenType.NORMAL.value: {}, TokenType.SUPER.value: {}}
-        
-        def load_sync():
-            with open(self.token_file, "r", encoding="utf-8") as f:
-                portalocker.lock(f, portalocker.LOCK_SH)
-                try:
-                    return orjson.loads(f.read())
-                finally:
-                    portalocker.unlock(f)
 
         try:
-            if self.token_file.exists():
-                # 使用进程锁读取文件
+            if self._storage:
+                self.token_data = await self._storage.load_tokens()
+            elif self.token_file.exists():
                 async with self._file_lock:
-                    self.token_data = await asyncio.to_thread(load_sync)
+                    self.token_data = await asyncio.to_thread(self._get_journal().load)
             else:
                 self.token_data = default
                 logger.debug("[Token] 创建新数据文件")
         except Exception as e:
             logger.error(f"[Token] 加载失败: {e}")
             self.token_data = default
+        self._dirty.clear()
+        self._full_save = False
+        self._index.mark_all()
 
-    async def _save_data(self) -> None:
-        """保存Token数据（支持多进程）"""
-        def save_sync(data):
-            with open(self.token_file, "w", encoding="utf-8") as f:
-                portalocker.lock(f, portalocker.LOCK_EX)
-                try:
-                    content = orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
-                    f.write(content)
-                    f.flush()
-                finally:
-                    portalocker.unlock(f)
+    def _collect_changes(self) -> List[TokenChange]:
+        """取出待保存的Token变更（已删除的Token记为None）"""
+        changes = []
+        for sso in self._dirty:
+            token_type, data = self._find_token(sso)
+            if token_type:
+                changes.append((token_type, sso, data))
+            else:
+                changes.extend((t, sso, None) for t in (TokenType.NORMAL.value, TokenType.SUPER.value))
+        self._dirty = {}
+        return changes
+
+    async def _save_data(self, full: bool = False) -> None:
+        """保存Token数据：默认只追加变更日志，full 时原子重写快照（支持多进程）"""
+        full = full or self._full_save
+        changes = [] if full else self._collect_changes()
+        if full:
+            self._dirty = {}
+        self._full_save = False
 
         try:
             if not self._storage:
+                journal = self._get_journal()
                 async with self._file_lock:
-                    await asyncio.to_thread(save_sync, self.token_data)
-            else:
+                    if full:
+                        await asyncio.to_thread(journal.compact, self.token_data)
+                    else:
+                        await asyncio.to_thread(journal.append, changes, self.token_data)
+            elif full:
                 await self._storage.save_tokens(self.token_data)
+            else:
+                await self._storage.save_token_changes(changes, self.token_data)
         except Exception as e:
+            self._full_save = True  # 变更已取出，下次重写完整快照以免丢失
             logger.error(f"[Token] 保存失败: {e}")
             raise GrokApiException(f"保存失败: {e}", "TOKEN_SAVE_ERROR")
 
-    def _mark_dirty(self) -> None:
-        """标记有待保存的数据"""
+    def _mark_dirty(self, *ssos: str) -> None:
+        """标记有待保存的数据（未指定Token时重写完整快照）"""
         self._save_pending = True
+        if not ssos:
+            self._full_save = True
+            self._index.mark_all()
+        for sso in ssos:
+            self._dirty[sso] = None
+        self._index.mark(ssos)
 
     async def _batch_save_worker(self) -> None:
         """批量保存后台任务"""
@@ -149,6 +302,18 @@ class GrokTokenManager:
         """关闭并刷新所有待保存数据"""
         self._shutdown = True
         
+        if self._cooldown_wakeup:
+            self._cooldown_wakeup.cancel()
+            self._cooldown_wakeup = None
+
+        if self._refresher_task:
+            self._refresher_task.cancel()
+            try:
+                await self._refresher_task
+            except asyncio.CancelledError:
+                pass
+        self._release_refresher_lock()
+
         if self._save_task:
             self._save_task.cancel()
             try:
@@ -156,9 +321,9 @@ class GrokTokenManager:
             except asyncio.CancelledError:
                 pass
         
-        # 最终刷新
+        # 最终刷新（压缩变更日志）
         if self._save_pending:
-            await self._save_data()
+            await self._save_data(full=True)
             logger.info("[Token] 关闭时刷新完成")
 
     @staticmethod
@@ -176,31 +341,45 @@ class GrokTokenManager:
                 return token_type, self.token_data[token_type][sso]
         return None, None
 
-    async def add_token(self, tokens: list[str], token_type: TokenType) -> None:
-        """添加Token"""
-        if not tokens:
-            return
+    @staticmethod
+    def _new_token_data() -> Dict[str, Any]:
+        return {
+            "createdTime": int(time.time() * 1000),
+            "remainingQueries": -1,
+            "heavyremainingQueries": -1,
+            "status": "active",
+            "failedCount": 0,
+            "lastFailureTime": None,
+            "lastFailureReason": None,
+            "tags": [],
+            "note": ""
+        }
 
+    async def import_tokens(self, records: List[TokenChange]) -> int:
+        """导入Token记录 (类型, Token, 数据)，数据为None时按新Token初始化；已存在的Token跳过，返回新增数量"""
         count = 0
-        for token in tokens:
-            if not token or not token.strip():
+        for token_type, token, data in records:
+            token = token.strip() if token else ""
+            if not token or token_type not in self.token_data or self._find_token(token)[0]:
                 continue
 
-            self.token_data[token_type.value][token] = {
-                "createdTime": int(time.time() * 1000),
-                "remainingQueries": -1,
-                "heavyremainingQueries": -1,
-                "status": "active",
-                "failedCount": 0,
-                "lastFailureTime": None,
-                "lastFailureReason": None,
-                "tags": [],
-                "note": ""
-            }
+            self.token_data[token_type][token] = {**self._new_token_data(), **data} if data else self._new_token_data()
             count += 1
+            self._mark_dirty(token)  # 批量保存
 
-        self._mark_dirty()  # 批量保存
-        logger.info(f"[Token] 添加 {count} 个 {token_type.value} Token")
+        if count:
+            self._notify_waiters()
+        return count
+
+    async def add_token(self, tokens: list[str], token_type: TokenType) -> int:
+        """添加Token（已存在的Token保留原有额度与失败记录），返回新增数量"""
+        if not tokens:
+            return 0
+
+        count = await self.import_tokens([(token_type.value, token, None) for token in tokens])
+        if count:
+            logger.info(f"[Token] 添加 {count} 个 {token_type.value} Token（跳过已存在 {len(tokens) - count} 个）")
+        return count
 
     async def delete_token(self, tokens: list[str], token_type: TokenType) -> None:
         """删除Token"""
@@ -211,9 +390,9 @@ class GrokTokenManager:
         for token in tokens:
             if token in self.token_data[token_type.value]:
                 del self.token_data[token_type.value][token]
+                self._mark_dirty(token)  # 批量保存
                 count += 1
 
-        self._mark_dirty()  # 批量保存
         logger.info(f"[Token] 删除 {count} 个 {token_type.value} Token")
 
     async def update_token_tags(self, token: str, token_type: TokenType, tags: list[str]) -> None:
@@ -223,7 +402,7 @@ class GrokTokenManager:
         
         cleaned = [t.strip() for t in tags if t and t.strip()]
         self.token_data[token_type.value][token]["tags"] = cleaned
-        self._mark_dirty()  # 批量保存
+        self._mark_dirty(token)  # 批量保存
         logger.info(f"[Token] 更新标签: {token[:10]}... -> {cleaned}")
 
     async def update_token_note(self, token: str, token_type: TokenType, note: str) -> None:
@@ -232,84 +411,239 @@ class GrokTokenManager:
             raise GrokApiException("Token不存在", "TOKEN_NOT_FOUND", {"token": token[:10]})
         
         self.token_data[token_type.value][token]["note"] = note.strip()
-        self._mark_dirty()  # 批量保存
+        self._mark_dirty(token)  # 批量保存
         logger.info(f"[Token] 更新备注: {token[:10]}...")
     
     def get_tokens(self) -> Dict[str, Any]:
         """获取所有Token"""
         return self.token_data.copy()
 
+    def query_tokens(self, **filters: Any) -> Tuple[int, List[Tuple[str, str, Dict[str, Any]]]]:
+        """按索引筛选、排序、分页Token（参数见 TokenIndex.query）"""
+        self._index.sync(self.token_data)
+        return self._index.query(self.token_data, **filters)
+
+    def get_token_stats(self) -> Dict[str, Dict[str, int]]:
+        """各类型Token的状态计数与额度合计"""
+        self._index.sync(self.token_data)
+        return self._index.stats()
+
+    def get_all_tags(self) -> List[str]:
+        """所有标签（已排序）"""
+        self._index.sync(self.token_data)
+        return self._index.tags()
+
     async def _reload_if_needed(self) -> None:
-        """在多进程模式下重新加载数据"""
-        # 只在文件模式且多进程环境下才重新加载
-        if self._storage:
+        """在多进程模式下同步其他进程的修改（按变更日志或SQLite行增量同步）"""
+        if self._save_pending:
             return
-        
-        def reload_sync():
-            with open(self.token_file, "r", encoding="utf-8") as f:
-                portalocker.lock(f, portalocker.LOCK_SH)
-                try:
-                    return orjson.loads(f.read())
-                finally:
-                    portalocker.unlock(f)
 
         try:
-            if self.token_file.exists():
-                self.token_data = await asyncio.to_thread(reload_sync)
+            if self._storage:
+                changes = await self._storage.load_token_changes()
+            else:
+                changes = await asyncio.to_thread(self._get_journal().read_changes)
+
+            if changes is None:
+                if self._storage:
+                    self.token_data = await self._storage.load_tokens()
+                else:
+                    self.token_data = await asyncio.to_thread(self._get_journal().load)
+                self._index.mark_all()
+                return
+            self._index.mark(sso for _, sso, _ in changes)
+            for token_type, sso, data in changes:
+                pool = self.token_data.setdefault(token_type, {})
+                if data is None:
+                    pool.pop(sso, None)
+                else:
+                    pool[sso] = data
         except Exception as e:
             logger.warning(f"[Token] 重新加载失败: {e}")
 
-    async def get_token(self, model: str) -> str:
-        """获取Token"""
-        jwt = await self.select_token(model)
-        return f"sso-rw={jwt};sso={jwt}"
-    
+    async def acquire(self, model: str) -> TokenLease:
+        """分配Token并返回租约"""
+        sso = await self.select_token(model)
+        return TokenLease(sso, self, self._get_health(sso).generation)
+
+    async def acquire_sso(self, sso: str, model: str) -> Optional[TokenLease]:
+        """为指定Token分配租约（会话续聊需使用会话所属Token），不可用时返回None"""
+        await self._reload_if_needed()
+        token_type, data = self._find_token(sso)
+        if data is None or (model == "grok-4-heavy" and token_type != TokenType.SUPER.value):
+            return None
+
+        if self._select_best({sso: data}, model, time.time() * 1000)[0] is None:
+            return None
+
+        self._inflight[sso] = self._inflight.get(sso, 0) + 1
+        return TokenLease(sso, self, self._get_health(sso).generation)
+
     async def select_token(self, model: str) -> str:
         """选择最优Token（多进程安全，支持冷却）"""
         # 重新加载最新数据（多进程模式）
         await self._reload_if_needed()
         
+        self._bucket_demand[Models.to_rate_limit(model)] = time.time()
+
         # 递减所有次数冷却计数
         self._request_counter += 1
+        released = False
         for token in list(self._cooldown_counts.keys()):
             self._cooldown_counts[token] -= 1
             if self._cooldown_counts[token] <= 0:
                 del self._cooldown_counts[token]
+                released = True
                 logger.debug(f"[Token] 冷却结束: {token[:10]}...")
+        if released:
+            self._notify_waiters()
+
+        # 已有请求排队时不插队，直接排到队尾
+        wait_timeout = setting.grok_config.get("token_wait_timeout", 0)
+        queued = wait_timeout and wait_timeout > 0 and self._waiters.get(self._model_class(model))
+        token_key, remaining = (None, None) if queued else self._try_select(model)
+
+        # 等待模式：短暂无可用Token时排队等待（等待者获得的Token已计入并发租约）
+        handed_off = False
+        if token_key is None and wait_timeout and wait_timeout > 0:
+            token_key, remaining = await self._wait_for_token(model, wait_timeout)
+            handed_off = token_key is not None
+
+        if token_key is None:
+            raise GrokApiException(
+                f"没有可用Token: {model}",
+                "NO_AVAILABLE_TOKEN",
+                {
+                    "model": model,
+                    "normal": len(self.token_data[TokenType.NORMAL.value]),
+                    "super": len(self.token_data[TokenType.SUPER.value]),
+                    "cooldown_count": len(self._cooldown_counts)
+                }
+            )
+
+        if not handed_off:
+            self._inflight[token_key] = self._inflight.get(token_key, 0) + 1
+
+        status = "未使用" if remaining == -1 else f"剩余{remaining}次"
+        logger.debug(f"[Token] 分配Token: {model} ({status}, 并发{self._inflight[token_key]})")
+        return token_key
+
+    def release_token(self, auth_token: str) -> None:
+        """释放Token租约（请求或流结束时调用）"""
+        sso = self._extract_sso(auth_token) if "sso=" in auth_token else auth_token
+        if not sso or sso not in self._inflight:
+            return
+        self._inflight[sso] -= 1
+        if self._inflight[sso] <= 0:
+            del self._inflight[sso]
+
+    def get_inflight(self, sso: str) -> int:
+        """获取Token进行中的请求数"""
+        return self._inflight.get(sso, 0)
+
+    def _get_health(self, sso: str) -> TokenHealth:
+        """获取Token健康度（不存在则创建）"""
+        health = self._health.get(sso)
+        if health is None:
+            health = TokenHealth()
+            self._health[sso] = health
+        return health
+
+    def record_result(self, auth_token: str, success: bool, ttfb: Optional[float] = None,
+                      duration: Optional[float] = None, chars: int = 0, generation: Optional[int] = None) -> None:
+        """记录请求结果到健康度统计
         
-        current_time = time.time() * 1000  # 毫秒
+        Args:
+            auth_token: 认证令牌
+            success: 是否成功
+            ttfb: 首字节耗时（秒）
+            duration: 首字节之后的流耗时（秒），仅文本对话传入
+            chars: 输出字符数
+            generation: 租约分配时的冷却代数
+        """
+        sso = self._extract_sso(auth_token) if "sso=" in auth_token else auth_token
+        if not sso:
+            return
+        throughput = chars / duration if success and duration and duration > 0 and chars else None
+        self._get_health(sso).observe(success, ttfb, throughput, generation)
+
+    def get_health(self, sso: str) -> Dict[str, Any]:
+        """获取Token健康度快照"""
+        health = self._health.get(sso)
+        return (health or TokenHealth()).to_dict()
+
+    @staticmethod
+    def _bucket_remaining(data: Dict[str, Any], model: str, current_time: float) -> int:
+        """Token在模型所属限额桶中的剩余次数（-1为未知）
+
+        已记录该桶时按桶判断，预计重置时间已过的耗尽桶视为未知；尚未按桶记录的旧数据沿用原字段。
+        """
+        quotas = data.get("quotas")
+        if not quotas:
+            return int(data.get("heavyremainingQueries" if model == "grok-4-heavy" else "remainingQueries", -1))
+
+        quota = quotas.get(Models.to_rate_limit(model))
+        if quota is None:
+            return -1
+        reset_at = quota.get("resetAt")
+        if quota.get("remaining") == 0 and reset_at and reset_at <= current_time:
+            return -1
+        return int(quota.get("remaining", -1))
+
+    def _selectable_remaining(self, key: str, data: Dict[str, Any], model: str, current_time: float) -> Optional[int]:
+        """Token可为该模型分配时返回所属限额桶的剩余次数（-1为未知），否则返回None"""
+        # 跳过已失效的token
+        if data.get("status") == "expired":
+            return None
         
-        def select_best(tokens: Dict[str, Any], field: str) -> Tuple[Optional[str], Optional[int]]:
-            """选择最佳Token"""
-            unused, used = [], []
+        # 跳过失败次数过多的token（任何错误状态码）
+        if data.get("failedCount", 0) >= MAX_FAILURES:
+            return None
+        
+        # 跳过次数冷却中的token
+        if key in self._cooldown_counts:
+            return None
+        
+        # 跳过时间冷却中的token（429）
+        cooldown_until = data.get("cooldownUntil", 0)
+        if cooldown_until and cooldown_until > current_time:
+            return None
 
-            for key, data in tokens.items():
-                # 跳过已失效的token
-                if data.get("status") == "expired":
-                    continue
-                
-                # 跳过失败次数过多的token（任何错误状态码）
-                if data.get("failedCount", 0) >= MAX_FAILURES:
-                    continue
-                
-                # 跳过次数冷却中的token
-                if key in self._cooldown_counts:
-                    continue
-                
-                # 跳过时间冷却中的token（429）
-                cooldown_until = data.get("cooldownUntil", 0)
-                if cooldown_until and cooldown_until > current_time:
-                    continue
+        remaining = self._bucket_remaining(data, model, current_time)
+        if remaining == 0 or remaining < -1:
+            return None
+        return remaining
 
-                remaining = int(data.get(field, -1))
-                if remaining == 0:
-                    continue
+    def available_count(self, model: str) -> int:
+        """当前可为该模型分配的Token数（不含冷却、失效与额度耗尽的Token）"""
+        current_time = time.time() * 1000
+        pools = [TokenType.SUPER.value] if model == "grok-4-heavy" else [TokenType.NORMAL.value, TokenType.SUPER.value]
+        return sum(
+            1
+            for pool in pools
+            for key, data in list(self.token_data[pool].items())
+            if self._selectable_remaining(key, data, model, current_time) is not None
+        )
+
+    def _select_best(self, tokens: Dict[str, Any], model: str, current_time: float) -> Tuple[Optional[str], Optional[int]]:
+        """选择最佳Token（按模型所属限额桶的剩余次数）"""
+        unused, used = [], []
 
-                if remaining == -1:
-                    unused.append(key)
-                elif remaining > 0:
-                    used.append((key, remaining))
+        for key, data in tokens.items():
+            remaining = self._selectable_remaining(key, data, model, current_time)
+            if remaining is None:
+                continue
+
+            if remaining == -1:
+                unused.append(key)
+            else:
+                used.append((key, remaining))
+
+        strategy = setting.grok_config.get("token_select_strategy", "least_loaded")
+        if strategy not in SELECT_STRATEGIES:
+            strategy = "least_loaded"
 
+        if strategy == "first":
             if unused:
                 return unused[0], -1
             if used:
@@ -317,6 +651,42 @@ class GrokTokenManager:
                 return used[0][0], used[0][1]
             return None, None
 
+        candidates = [(key, -1) for key in unused] + used
+        if not candidates:
+            return None, None
+        return self._pick_by_load(candidates, strategy)
+
+    def _pick_by_load(self, candidates: list[Tuple[str, int]], strategy: str) -> Tuple[str, int]:
+        """按并发租约挑选Token，避免并发请求集中到同一账号"""
+        def quota(remaining: int) -> int:
+            return UNKNOWN_QUOTA_WEIGHT if remaining == -1 else remaining
+
+        def score(key: str) -> float:
+            health = self._health.get(key)
+            return health.score() if health else 1.0
+
+        def load_key(item: Tuple[str, int]) -> Tuple[float, int]:
+            # 按健康度折算后的并发少者优先，其次剩余额度多者优先
+            return (self._inflight.get(item[0], 0) + 1) / score(item[0]), -quota(item[1])
+
+        if len(candidates) == 1:
+            return candidates[0]
+
+        if strategy == "least_loaded":
+            return min(candidates, key=load_key)
+
+        if strategy == "weighted":
+            weights = [quota(r) * score(k) / (self._inflight.get(k, 0) + 1) for k, r in candidates]
+            return random.choices(candidates, weights=weights, k=1)[0]
+
+        # p2c: 随机抽两个，取负载较低者
+        a, b = random.sample(candidates, 2)
+        return min(a, b, key=load_key)
+
+    def _try_select(self, model: str) -> Tuple[Optional[str], Optional[int]]:
+        """按模型尝试选择一个可用Token"""
+        current_time = time.time() * 1000  # 毫秒
+
         # 快照
         snapshot = {
             TokenType.NORMAL.value: self.token_data[TokenType.NORMAL.value].copy(),
@@ -325,29 +695,107 @@ class GrokTokenManager:
 
         # 选择策略
         if model == "grok-4-heavy":
-            field = "heavyremainingQueries"
-            token_key, remaining = select_best(snapshot[TokenType.SUPER.value], field)
-        else:
-            field = "remainingQueries"
-            token_key, remaining = select_best(snapshot[TokenType.NORMAL.value], field)
-            if token_key is None:
-                token_key, remaining = select_best(snapshot[TokenType.SUPER.value], field)
+            return self._select_best(snapshot[TokenType.SUPER.value], model, current_time)
 
+        token_key, remaining = self._select_best(snapshot[TokenType.NORMAL.value], model, current_time)
         if token_key is None:
-            raise GrokApiException(
-                f"没有可用Token: {model}",
-                "NO_AVAILABLE_TOKEN",
-                {
-                    "model": model,
-                    "normal": len(snapshot[TokenType.NORMAL.value]),
-                    "super": len(snapshot[TokenType.SUPER.value]),
-                    "cooldown_count": len(self._cooldown_counts)
-                }
-            )
+            token_key, remaining = self._select_best(snapshot[TokenType.SUPER.value], model, current_time)
+        return token_key, remaining
 
-        status = "未使用" if remaining == -1 else f"剩余{remaining}次"
-        logger.debug(f"[Token] 分配Token: {model} ({status})")
-        return token_key
+    @staticmethod
+    def _model_class(model: str) -> str:
+        """模型类别（等待队列按类别区分）"""
+        return "heavy" if model == "grok-4-heavy" else "normal"
+
+    async def _wait_for_token(self, model: str, timeout: float) -> Tuple[Optional[str], Optional[int]]:
+        """排队等待可用Token（FIFO，超过最长等待时间返回None）
+        
+        每个等待者在所属模型类别的队列中持有一个Future，Token可用时由 _notify_waiters
+        按排队顺序直接交给等待者（同时计入并发租约），新请求与轮询到期都不会插队。
+        其他进程（文件存储多worker）的变更无法通知到本进程，因此每次轮询到期都会
+        重新加载数据后再按顺序分配。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        queue = self._waiters.setdefault(self._model_class(model), deque())
+        waiter = loop.create_future()
+        entry = (model, waiter)
+        queue.append(entry)
+        logger.info(f"[Token] 暂无可用Token，排队等待: {model} (最长{timeout}s, 等待中{len(queue)})")
+
+        try:
+            # 队列中可能已有可用Token（例如前一个等待者刚超时离开）
+            self._notify_waiters()
+            while not waiter.done():
+                left = deadline - loop.time()
+                if left <= 0:
+                    break
+                self._schedule_cooldown_wakeup()
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter), timeout=min(left, TOKEN_WAIT_POLL))
+                except asyncio.TimeoutError:
+                    await self._reload_if_needed()
+                    self._notify_waiters()
+        except BaseException:
+            # 取消时若Token已交付则归还租约
+            if waiter.done() and not waiter.cancelled():
+                self.release_token(waiter.result()[0])
+            waiter.cancel()
+            raise
+        finally:
+            if entry in queue:
+                queue.remove(entry)
+
+        if not waiter.done():
+            waiter.cancel()
+            logger.warning(f"[Token] 等待Token超时: {model} ({timeout}s)")
+            return None, None
+
+        logger.info(f"[Token] 等待后获得Token: {model}")
+        return waiter.result()
+
+    def _schedule_cooldown_wakeup(self) -> None:
+        """在最近一个时间冷却或限额桶预计重置到期时唤醒等待者"""
+        now_ms = time.time() * 1000
+        earliest = None
+        for token_type in [TokenType.NORMAL.value, TokenType.SUPER.value]:
+            for data in self.token_data[token_type].values():
+                deadlines = [data.get("cooldownUntil", 0)]
+                deadlines.extend(quota.get("resetAt") or 0 for quota in (data.get("quotas") or {}).values())
+                for deadline in deadlines:
+                    if deadline and deadline > now_ms and (earliest is None or deadline < earliest):
+                        earliest = deadline
+
+        if earliest is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        when = loop.time() + (earliest - now_ms) / 1000
+        if self._cooldown_wakeup and not self._cooldown_wakeup.cancelled() and self._cooldown_wakeup.when() <= when:
+            return
+
+        if self._cooldown_wakeup:
+            self._cooldown_wakeup.cancel()
+        self._cooldown_wakeup = loop.call_at(when, self._on_cooldown_expired)
+
+    def _on_cooldown_expired(self) -> None:
+        """时间冷却到期回调"""
+        self._cooldown_wakeup = None
+        self._notify_waiters()
+
+    def _notify_waiters(self) -> None:
+        """按排队顺序把可用Token交给等待者（无可用Token的模型继续排队，不阻塞其他模型）"""
+        for queue in self._waiters.values():
+            for entry in list(queue):
+                model, waiter = entry
+                if waiter.done():
+                    continue
+                token_key, remaining = self._try_select(model)
+                if token_key is None:
+                    continue
+                queue.remove(entry)
+                self._inflight[token_key] = self._inflight.get(token_key, 0) + 1
+                waiter.set_result((token_key, remaining))
     
     async def check_limits(self, auth_token: str, model: str) -> Optional[Dict[str, Any]]:
         """检查速率限制"""
@@ -372,18 +820,19 @@ class GrokTokenManager:
                     # 异步获取代理（支持代理池）
                     from app.core.proxy_pool import proxy_pool
                     
-                    # 如果是403重试且使用代理池，强制刷新代理
-                    if retry_403_count > 0 and proxy_pool._enabled:
+                    # 如果是403重试且代理可轮换，作废本次租约所属的那一代代理
+                    if retry_403_count > 0 and proxy_pool.rotatable:
                         logger.info(f"[Token] 403重试 {retry_403_count}/{max_403_retries}，刷新代理...")
-                        proxy = await proxy_pool.force_refresh()
+                        proxy_lease = await proxy_pool.invalidate(proxy_lease, self._extract_sso(auth_token))
                     else:
-                        proxy = await setting.get_proxy_async("service")
+                        proxy_lease = await proxy_pool.acquire(self._extract_sso(auth_token))
+                    proxy = proxy_lease.url
                     
                     proxies = {"http": proxy, "https": proxy} if proxy else None
                     
                     async with AsyncSession() as session:
                         response = await session.post(
-                            RATE_LIMIT_API,
+                            setting.grok_url(RATE_LIMIT_PATH),
                             headers=headers,
                             json=payload,
                             impersonate=BROWSER,
@@ -391,8 +840,8 @@ class GrokTokenManager:
                             proxies=proxies
                         )
 
-                        # 内层403重试：仅当有代理池时触发
-                        if response.status_code == 403 and proxy_pool._enabled:
+                        # 内层403重试：仅当代理可轮换时触发
+                        if response.status_code == 403 and proxy_pool.rotatable:
                             retry_403_count += 1
                             
                             if retry_403_count <= max_403_retries:
@@ -431,12 +880,7 @@ class GrokTokenManager:
                                 logger.info(f"[Token] 重试成功！")
                             
                             if sso:
-                                if model == "grok-4-heavy":
-                                    await self.update_limits(sso, normal=None, heavy=data.get("remainingQueries", -1))
-                                    logger.info(f"[Token] 更新限制: {sso[:10]}..., heavy={data.get('remainingQueries', -1)}")
-                                else:
-                                    await self.update_limits(sso, normal=data.get("remainingTokens", -1), heavy=None)
-                                    logger.info(f"[Token] 更新限制: {sso[:10]}..., basic={data.get('remainingTokens', -1)}")
+                                await self.update_quota(sso, rate_model, data)
                             
                             return data
                         else:
@@ -451,23 +895,59 @@ class GrokTokenManager:
             logger.error(f"[Token] 检查限制错误: {e}")
             return None
 
+    async def update_quota(self, sso: str, bucket: str, limits: Dict[str, Any]) -> None:
+        """记录 /rest/rate-limits 返回的限额桶额度与窗口
+
+        耗尽时按 waitTimeSeconds（缺省为 windowSizeSeconds）预测重置时间并预约重新检查；
+        同时更新旧字段（普通/高级剩余次数）供列表与统计显示。
+        """
+        _, data = self._find_token(sso)
+        if data is None:
+            logger.warning(f"[Token] 未找到: {sso[:10]}...")
+            return
+
+        heavy = bucket == Models.to_rate_limit("grok-4-heavy")
+        remaining = limits.get("remainingQueries" if heavy else "remainingTokens", limits.get("remainingQueries", -1))
+        remaining = -1 if remaining is None else int(remaining)
+        window = int(limits.get("windowSizeSeconds") or 0)
+        now_ms = int(time.time() * 1000)
+
+        reset_at = None
+        if remaining == 0:
+            wait = limits.get("waitTimeSeconds") or window
+            if wait:
+                reset_at = now_ms + int(wait) * 1000
+                self.schedule_limit_check(sso, reset_at / 1000, bucket)
+
+        data.setdefault("quotas", {})[bucket] = {
+            "remaining": remaining,
+            "total": limits.get("totalQueries" if heavy else "totalTokens", limits.get("totalQueries")),
+            "window": window,
+            "resetAt": reset_at,
+            "checkedAt": now_ms,
+        }
+        logger.info(f"[Token] 更新限额: {sso[:10]}..., {bucket}={remaining}")
+        await self.update_limits(sso, normal=None if heavy else remaining, heavy=remaining if heavy else None)
+
     async def update_limits(self, sso: str, normal: Optional[int] = None, heavy: Optional[int] = None) -> None:
         """更新限制"""
         try:
             for token_type in [TokenType.NORMAL.value, TokenType.SUPER.value]:
                 if sso in self.token_data[token_type]:
+                    self.token_data[token_type][sso]["lastLimitCheck"] = int(time.time() * 1000)
                     if normal is not None:
                         self.token_data[token_type][sso]["remainingQueries"] = normal
                     if heavy is not None:
                         self.token_data[token_type][sso]["heavyremainingQueries"] = heavy
-                    self._mark_dirty()  # 批量保存
+                    self._mark_dirty(sso)  # 批量保存
                     logger.info(f"[Token] 更新限制: {sso[:10]}...")
+                    self._notify_waiters()
                     return
             logger.warning(f"[Token] 未找到: {sso[:10]}...")
         except Exception as e:
             logger.error(f"[Token] 更新限制错误: {e}")
     
-    async def record_failure(self, auth_token: str, status: int, msg: str) -> None:
+    async def record_failure(self, auth_token: str, status: int, msg: str, generation: Optional[int] = None) -> None:
         """记录失败"""
         try:
             if status == STATSIG_INVALID:
@@ -483,6 +963,7 @@ class GrokTokenManager:
                 logger.warning(f"[Token] 未找到: {sso[:10]}...")
                 return
 
+            self._get_health(sso).observe(False, generation=generation)
             data["failedCount"] = data.get("failedCount", 0) + 1
             data["lastFailureTime"] = int(time.time() * 1000)
             data["lastFailureReason"] = f"{status}: {msg}"
@@ -496,7 +977,7 @@ class GrokTokenManager:
                 data["status"] = "expired"
                 logger.error(f"[Token] 标记失效: {sso[:10]}... (连续{status}错误{data['failedCount']}次)")
 
-            self._mark_dirty()  # 批量保存
+            self._mark_dirty(sso)  # 批量保存
 
         except Exception as e:
             logger.error(f"[Token] 记录失败错误: {e}")
@@ -516,16 +997,24 @@ class GrokTokenManager:
                 data["failedCount"] = 0
                 data["lastFailureTime"] = None
                 data["lastFailureReason"] = None
-                self._mark_dirty()  # 批量保存
+                self._mark_dirty(sso)  # 批量保存
                 logger.info(f"[Token] 重置失败计数: {sso[:10]}...")
+                self._notify_waiters()
 
         except Exception as e:
             logger.error(f"[Token] 重置失败错误: {e}")
 
-    async def apply_cooldown(self, auth_token: str, status_code: int) -> None:
+    async def apply_cooldown(self, auth_token: str, status_code: int, generation: Optional[int] = None,
+                             model: Optional[str] = None) -> None:
         """应用冷却策略
-        - 429 错误：使用时间冷却（有额度1小时，无额度10小时）
+        - 429 错误：已知模型时只将该模型所属限额桶标记耗尽，直到预计重置时间（按记录的窗口预测，
+          未知时有额度1小时、无额度10小时）；Token仍可用于其他限额桶。未知模型时冷却整个Token
         - 其他错误：使用次数冷却（5次请求）
+        冷却时长按Token健康度的自适应倍数伸缩：冷却结束后新分配的首个请求成功则缩短，仍失败则延长
+        
+        Args:
+            generation: 触发冷却的请求分配时的冷却代数（未知时传None）
+            model: 请求的模型
         """
         try:
             sso = self._extract_sso(auth_token)
@@ -536,29 +1025,84 @@ class GrokTokenManager:
             if not data:
                 return
             
+            health = self._get_health(sso)
+            if generation is not None and generation < health.generation:
+                # 上一轮冷却前已在途的请求，Token已进入冷却，不重复处理
+                return
+            if health.recovering and generation == health.generation:
+                health.settle(False)
+
             remaining = data.get("remainingQueries", -1)
+            factor = health.cooldown_factor
             
-            if status_code == 429:
+            if status_code == 429 and model:
+                self._exhaust_bucket(sso, data, Models.to_rate_limit(model), factor)
+                health.enter_cooldown()
+                self._mark_dirty(sso)
+            elif status_code == 429:
                 # 429 使用时间冷却
                 if remaining > 0 or remaining == -1:
-                    # 有额度：冷却1小时
-                    cooldown_until = time.time() + COOLDOWN_429_WITH_QUOTA
-                    logger.info(f"[Token] 429冷却(有额度): {sso[:10]}... 冷却1小时")
+                    # 有额度：默认冷却1小时
+                    seconds = COOLDOWN_429_WITH_QUOTA * factor
+                    logger.info(f"[Token] 429冷却(有额度): {sso[:10]}... 冷却{seconds / 60:.0f}分钟")
                 else:
-                    # 无额度：冷却10小时
-                    cooldown_until = time.time() + COOLDOWN_429_NO_QUOTA
-                    logger.info(f"[Token] 429冷却(无额度): {sso[:10]}... 冷却10小时")
-                data["cooldownUntil"] = int(cooldown_until * 1000)
-                self._mark_dirty()
+                    # 无额度：默认冷却10小时
+                    seconds = COOLDOWN_429_NO_QUOTA * factor
+                    logger.info(f"[Token] 429冷却(无额度): {sso[:10]}... 冷却{seconds / 3600:.1f}小时")
+                data["cooldownUntil"] = int((time.time() + seconds) * 1000)
+                health.enter_cooldown()
+                self.schedule_limit_check(sso, data["cooldownUntil"] / 1000)
+                self._mark_dirty(sso)
             else:
                 # 其他错误使用次数冷却（有额度时才冷却）
                 if remaining != 0:
-                    self._cooldown_counts[sso] = COOLDOWN_REQUESTS
-                    logger.info(f"[Token] 次数冷却: {sso[:10]}... 冷却{COOLDOWN_REQUESTS}次请求")
+                    count = max(1, round(COOLDOWN_REQUESTS * factor))
+                    self._cooldown_counts[sso] = count
+                    health.enter_cooldown()
+                    logger.info(f"[Token] 次数冷却: {sso[:10]}... 冷却{count}次请求")
         
         except Exception as e:
             logger.error(f"[Token] 应用冷却错误: {e}")
 
+    def _exhaust_bucket(self, sso: str, data: Dict[str, Any], bucket: str, factor: float) -> None:
+        """429时将限额桶标记耗尽并预测重置时间"""
+        now_ms = int(time.time() * 1000)
+        quota = data.setdefault("quotas", {}).setdefault(bucket, {"remaining": -1, "window": 0, "checkedAt": 0})
+        reset_at = quota.get("resetAt") or 0
+        if reset_at <= now_ms and quota.get("window") and quota.get("checkedAt"):
+            # 滚动窗口：上次检查时窗口内最早的请求最迟在 检查时间+窗口 过期
+            reset_at = quota["checkedAt"] + quota["window"] * 1000
+        if reset_at <= now_ms:
+            seconds = (COOLDOWN_429_WITH_QUOTA if quota.get("remaining", -1) != 0 else COOLDOWN_429_NO_QUOTA) * factor
+            reset_at = int(now_ms + seconds * 1000)
+
+        quota["remaining"] = 0
+        quota["resetAt"] = reset_at
+        self.schedule_limit_check(sso, reset_at / 1000, bucket)
+        logger.info(f"[Token] 429限额耗尽: {sso[:10]}... {bucket}，预计{(reset_at - now_ms) / 60000:.0f}分钟后重置")
+
+    def _refresh_buckets(self, token_type: str) -> list[str]:
+        """需要刷新的限额桶：最近有请求的桶，尚无请求时为该类型Token可用的全部桶"""
+        now = time.time()
+        heavy = Models.to_rate_limit("grok-4-heavy")
+        buckets = [bucket for bucket, used in self._bucket_demand.items() if now - used <= RATE_LIMIT_DEMAND_TTL]
+        if not buckets:
+            buckets = list(dict.fromkeys(Models.to_rate_limit(m) for m in Models.get_all_model_names()))
+        if token_type != TokenType.SUPER.value:
+            buckets = [bucket for bucket in buckets if bucket != heavy]
+        return buckets
+
+    async def refresh_token_limits(self, sso: str, bucket: Optional[str] = None) -> bool:
+        """刷新Token的限额（指定桶或全部需要刷新的桶），任一成功返回True"""
+        token_type, _ = self._find_token(sso)
+        if token_type is None:
+            return False
+        auth_token = f"sso-rw={sso};sso={sso}"
+        ok = False
+        for name in ([bucket] if bucket else self._refresh_buckets(token_type)):
+            ok = bool(await self.check_limits(auth_token, name)) or ok
+        return ok
+
     async def refresh_all_limits(self) -> Dict[str, Any]:
         """刷新所有 Token 的剩余次数"""
         # 检查是否已在刷新
@@ -582,10 +1126,8 @@ class GrokTokenManager:
             fail_count = 0
             
             for i, (token_type, sso) in enumerate(all_tokens):
-                auth_token = f"sso-rw={sso};sso={sso}"
                 try:
-                    result = await self.check_limits(auth_token, "grok-4-fast")
-                    if result:
+                    if await self.refresh_token_limits(sso):
                         success_count += 1
                     else:
                         fail_count += 1
@@ -610,6 +1152,153 @@ class GrokTokenManager:
         finally:
             self._refresh_lock = False
     
+    def schedule_limit_check(self, sso: str, due: float, bucket: Optional[str] = None) -> None:
+        """预约在指定时间（秒级时间戳）检查Token限额（bucket为空时检查全部需要刷新的桶）"""
+        heapq.heappush(self._refresh_queue, (due, sso, bucket or ""))
+
+    async def start_limit_refresher(self) -> None:
+        """启动后台限额刷新任务"""
+        if self._refresher_task is not None:
+            return
+        if not setting.grok_config.get("limit_refresh_enabled", True):
+            logger.info("[Token] 后台限额刷新已禁用")
+            return
+
+        # 按现有冷却到期与限额桶预计重置时间预约
+        for token_type in [TokenType.NORMAL.value, TokenType.SUPER.value]:
+            for sso, data in self.token_data[token_type].items():
+                if cooldown_until := data.get("cooldownUntil"):
+                    self.schedule_limit_check(sso, cooldown_until / 1000)
+                for bucket, quota in (data.get("quotas") or {}).items():
+                    if quota.get("remaining") == 0 and quota.get("resetAt"):
+                        self.schedule_limit_check(sso, quota["resetAt"] / 1000, bucket)
+
+        self._refresher_task = asyncio.create_task(self._limit_refresh_worker())
+        logger.info(f"[Token] 后台限额刷新已启动，预约{len(self._refresh_queue)}个")
+
+    def _pop_due_token(self, now: float) -> Optional[Tuple[str, str]]:
+        """弹出一个已到期且仍需检查的 (Token, 限额桶)"""
+        while self._refresh_queue and self._refresh_queue[0][0] <= now:
+            due, sso, bucket = heapq.heappop(self._refresh_queue)
+            _, data = self._find_token(sso)
+            if not data or data.get("status") == "expired":
+                continue
+            if bucket:
+                quota = (data.get("quotas") or {}).get(bucket) or {}
+                # 预计重置时间被推迟时已有新的预约；到期后已被请求刷新过
+                if (quota.get("resetAt") or 0) / 1000 > now or quota.get("checkedAt", 0) / 1000 >= due:
+                    continue
+                return sso, bucket
+            # 冷却被延长时已有新的预约，跳过旧条目
+            cooldown_until = data.get("cooldownUntil", 0)
+            if cooldown_until and cooldown_until / 1000 > now:
+                continue
+            # 冷却到期后已被请求刷新过
+            if data.get("lastLimitCheck", 0) / 1000 >= due:
+                continue
+            return sso, bucket
+        return None
+
+    def _sample_stale_tokens(self, count: int, now: float) -> list[str]:
+        """抽样需要检查的Token
+        
+        优先冷却已到期但之后未检查过的Token（含其他worker施加的冷却），其次额度未知或长时间未检查的Token。
+        """
+        stale_after = setting.grok_config.get("limit_refresh_stale_seconds", 3600)
+        now_ms = now * 1000
+        expired, stale = [], []
+        for token_type in [TokenType.NORMAL.value, TokenType.SUPER.value]:
+            for sso, data in self.token_data[token_type].items():
+                if data.get("status") == "expired" or data.get("failedCount", 0) >= MAX_FAILURES:
+                    continue
+                cooldown_until = data.get("cooldownUntil", 0)
+                if cooldown_until and cooldown_until > now_ms:
+                    continue
+                checked = data.get("lastLimitCheck", 0)
+                if cooldown_until and checked < cooldown_until:
+                    expired.append(sso)
+                elif data.get("remainingQueries", -1) == -1 or now_ms - checked >= stale_after * 1000:
+                    stale.append((checked, sso))
+
+        picked = expired[:count]
+        count -= len(picked)
+        if count <= 0:
+            return picked
+        if len(stale) <= count:
+            return picked + [sso for _, sso in stale]
+        # 在最久未检查的一批中随机抽取，避免每次都选中同一批
+        stale.sort()
+        return picked + [sso for _, sso in random.sample(stale[:count * 4], count)]
+
+    def _acquire_refresher_lock(self) -> bool:
+        """抢占主机级刷新锁：多worker时只有一个进程执行后台刷新，避免检查频率按worker数放大"""
+        if self._refresher_lock_file is not None:
+            return True
+        f = open(self.token_file.parent / LIMIT_REFRESH_LOCK, "a")
+        try:
+            portalocker.lock(f, portalocker.LOCK_EX | portalocker.LOCK_NB)
+        except portalocker.LockException:
+            f.close()
+            return False
+        self._refresher_lock_file = f
+        logger.info(f"[Token] 本进程负责后台限额刷新 (pid={os.getpid()})")
+        return True
+
+    def _release_refresher_lock(self) -> None:
+        """释放主机级刷新锁"""
+        if self._refresher_lock_file is None:
+            return
+        try:
+            portalocker.unlock(self._refresher_lock_file)
+        finally:
+            self._refresher_lock_file.close()
+            self._refresher_lock_file = None
+
+    async def _limit_refresh_worker(self) -> None:
+        """后台限额刷新：冷却到期优先，剩余预算抽样陈旧Token（令牌桶限速）"""
+        budget = 0.0
+        last = time.time()
+
+        while not self._shutdown:
+            await asyncio.sleep(LIMIT_REFRESH_TICK)
+            if not self._acquire_refresher_lock():
+                # 其他进程负责刷新，仅丢弃本进程已到期的预约
+                while self._refresh_queue and self._refresh_queue[0][0] <= time.time():
+                    heapq.heappop(self._refresh_queue)
+                last = time.time()
+                continue
+            if self._refresh_lock:
+                continue
+
+            per_minute = max(0, setting.grok_config.get("limit_refresh_budget", 6))
+            now = time.time()
+            budget = min(float(per_minute), budget + (now - last) * per_minute / 60)
+            last = now
+
+            batch: list[Tuple[str, str]] = []
+            while budget >= 1 and (due := self._pop_due_token(now)):
+                batch.append(due)
+                budget -= 1
+            if budget >= 1:
+                queued = {sso for sso, _ in batch}
+                for sso in self._sample_stale_tokens(int(budget), now):
+                    if sso not in queued:
+                        batch.append((sso, ""))
+                        budget -= 1
+
+            for sso, bucket in batch:
+                try:
+                    _, data = self._find_token(sso)
+                    if data is not None:
+                        data["lastLimitCheck"] = int(now * 1000)
+                        self._mark_dirty(sso)
+                    await self.refresh_token_limits(sso, bucket or None)
+                except Exception as e:
+                    logger.warning(f"[Token] 后台刷新失败: {sso[:10]}... - {e}")
+
+            if batch:
+                logger.debug(f"[Token] 后台刷新{len(batch)}个Token，待预约{len(self._refresh_queue)}个")
+
     def get_refresh_progress(self) -> Dict[str, Any]:
         """获取刷新进度"""
         return self._refresh_progress.copy()
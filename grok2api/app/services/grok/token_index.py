@@ -0,0 +1,257 @@
+"""Token二级索引 - 管理后台列表的筛选、排序与统计
+
+按Token维护类型、基础状态、标签、冷却截止时间与额度，并维护各状态计数与额度合计；
+Token变更时由 TokenManager 标记，查询前增量更新，列表只对候选集合排序分页。
+冷却状态随时间变化，只记录冷却截止时间，在查询时叠加到基础状态上。
+"""
+
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.models.grok_models import TokenType
+
+
+TOKEN_TYPES = (TokenType.NORMAL.value, TokenType.SUPER.value)
+BASE_CATEGORIES = ("unused", "exhausted", "active", "expired")
+CATEGORY_LABELS = {
+    "unused": "未使用",
+    "cooldown": "冷却中",
+    "exhausted": "额度耗尽",
+    "expired": "失效",
+    "active": "正常",
+}
+SORT_KEYS = ("created_time", "remaining", "heavy_remaining", "cooldown", "failure_time", "token")
+
+
+def _to_int(value: Any, default: int = 0) -> int:
+    try:
+        return int(value) if value not in (None, "") else default
+    except (TypeError, ValueError):
+        return default
+
+
+def base_category(data: Dict[str, Any], token_type: str) -> str:
+    """不含冷却的基础状态：expired/unused/exhausted/active"""
+    if data.get("status") == "expired":
+        return "expired"
+
+    remaining = data.get("remainingQueries", -1)
+    heavy_remaining = data.get("heavyremainingQueries", -1)
+    if token_type == TokenType.SUPER.value:
+        if remaining == -1 and heavy_remaining == -1:
+            return "unused"
+        if remaining == 0 or heavy_remaining == 0:
+            return "exhausted"
+        return "active"
+
+    if remaining == -1:
+        return "unused"
+    if remaining == 0:
+        return "exhausted"
+    return "active"
+
+
+def token_category(data: Dict[str, Any], token_type: str, now_ms: Optional[int] = None) -> str:
+    """Token当前状态（失效优先，其次429冷却）"""
+    category = base_category(data, token_type)
+    if category == "expired":
+        return category
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    return "cooldown" if _to_int(data.get("cooldownUntil")) > now_ms else category
+
+
+@dataclass(slots=True)
+class IndexEntry:
+    """单个Token的索引项"""
+    token_type: str
+    category: str
+    tags: Tuple[str, ...]
+    cooldown_until: int
+    remaining: int
+    heavy_remaining: int
+    created_time: int
+    failure_time: int
+
+
+class TokenIndex:
+    """Token二级索引（由 TokenManager 持有，仅在事件循环中访问）"""
+
+    def __init__(self):
+        self._entries: Dict[str, IndexEntry] = {}
+        self._by_status: Dict[Tuple[str, str], Set[str]] = defaultdict(set)  # (类型, 基础状态) -> Token
+        self._by_tag: Dict[str, Set[str]] = defaultdict(set)
+        self._cooling: Dict[str, int] = {}  # 设置了冷却截止时间的Token（到期后查询时移除）
+        self._quota: Dict[str, List[int]] = {t: [0, 0] for t in TOKEN_TYPES}  # 类型 -> [普通剩余, 高级剩余]
+        self._source: Optional[Dict[str, Any]] = None
+        self._pending: Set[str] = set()
+        self._stale = True
+
+    # === 维护 ===
+
+    def mark(self, ssos: Iterable[str]) -> None:
+        """标记需要重新索引的Token"""
+        self._pending.update(ssos)
+
+    def mark_all(self) -> None:
+        """标记整体重建"""
+        self._stale = True
+        self._pending.clear()
+
+    def sync(self, token_data: Dict[str, Any]) -> None:
+        """查询前应用待更新的Token（数据对象被替换时整体重建）"""
+        if self._stale or token_data is not self._source:
+            self._rebuild(token_data)
+            return
+        for sso in self._pending:
+            self._remove(sso)
+            for token_type in TOKEN_TYPES:
+                data = token_data.get(token_type, {}).get(sso)
+                if data is not None:
+                    self._add(sso, token_type, data)
+                    break
+        self._pending.clear()
+
+    def _rebuild(self, token_data: Dict[str, Any]) -> None:
+        self._entries.clear()
+        self._by_status.clear()
+        self._by_tag.clear()
+        self._cooling.clear()
+        self._quota = {t: [0, 0] for t in TOKEN_TYPES}
+        for token_type in TOKEN_TYPES:
+            for sso, data in token_data.get(token_type, {}).items():
+                self._add(sso, token_type, data)
+        self._source = token_data
+        self._pending.clear()
+        self._stale = False
+
+    def _add(self, sso: str, token_type: str, data: Dict[str, Any]) -> None:
+        tags = data.get("tags")
+        entry = IndexEntry(
+            token_type=token_type,
+            category=base_category(data, token_type),
+            tags=tuple(tags) if isinstance(tags, list) else (),
+            cooldown_until=_to_int(data.get("cooldownUntil")),
+            remaining=_to_int(data.get("remainingQueries"), -1),
+            heavy_remaining=_to_int(data.get("heavyremainingQueries"), -1),
+            created_time=_to_int(data.get("createdTime")),
+            failure_time=_to_int(data.get("lastFailureTime")),
+        )
+        self._entries[sso] = entry
+        self._by_status[(token_type, entry.category)].add(sso)
+        for tag in entry.tags:
+            self._by_tag[tag].add(sso)
+        if entry.cooldown_until:
+            self._cooling[sso] = entry.cooldown_until
+        quota = self._quota[token_type]
+        quota[0] += max(entry.remaining, 0)
+        quota[1] += max(entry.heavy_remaining, 0)
+
+    def _remove(self, sso: str) -> None:
+        entry = self._entries.pop(sso, None)
+        if entry is None:
+            return
+        self._by_status[(entry.token_type, entry.category)].discard(sso)
+        for tag in entry.tags:
+            tagged = self._by_tag.get(tag)
+            if tagged is not None:
+                tagged.discard(sso)
+                if not tagged:
+                    del self._by_tag[tag]
+        self._cooling.pop(sso, None)
+        quota = self._quota[entry.token_type]
+        quota[0] -= max(entry.remaining, 0)
+        quota[1] -= max(entry.heavy_remaining, 0)
+
+    def _cooling_now(self, now_ms: int) -> Set[str]:
+        """当前处于冷却中的Token（清理已到期的记录，失效Token不计入冷却）"""
+        expired = [sso for sso, until in self._cooling.items() if until <= now_ms]
+        for sso in expired:
+            del self._cooling[sso]
+        return {sso for sso in self._cooling if self._entries[sso].category != "expired"}
+
+    # === 查询 ===
+
+    def stats(self, now_ms: Optional[int] = None) -> Dict[str, Dict[str, int]]:
+        """各类型状态计数与额度合计"""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        result = {}
+        for token_type in TOKEN_TYPES:
+            counts = {category: len(self._by_status.get((token_type, category), ())) for category in BASE_CATEGORIES}
+            counts["cooldown"] = 0
+            result[token_type] = counts
+        for sso in self._cooling_now(now_ms):
+            entry = self._entries[sso]
+            counts = result[entry.token_type]
+            counts[entry.category] -= 1
+            counts["cooldown"] += 1
+
+        for token_type, counts in result.items():
+            counts["total"] = sum(counts.values())
+            counts["limited"] = counts["cooldown"] + counts["exhausted"]
+            counts["remaining_queries"], counts["heavy_remaining_queries"] = self._quota[token_type]
+        return result
+
+    def tags(self) -> List[str]:
+        return sorted(self._by_tag)
+
+    def query(
+        self,
+        token_data: Dict[str, Any],
+        token_type: Optional[str] = None,
+        status: Optional[str] = None,
+        tag: Optional[str] = None,
+        cooldown: Optional[bool] = None,
+        search: Optional[str] = None,
+        sort: str = "created_time",
+        desc: bool = True,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        now_ms: Optional[int] = None,
+    ) -> Tuple[int, List[Tuple[str, str, Dict[str, Any]]]]:
+        """筛选、排序并分页
+
+        Returns:
+            (匹配总数, [(Token, 类型, 数据)])
+        """
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        cooling = self._cooling_now(now_ms)
+        types = [token_type] if token_type else list(TOKEN_TYPES)
+
+        if status == "cooldown":
+            candidates = {sso for sso in cooling if self._entries[sso].token_type in types}
+        elif status:
+            candidates = set().union(*(self._by_status.get((t, status), ()) for t in types)) - cooling
+        elif token_type:
+            candidates = set().union(*(self._by_status.get((token_type, c), ()) for c in BASE_CATEGORIES))
+        else:
+            candidates = set(self._entries)
+
+        if tag:
+            candidates &= self._by_tag.get(tag, set())
+        if cooldown is not None:
+            candidates = candidates & cooling if cooldown else candidates - cooling
+        if search:
+            needle = search.lower()
+            candidates = {
+                sso for sso in candidates
+                if needle in sso.lower()
+                or needle in str(token_data[self._entries[sso].token_type][sso].get("note") or "").lower()
+            }
+
+        # 相同排序值按Token排序，保证翻页稳定
+        entries = self._entries
+        if sort == "token":
+            key = None
+        elif sort == "cooldown":
+            key = lambda sso: (entries[sso].cooldown_until if sso in cooling else 0, sso)
+        else:
+            field = sort if sort in SORT_KEYS else "created_time"
+            key = lambda sso: (getattr(entries[sso], field), sso)
+        ordered = sorted(candidates, key=key, reverse=desc)
+
+        page = ordered[offset:offset + limit] if limit else ordered[offset:]
+        return len(ordered), [
+            (sso, entries[sso].token_type, token_data[entries[sso].token_type][sso]) for sso in page
+        ]
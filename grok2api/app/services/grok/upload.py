@@ -2,11 +2,14 @@
 
 import asyncio
 import base64
+import hashlib
 import re
-from typing import Tuple, Optional
+from collections import OrderedDict
+from typing import NamedTuple, Tuple, Optional, Union
 from urllib.parse import urlparse
 from curl_cffi.requests import AsyncSession
 
+from app.services.grok import imaging
 from app.services.grok.statsig import get_dynamic_headers
 from app.core.exception import GrokApiException
 from app.core.config import setting
@@ -14,7 +17,7 @@ from app.core.logger import logger
 
 
 # 常量
-UPLOAD_API = "https://grok.com/rest/app-chat/upload-file"
+UPLOAD_PATH = "/rest/app-chat/upload-file"
 TIMEOUT = 30
 BROWSER = "chrome133a"
 
@@ -25,32 +28,146 @@ MIME_TYPES = {
 }
 DEFAULT_MIME = "image/jpeg"
 DEFAULT_EXT = "jpg"
+_UNCHANGED = object()  # 规范化缓存标记：图片无需规范化，上传原图
+
+
+class PreparedImage(NamedTuple):
+    """已下载并规范化、可直接上传的图片（同一图片上传到多个Token时复用）"""
+    filename: str
+    mime: str
+    content: str  # Base64
+
+
+class ImageNormalizer:
+    """上传前图片规范化（单例；缩小、去元数据、重新压缩），在图片处理进程池中执行
+
+    结果按内容哈希缓存（LRU + 内存上限），同一图片在多轮对话中重复发送时复用。
+    """
+
+    _instance: Optional['ImageNormalizer'] = None
+
+    def __new__(cls) -> 'ImageNormalizer':
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        # 内容哈希 -> ((Base64, MIME) 或 _UNCHANGED, 占用字节数)
+        self._cache: "OrderedDict[str, Tuple[Union[Tuple[str, str], object], int]]" = OrderedDict()
+        self._size = 0
+        self._initialized = True
+
+    @staticmethod
+    def enabled() -> bool:
+        """是否启用规范化（需开启 image_normalize 且已安装 Pillow）"""
+        return imaging.AVAILABLE and setting.global_config.get("image_normalize", False)
+
+    async def normalize(self, buffer: str, mime: str) -> Tuple[str, str]:
+        """规范化Base64图片，小于阈值、无法解码或无收益时原样返回
+
+        Returns:
+            (base64_string, mime_type) 元组
+        """
+        min_bytes = int(setting.global_config.get("image_normalize_min_kb", 256)) * 1024
+        if len(buffer) * 3 // 4 < min_bytes:
+            return buffer, mime
+
+        max_dimension = int(setting.global_config.get("image_normalize_max_dimension", 2048))
+        quality = int(setting.global_config.get("image_normalize_quality", 85))
+
+        def decode() -> Tuple[bytes, str]:
+            raw = base64.b64decode(buffer)
+            return raw, hashlib.sha256(raw).hexdigest() + f":{max_dimension}:{quality}"
+
+        raw, key = await asyncio.to_thread(decode)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            cached, _ = self._cache[key]
+            return (buffer, mime) if cached is _UNCHANGED else cached
+
+        try:
+            result = await imaging.run(imaging.normalize, raw, max_dimension, quality)
+        except Exception as e:
+            logger.warning(f"[Upload] 图片规范化失败，上传原图: {e}")
+            return buffer, mime
+
+        if result is None:
+            # 无收益：只记录标记，不缓存原图
+            self._put(key, _UNCHANGED)
+            return buffer, mime
+
+        data, normalized_mime = result
+        normalized = await asyncio.to_thread(lambda: base64.b64encode(data).decode()), normalized_mime
+        logger.debug(f"[Upload] 图片规范化: {len(raw) // 1024}KB -> {len(data) // 1024}KB")
+        self._put(key, normalized)
+        return normalized
+
+    def _put(self, key: str, value: Union[Tuple[str, str], object]) -> None:
+        """写入缓存（超出内存上限时淘汰最久未使用的条目）"""
+        size = len(key) + (0 if value is _UNCHANGED else len(value[0]))
+        max_bytes = int(setting.global_config.get("image_normalize_cache_mb", 32)) * 1024 * 1024
+        if size > max_bytes:
+            return
+
+        if previous := self._cache.pop(key, None):
+            self._size -= previous[1]
+        self._cache[key] = (value, size)
+        self._size += size
+        while self._size > max_bytes:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self._size -= evicted
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._cache.clear()
+        self._size = 0
 
 
 class ImageUploadManager:
     """图片上传管理器"""
 
     @staticmethod
-    async def upload(image_input: str, auth_token: str) -> Tuple[str, str]:
-        """上传图片（支持Base64或URL）
+    async def prepare(image_input: str) -> Optional[PreparedImage]:
+        """准备上传数据：下载URL图片并按配置规范化（下载失败返回None）"""
+        # 判断类型并处理
+        if ImageUploadManager._is_url(image_input):
+            buffer, mime = await ImageUploadManager._download(image_input)
+            filename, _ = ImageUploadManager._get_info("", mime)
+        else:
+            buffer = image_input.split(",")[1] if "data:image" in image_input else image_input
+            filename, mime = ImageUploadManager._get_info(image_input)
+
+        if not buffer:
+            return None
+
+        # 上传前规范化（可选）
+        if ImageNormalizer.enabled():
+            buffer, normalized_mime = await image_normalizer.normalize(buffer, mime)
+            if normalized_mime != mime:
+                filename, mime = ImageUploadManager._get_info("", normalized_mime)
+
+        return PreparedImage(filename, mime, buffer)
+
+    @staticmethod
+    async def upload(image_input: Union[str, PreparedImage], auth_token: str) -> Tuple[str, str]:
+        """上传图片（支持Base64、URL或已准备的图片）
         
         Returns:
             (file_id, file_uri) 元组
         """
         try:
-            # 判断类型并处理
-            if ImageUploadManager._is_url(image_input):
-                buffer, mime = await ImageUploadManager._download(image_input)
-                filename, _ = ImageUploadManager._get_info("", mime)
-            else:
-                buffer = image_input.split(",")[1] if "data:image" in image_input else image_input
-                filename, mime = ImageUploadManager._get_info(image_input)
+            image = image_input if isinstance(image_input, PreparedImage) else await ImageUploadManager.prepare(image_input)
+            if image is None:
+                return "", ""
 
             # 构建数据
             data = {
-                "fileName": filename,
-                "fileMimeType": mime,
-                "content": buffer,
+                "fileName": image.filename,
+                "fileMimeType": image.mime,
+                "content": image.content,
             }
 
 
@@ -78,19 +195,20 @@ class ImageUploadManager:
                         # 异步获取代理（支持代理池）
                         from app.core.proxy_pool import proxy_pool
                         
-                        # 如果是403重试且使用代理池，强制刷新代理
-                        if retry_403_count > 0 and proxy_pool._enabled:
+                        # 如果是403重试且代理可轮换，作废本次租约所属的那一代代理
+                        if retry_403_count > 0 and proxy_pool.rotatable:
                             logger.info(f"[Upload] 403重试 {retry_403_count}/{max_403_retries}，刷新代理...")
-                            proxy = await proxy_pool.force_refresh()
+                            proxy_lease = await proxy_pool.invalidate(proxy_lease, None)
                         else:
-                            proxy = await setting.get_proxy_async("service")
+                            proxy_lease = await proxy_pool.acquire(None)
+                        proxy = proxy_lease.url
                         
                         proxies = {"http": proxy, "https": proxy} if proxy else None
 
                         # 上传
                         async with AsyncSession() as session:
                             response = await session.post(
-                                UPLOAD_API,
+                                setting.grok_url(UPLOAD_PATH),
                                 headers=headers,
                                 json=data,
                                 impersonate=BROWSER,
@@ -98,8 +216,8 @@ class ImageUploadManager:
                                 proxies=proxies,
                             )
 
-                            # 内层403重试：仅当有代理池时触发
-                            if response.status_code == 403 and proxy_pool._enabled:
+                            # 内层403重试：仅当代理可轮换时触发
+                            if response.status_code == 403 and proxy_pool.rotatable:
                                 retry_403_count += 1
                                 
                                 if retry_403_count <= max_403_retries:
@@ -206,4 +324,8 @@ class ImageUploadManager:
                 mime = match.group(1)
                 ext = mime.split("/")[1]
 
-        return f"image.{ext}", mime
\ No newline at end of file
+        return f"image.{ext}", mime
+
+
+# 全局实例
+image_normalizer = ImageNormalizer()
@@ -0,0 +1,160 @@
+"""注册输出导入 - 增量导入注册机生成的 keys/grok.txt
+
+记录 grok.txt 的 inode 与已读取的字节偏移（data/key_import.json），每次只读取新追加的
+完整行并跳过已存在的Token；后台按间隔检查文件变化，注册进行中新账号数秒内进入Token池。
+"""
+
+import os
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.core.storage import atomic_write
+from app.models.grok_models import TokenType
+from app.services.grok.token import token_manager
+
+
+CHECKPOINT_FILE = Path(__file__).parents[2] / "data" / "key_import.json"
+
+
+class KeyImporter:
+    """注册输出增量导入器（单例）"""
+
+    _instance: Optional['KeyImporter'] = None
+
+    def __new__(cls) -> 'KeyImporter':
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        self.keys_file: Optional[Path] = None  # 由注册机模块设置
+        self.checkpoint_file = CHECKPOINT_FILE
+        self._checkpoint: Optional[Dict[str, Any]] = None  # {"file": (dev, inode), "offset": 已读取字节}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._initialized = True
+
+    # === 检查点 ===
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        try:
+            return orjson.loads(self.checkpoint_file.read_bytes())
+        except FileNotFoundError:
+            return {"file": None, "offset": 0}
+        except Exception as e:
+            logger.warning(f"[KeyImport] 检查点读取失败，从头导入: {e}")
+            return {"file": None, "offset": 0}
+
+    def _save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.checkpoint_file, orjson.dumps(checkpoint))
+
+    def _read_new_lines(self, checkpoint: Dict[str, Any], rescan: bool) -> Tuple[List[str], Dict[str, Any]]:
+        """读取检查点之后新增的完整行（文件被替换或截断时从头读取）"""
+        try:
+            st = os.stat(self.keys_file)
+        except FileNotFoundError:
+            return [], {"file": None, "offset": 0}
+
+        file_id = [st.st_dev, st.st_ino]
+        offset = checkpoint["offset"]
+        if rescan or checkpoint["file"] != file_id or st.st_size < offset:
+            offset = 0
+        if st.st_size == offset:
+            return [], {"file": file_id, "offset": offset}
+
+        with open(self.keys_file, "rb") as f:
+            f.seek(offset)
+            chunk = f.read()
+        # 只处理完整行（注册机可能正在写入最后一行），手动全量导入时包含末行
+        end = len(chunk) if rescan else chunk.rfind(b"\n") + 1
+        lines = chunk[:end].decode("utf-8", errors="ignore").splitlines()
+        return [line.strip() for line in lines if line.strip()], {"file": file_id, "offset": offset + end}
+
+    # === 导入 ===
+
+    async def sync(self, rescan: bool = False) -> Dict[str, int]:
+        """导入新增的Token
+
+        Args:
+            rescan: 忽略检查点重新扫描整个文件（已存在的Token仍跳过）
+
+        Returns:
+            {"read": 读取行数, "added": 新增Token数}
+        """
+        if self.keys_file is None:
+            return {"read": 0, "added": 0}
+
+        async with self._lock:
+            if self._checkpoint is None:
+                self._checkpoint = await asyncio.to_thread(self._load_checkpoint)
+
+            tokens, checkpoint = await asyncio.to_thread(self._read_new_lines, self._checkpoint, rescan)
+            added = await token_manager.add_token(tokens, TokenType.NORMAL) if tokens else 0
+
+            if checkpoint != self._checkpoint:
+                await asyncio.to_thread(self._save_checkpoint, checkpoint)
+                self._checkpoint = checkpoint
+            if added:
+                logger.info(f"[KeyImport] 导入 {added} 个新Token（读取 {len(tokens)} 行）")
+            return {"read": len(tokens), "added": added}
+
+    async def reset(self) -> None:
+        """清空检查点（注册输出被清空时调用）"""
+        async with self._lock:
+            self._checkpoint = {"file": None, "offset": 0}
+            await asyncio.to_thread(self._save_checkpoint, self._checkpoint)
+
+    # === 文件监听 ===
+
+    def _file_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.keys_file)
+            return st.st_ino, st.st_size, st.st_mtime_ns
+        except (FileNotFoundError, TypeError):
+            return None
+
+    async def _watch(self, interval: float) -> None:
+        """文件大小或修改时间变化时导入"""
+        last = self._file_signature()
+        while True:
+            await asyncio.sleep(interval)
+            signature = self._file_signature()
+            if signature == last:
+                continue
+            last = signature
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"[KeyImport] 导入失败: {e}")
+
+    async def start(self) -> None:
+        """启动时补齐导入并开始监听"""
+        try:
+            await self.sync()
+        except Exception as e:
+            logger.warning(f"[KeyImport] 启动导入失败: {e}")
+
+        interval = setting.grok_config.get("key_import_interval", 2)
+        if interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._watch(interval))
+            logger.info(f"[KeyImport] 监听注册输出: {self.keys_file}，间隔: {interval}s")
+
+    async def stop(self) -> None:
+        """停止监听"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# 全局实例
+key_importer = KeyImporter()
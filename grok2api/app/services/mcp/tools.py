@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 """MCP Tools - Grok AI 对话工具"""
 
-import json
 from typing import Optional
 from app.services.grok.client import GrokClient
+from app.services.grok.delta import collect
 from app.core.logger import logger
 from app.core.exception import GrokApiException
 
@@ -43,31 +43,15 @@ async def ask_grok_impl(
         # 调用Grok客户端(流式)
         response_iterator = await GrokClient.openai_to_grok(request_data)
 
-        # 收集所有流式响应块
-        content_parts = []
-        async for chunk in response_iterator:
-            if isinstance(chunk, bytes):
-                chunk = chunk.decode('utf-8')
+        # 直接消费增量事件（思考过程与视频进度不计入结果）
+        try:
+            content, _ = await collect(response_iterator.deltas(), model)
+        finally:
+            # 提前退出时同样关闭上游并释放Token租约
+            await response_iterator.aclose()
 
-            # 解析SSE格式
-            if chunk.startswith("data: "):
-                data_str = chunk[6:].strip()
-                if data_str == "[DONE]":
-                    break
-
-                try:
-                    data = json.loads(data_str)
-                    choices = data.get("choices", [])
-                    if choices:
-                        delta = choices[0].get("delta", {})
-                        if content := delta.get("content"):
-                            content_parts.append(content)
-                except json.JSONDecodeError:
-                    continue
-
-        result = "".join(content_parts)
-        logger.info(f"[MCP] ask_grok 完成, 响应长度: {len(result)}")
-        return result
+        logger.info(f"[MCP] ask_grok 完成, 响应长度: {len(content)}")
+        return content
 
     except GrokApiException as e:
         logger.error(f"[MCP] Grok API错误: {str(e)}")
@@ -31,6 +31,7 @@ class RequestStats:
         self._hourly: Dict[str, Dict[str, int]] = defaultdict(lambda: {"total": 0, "success": 0, "failed": 0})
         self._daily: Dict[str, Dict[str, int]] = defaultdict(lambda: {"total": 0, "success": 0, "failed": 0})
         self._models: Dict[str, int] = defaultdict(int)
+        self._cache: Dict[str, int] = {"hits": 0, "misses": 0, "quota_saved": 0}  # 响应缓存统计
         
         # 保留策略
         self._hourly_keep = 48  # 保留48小时
@@ -69,6 +70,8 @@ class RequestStats:
                     
                     self._models = defaultdict(int)
                     self._models.update(data.get("models", {}))
+
+                    self._cache.update(data.get("cache", {}))
                     
                     self._loaded = True
                     logger.debug(f"[Stats] 加载统计数据成功")
@@ -89,7 +92,8 @@ class RequestStats:
                 data = {
                     "hourly": dict(self._hourly),
                     "daily": dict(self._daily),
-                    "models": dict(self._models)
+                    "models": dict(self._models),
+                    "cache": self._cache
                 }
                 content = orjson.dumps(data)
                 await asyncio.to_thread(self.file_path.write_bytes, content)
@@ -128,6 +132,18 @@ class RequestStats:
         # 异步保存
         asyncio.create_task(self._save_data())
     
+    async def record_cache(self, hit: bool, quota: int = 0) -> None:
+        """记录一次响应缓存查询（quota为命中时节省的额度次数）"""
+        if not self._loaded:
+            await self.init()
+
+        if hit:
+            self._cache["hits"] += 1
+            self._cache["quota_saved"] += quota
+        else:
+            self._cache["misses"] += 1
+        asyncio.create_task(self._save_data())
+
     def _cleanup(self) -> None:
         """清理过期数据"""
         now = datetime.now()
@@ -180,11 +196,16 @@ class RequestStats:
         total_requests = sum(d["total"] for d in self._hourly.values())
         total_success = sum(d["success"] for d in self._hourly.values())
         total_failed = sum(d["failed"] for d in self._hourly.values())
+        lookups = self._cache["hits"] + self._cache["misses"]
         
         return {
             "hourly": hourly_data,
             "daily": daily_data,
             "models": [{"model": m, "count": c} for m, c in model_data],
+            "cache": {
+                **self._cache,
+                "hit_rate": round(self._cache["hits"] / lookups * 100, 1) if lookups > 0 else 0
+            },
             "summary": {
                 "total": total_requests,
                 "success": total_success,
@@ -198,6 +219,7 @@ class RequestStats:
         self._hourly.clear()
         self._daily.clear()
         self._models.clear()
+        self._cache = {"hits": 0, "misses": 0, "quota_saved": 0}
         await self._save_data()
 
 
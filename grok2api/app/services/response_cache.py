@@ -0,0 +1,142 @@
+"""响应缓存模块 - 按API Key隔离的非流式补全精确匹配缓存（需按Key开启）"""
+
+import time
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional
+
+import orjson
+
+from app.core.config import setting
+from app.models.grok_models import Models
+from app.services.grok.delta import Delta, DeltaStream, DELTA_TEXT, DELTA_FINISH
+from app.services.grok.processer import GrokResponseProcessor
+
+
+# 参与缓存键计算的请求字段（stream不参与，流式请求可命中非流式结果）
+KEY_FIELDS = ("model", "messages", "temperature", "max_tokens", "top_p")
+
+
+@dataclass(slots=True)
+class CachedResponse:
+    """缓存的补全结果"""
+    content: str
+    model: str
+    expires_at: float
+    size: int
+
+
+class CachedStream(DeltaStream):
+    """以缓存结果回放的合成流"""
+
+    def __init__(self, entry: CachedResponse):
+        super().__init__()
+        self._entry = entry
+        self._deltas = self._iter_deltas()
+
+    def deltas(self) -> AsyncIterator[Delta]:
+        return self._deltas
+
+    async def _iter_deltas(self) -> AsyncGenerator[Delta, None]:
+        yield Delta(DELTA_TEXT, self._entry.content, self._entry.model)
+        yield Delta(DELTA_FINISH, model=self._entry.model, finish="stop")
+
+    async def aclose(self) -> None:
+        await self._close_sse()
+        await self._deltas.aclose()
+
+
+class ResponseCache:
+    """响应缓存（单例，LRU + TTL + 内存上限）"""
+
+    _instance: Optional['ResponseCache'] = None
+
+    def __new__(cls) -> 'ResponseCache':
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._size = 0
+        self._initialized = True
+
+    @staticmethod
+    def enabled_for(auth_info: Dict[str, Any]) -> bool:
+        """Key是否开启响应缓存（多Key按Key设置，全局Key与匿名访问按配置）"""
+        if "response_cache" in auth_info:
+            return bool(auth_info["response_cache"])
+        return bool(setting.grok_config.get("response_cache_default", False))
+
+    @staticmethod
+    def make_key(api_key: Optional[str], request: Dict[str, Any]) -> Optional[str]:
+        """规范化请求的缓存键；含图片、视频模型或多候选的请求不缓存，返回None"""
+        if Models.get_model_info(request["model"]).get("is_video_model", False) or (request.get("n") or 1) > 1:
+            return None
+        for msg in request["messages"]:
+            content = msg.get("content")
+            if isinstance(content, list) and any(item.get("type") == "image_url" for item in content):
+                return None
+
+        canonical = {field: request.get(field) for field in KEY_FIELDS}
+        digest = hashlib.blake2b(orjson.dumps(canonical, option=orjson.OPT_SORT_KEYS), digest_size=16)
+        digest.update((api_key or "").encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """查找缓存（过期则删除）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, content: str, model: str) -> None:
+        """写入缓存（超出条数或内存上限时淘汰最久未使用的条目）"""
+        size = len(content.encode())
+        max_bytes = setting.grok_config.get("response_cache_max_mb", 64) * 1024 * 1024
+        if size > max_bytes:
+            return
+
+        self._remove(key)
+        ttl = setting.grok_config.get("response_cache_ttl", 3600)
+        self._entries[key] = CachedResponse(content, model, time.time() + ttl, size)
+        self._size += size
+
+        max_entries = max(setting.grok_config.get("response_cache_max_entries", 1000), 1)
+        while self._entries and (len(self._entries) > max_entries or self._size > max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+
+    @staticmethod
+    def replay(entry: CachedResponse, stream: bool):
+        """以缓存结果构建响应（流式返回合成流）"""
+        if stream:
+            return CachedStream(entry)
+        return GrokResponseProcessor._build_response(entry.content, entry.model)
+
+    def _remove(self, key: str) -> None:
+        if entry := self._entries.pop(key, None):
+            self._size -= entry.size
+
+    def clear(self) -> int:
+        """清空缓存，返回删除条数"""
+        count = len(self._entries)
+        self._entries.clear()
+        self._size = 0
+        return count
+
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存占用"""
+        return {"entries": len(self._entries), "size_mb": round(self._size / 1024 / 1024, 2)}
+
+
+# 全局实例
+response_cache = ResponseCache()
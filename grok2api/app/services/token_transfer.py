@@ -0,0 +1,149 @@
+"""Token批量导入导出 - 流式解析与输出，用于大批量导入与节点间迁移Token池
+
+导入按行解析请求体，每行为纯文本Token或导出格式的JSON数组
+["ssoNormal", "<token>", {数据}]（与 token.journal 变更日志行一致），按块去重写入；
+导出逐块生成同样格式的行，不在内存中拼接整个Token池。
+"""
+
+import time
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import orjson
+
+from app.core.exception import GrokApiException
+from app.core.logger import logger
+from app.core.storage import TokenChange
+from app.models.grok_models import TokenType
+from app.services.grok.token import token_manager
+
+
+IMPORT_CHUNK_SIZE = 1000  # 每块写入的Token数（块之间让出事件循环，由批量保存落盘）
+EXPORT_CHUNK_SIZE = 1000  # 导出每次生成的行数
+TOKEN_TYPES = (TokenType.NORMAL.value, TokenType.SUPER.value)
+
+
+class TokenTransfer:
+    """Token批量导入导出（单例）"""
+
+    _instance: Optional['TokenTransfer'] = None
+
+    def __new__(cls) -> 'TokenTransfer':
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if hasattr(self, '_initialized'):
+            return
+
+        self._progress: Dict[str, Any] = {"running": False, "read": 0, "added": 0, "skipped": 0, "invalid": 0}
+        self._initialized = True
+
+    # === 导入 ===
+
+    @staticmethod
+    def _parse_line(line: bytes, token_type: str) -> Optional[TokenChange]:
+        """解析一行：JSON数组为导出格式，否则视为纯文本Token（使用默认类型）"""
+        line = line.strip()
+        if not line:
+            return None
+        if not line.startswith(b"["):
+            return token_type, line.decode("utf-8", errors="ignore"), None
+
+        record_type, token, data = orjson.loads(line)
+        if record_type not in TOKEN_TYPES or not isinstance(token, str) or not (data is None or isinstance(data, dict)):
+            raise ValueError("invalid record")
+        return record_type, token, data
+
+    async def import_stream(self, chunks: AsyncIterator[bytes], token_type: TokenType) -> Dict[str, Any]:
+        """流式导入Token（纯文本或导出格式NDJSON，可混合）
+
+        Args:
+            chunks: 请求体字节流
+            token_type: 纯文本行使用的Token类型
+
+        Returns:
+            导入进度 {"read", "added", "skipped", "invalid"}
+        """
+        if self._progress["running"]:
+            raise GrokApiException("导入任务正在进行中", "IMPORT_IN_PROGRESS", status_code=409)
+
+        progress = self._progress = {"running": True, "read": 0, "added": 0, "skipped": 0, "invalid": 0,
+                                     "started_at": int(time.time())}
+        records: List[TokenChange] = []
+
+        async def apply() -> None:
+            added = await token_manager.import_tokens(records)
+            progress["added"] += added
+            progress["skipped"] += len(records) - added
+            records.clear()
+            await asyncio.sleep(0)
+
+        try:
+            tail = b""
+            async for chunk in chunks:
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                for line in lines:
+                    try:
+                        record = self._parse_line(line, token_type.value)
+                    except (orjson.JSONDecodeError, ValueError, TypeError):
+                        progress["invalid"] += 1
+                        continue
+                    if record:
+                        progress["read"] += 1
+                        records.append(record)
+                if len(records) >= IMPORT_CHUNK_SIZE:
+                    await apply()
+
+            try:
+                record = self._parse_line(tail, token_type.value)
+            except (orjson.JSONDecodeError, ValueError, TypeError):
+                progress["invalid"] += 1
+                record = None
+            if record:
+                progress["read"] += 1
+                records.append(record)
+            if records:
+                await apply()
+        finally:
+            progress["running"] = False
+            logger.info(f"[TokenTransfer] 导入完成: 读取 {progress['read']}，新增 {progress['added']}，"
+                        f"跳过 {progress['skipped']}，无效 {progress['invalid']}")
+
+        return self.get_progress()
+
+    def get_progress(self) -> Dict[str, Any]:
+        """获取导入进度"""
+        return self._progress.copy()
+
+    # === 导出 ===
+
+    @staticmethod
+    async def export_stream(token_type: Optional[TokenType] = None, fmt: str = "ndjson") -> AsyncIterator[bytes]:
+        """逐块导出Token池
+
+        Args:
+            token_type: 只导出指定类型（None为全部）
+            fmt: ndjson（含完整数据，可直接导入其他节点）或 text（每行一个Token）
+        """
+        types = [token_type.value] if token_type else TOKEN_TYPES
+        for record_type in types:
+            pool = token_manager.token_data.get(record_type, {})
+            tokens = list(pool)
+            for start in range(0, len(tokens), EXPORT_CHUNK_SIZE):
+                lines = []
+                for token in tokens[start:start + EXPORT_CHUNK_SIZE]:
+                    data = pool.get(token)
+                    if data is None:
+                        continue  # 导出期间被删除
+                    if fmt == "text":
+                        lines.append(token.encode("utf-8") + b"\n")
+                    else:
+                        lines.append(orjson.dumps([record_type, token, data]) + b"\n")
+                yield b"".join(lines)
+
+
+# 全局实例
+token_transfer = TokenTransfer()
@@ -0,0 +1,310 @@
+"""端到端压测 - 以固定并发驱动 /v1/chat/completions 并记录结果
+
+统计 RPS、首字延迟(TTFT)分位数、输出 tokens/s，以及（指定 --pid 时）服务进程的
+CPU 与 RSS。结果写入 benchmark/results/*.json，便于跨提交对比。
+
+配合 benchmark/mock_upstream.py 使用（在 grok2api 目录下）:
+    python benchmark/mock_upstream.py --port 9001 &
+    python main.py &
+    python benchmark/load.py --api-key sk-xxx --concurrency 32 --requests 500 --pid $!
+    python benchmark/load.py ... --compare benchmark/results/<上次结果>.json
+
+场景（--scenario）通过消息关键字驱动模拟上游回放对应 fixture：image/video 会让服务
+下载并缓存资源（CacheService），video 同时切换到视频模型；--image-url 在消息中附带
+图片（URL 或 data URI），使每个请求都经过上传流程:
+    python benchmark/load.py --scenario image --requests 100
+    python benchmark/load.py --scenario video --image-url http://127.0.0.1:9001/sample.png
+
+输出 tokens 以 SSE 内容增量块数近似（非流式时按字符数/4估算），media 为响应中的图片/视频链接数。
+"""
+
+import argparse
+import asyncio
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiohttp
+import orjson
+
+try:
+    import psutil
+except ImportError:  # 可选依赖：缺失时不采集资源占用
+    psutil = None
+
+
+RESULT_DIR = Path(__file__).resolve().parent / "results"
+SAMPLE_INTERVAL = 0.5
+SCENARIOS = ("text", "search", "image", "video")
+SCENARIO_MODELS = {"video": "grok-imagine-0.9"}  # 场景默认模型（未指定 --model 时）
+DEFAULT_MODEL = "grok-4-fast"
+MEDIA_PATTERN = re.compile(r"!\[[^\]]*\]\(|<video|<img")
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """线性插值分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * pct / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """汇总延迟分布（毫秒）"""
+    return {
+        "p50": _ms(percentile(values, 50)),
+        "p90": _ms(percentile(values, 90)),
+        "p99": _ms(percentile(values, 99)),
+        "mean": _ms(sum(values) / len(values)) if values else None,
+    }
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 2) if value is not None else None
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+class ResourceSampler:
+    """周期采集服务进程 CPU/RSS"""
+
+    def __init__(self, pid: Optional[int]):
+        self.process = psutil.Process(pid) if psutil and pid else None
+        self.cpu: List[float] = []
+        self.rss: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.process:
+            self.process.cpu_percent(None)
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            try:
+                self.cpu.append(self.process.cpu_percent(None))
+                self.rss.append(self.process.memory_info().rss)
+            except psutil.Error:
+                return
+
+    async def stop(self) -> Optional[Dict[str, float]]:
+        if not self._task:
+            return None
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if not self.cpu:
+            return None
+        return {
+            "cpu_percent_mean": round(sum(self.cpu) / len(self.cpu), 1),
+            "cpu_percent_max": round(max(self.cpu), 1),
+            "rss_mb_max": round(max(self.rss) / 1024 / 1024, 1),
+            "rss_mb_end": round(self.rss[-1] / 1024 / 1024, 1),
+        }
+
+
+class LoadRunner:
+    """固定并发压测"""
+
+    def __init__(self, args):
+        self.args = args
+        self.url = f"{args.base_url.rstrip('/')}/v1/chat/completions"
+        self.headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+        self.ttft: List[float] = []
+        self.latency: List[float] = []
+        self.tokens = 0
+        self.media = 0
+        self.ok = 0
+        self.errors: Dict[str, int] = {}
+        self._issued = 0
+
+    def _next(self) -> bool:
+        """分配下一个请求序号，超出数量或时长时返回False"""
+        if self.args.duration:
+            return time.perf_counter() < self._deadline
+        if self._issued >= self.args.requests:
+            return False
+        self._issued += 1
+        return True
+
+    def _error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def _body(self) -> Dict:
+        """按场景构造请求体"""
+        prompt = self.args.prompt
+        if self.args.scenario != "text":
+            prompt = f"{self.args.scenario}: {prompt}"
+        content = prompt
+        if self.args.image_url:
+            content = [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": self.args.image_url}},
+            ]
+        return {
+            "model": self.args.model,
+            "stream": self.args.stream,
+            "messages": [{"role": "user", "content": content}],
+        }
+
+    async def _one(self, session: aiohttp.ClientSession):
+        body = self._body()
+        started = time.perf_counter()
+        first = None
+        tokens = 0
+        media = 0
+        try:
+            async with session.post(self.url, json=body, headers=self.headers) as resp:
+                if resp.status != 200:
+                    await resp.read()
+                    self._error(f"http_{resp.status}")
+                    return
+
+                if self.args.stream:
+                    async for raw in resp.content:
+                        line = raw.strip()
+                        if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                            continue
+                        delta = orjson.loads(line[6:])["choices"][0].get("delta") or {}
+                        if text := delta.get("content"):
+                            if first is None:
+                                first = time.perf_counter() - started
+                            tokens += 1
+                            media += len(MEDIA_PATTERN.findall(text))
+                else:
+                    data = orjson.loads(await resp.read())
+                    first = time.perf_counter() - started
+                    text = data["choices"][0]["message"]["content"] or ""
+                    tokens = len(text) // 4
+                    media = len(MEDIA_PATTERN.findall(text))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._error(type(e).__name__)
+            return
+
+        self.latency.append(time.perf_counter() - started)
+        if first is not None:
+            self.ttft.append(first)
+        self.tokens += tokens
+        self.media += media
+        self.ok += 1
+
+    async def _worker(self, session: aiohttp.ClientSession):
+        while self._next():
+            await self._one(session)
+
+    async def run(self) -> Dict:
+        sampler = ResourceSampler(self.args.pid)
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            sampler.start()
+            started = time.perf_counter()
+            self._deadline = started + (self.args.duration or 0)
+            await asyncio.gather(*(self._worker(session) for _ in range(self.args.concurrency)))
+            elapsed = time.perf_counter() - started
+            resources = await sampler.stop()
+
+        return {
+            "label": self.args.label,
+            "revision": git_revision(),
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "config": {
+                "model": self.args.model,
+                "scenario": self.args.scenario,
+                "image_url": bool(self.args.image_url),
+                "stream": self.args.stream,
+                "concurrency": self.args.concurrency,
+                "requests": self.args.requests if not self.args.duration else None,
+                "duration": self.args.duration or None,
+            },
+            "elapsed_s": round(elapsed, 3),
+            "ok": self.ok,
+            "errors": self.errors,
+            "rps": round(self.ok / elapsed, 2) if elapsed else 0,
+            "ttft_ms": summarize(self.ttft),
+            "latency_ms": summarize(self.latency),
+            "tokens_per_s": round(self.tokens / elapsed, 1) if elapsed else 0,
+            "media": self.media,
+            "resources": resources,
+        }
+
+
+def compare(current: Dict, baseline_path: Path):
+    """打印与基线结果的差异"""
+    baseline = orjson.loads(baseline_path.read_bytes())
+    rows = [
+        ("rps", current["rps"], baseline["rps"]),
+        ("tokens/s", current["tokens_per_s"], baseline["tokens_per_s"]),
+        ("ttft p50", current["ttft_ms"]["p50"], baseline["ttft_ms"]["p50"]),
+        ("ttft p99", current["ttft_ms"]["p99"], baseline["ttft_ms"]["p99"]),
+        ("latency p99", current["latency_ms"]["p99"], baseline["latency_ms"]["p99"]),
+    ]
+    if current.get("resources") and baseline.get("resources"):
+        rows.append(("cpu% mean", current["resources"]["cpu_percent_mean"], baseline["resources"]["cpu_percent_mean"]))
+        rows.append(("rss MB max", current["resources"]["rss_mb_max"], baseline["resources"]["rss_mb_max"]))
+
+    print(f"\n对比基线 {baseline.get('revision')} ({baseline_path.name}):")
+    for name, now, before in rows:
+        if now is None or before is None:
+            continue
+        change = f"{(now - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"  {name:<12} {before:>10} -> {now:<10} {change}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="grok2api 端到端压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--api-key", default=os.getenv("GROK2API_KEY", ""))
+    parser.add_argument("--model", help=f"模型（默认 {DEFAULT_MODEL}，video 场景默认 {SCENARIO_MODELS['video']}）")
+    parser.add_argument("--prompt", default="hello")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="text", help="回放场景（image/video 会下载资源）")
+    parser.add_argument("--image-url", help="附带的图片（URL 或 data URI），触发上传流程")
+    parser.add_argument("--no-stream", dest="stream", action="store_false")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="请求总数")
+    parser.add_argument("--duration", type=float, default=0, help="按时长压测（秒），设置后忽略 --requests")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--pid", type=int, help="服务进程PID（采集CPU/RSS，需要psutil）")
+    parser.add_argument("--label", default="", help="结果标签")
+    parser.add_argument("--output", type=Path, help="结果文件路径（默认 benchmark/results/）")
+    parser.add_argument("--compare", type=Path, help="对比的基线结果文件")
+    args = parser.parse_args()
+    args.model = args.model or SCENARIO_MODELS.get(args.scenario, DEFAULT_MODEL)
+
+    if args.pid and psutil is None:
+        print("未安装 psutil，跳过资源采集", file=sys.stderr)
+
+    result = await LoadRunner(args).run()
+
+    output = args.output or RESULT_DIR / f"{result['timestamp']}-{result['revision']}{'-' + args.label if args.label else ''}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+
+    print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
+    print(f"\n结果已保存: {output}")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,251 @@
+"""本地模拟 Grok 上游 - 回放 NDJSON 对话流，供压测使用
+
+提供与 grok.com 相同路径的接口：
+    POST /rest/app-chat/conversations/new   回放 fixtures/*.ndjson（首行返回会话ID）
+    POST /rest/app-chat/conversations/<id>/responses  在已有会话中续聊（数据直接位于 result 下）
+    POST /rest/rate-limits                  返回剩余额度
+    POST /rest/app-chat/upload-file         返回文件ID/URI
+    POST /rest/media/post/create            返回会话ID
+    GET  /<资源路径>                        返回图片/视频字节（资源域名）
+
+场景按请求消息中的关键字选择（image/video/search），否则使用 --scenario。
+支持首包延迟、逐行吞吐限速、前N次对话挂起与 403/429 故障注入；
+客户端中途断开时记录断开次数与时间（/__stats 的 client_aborts）。
+
+用法（在 grok2api 目录下）:
+    python benchmark/mock_upstream.py --port 9001 --ttfb 0.3 --lines-per-sec 200
+    然后在 data/setting.toml 的 [grok] 节中设置：
+        upstream_base_url = "http://127.0.0.1:9001"
+        assets_base_url = "http://127.0.0.1:9001"
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import struct
+import time
+import uuid
+import zlib
+from pathlib import Path
+
+import orjson
+from aiohttp import web
+
+
+FIXTURE_DIR = Path(__file__).resolve().parent / "fixtures"
+SCENARIOS = ("text", "search", "image", "video")
+
+
+def load_fixtures() -> dict:
+    """读取 NDJSON 回放文件"""
+    fixtures = {}
+    for name in SCENARIOS:
+        path = FIXTURE_DIR / f"{name}.ndjson"
+        fixtures[name] = [line.encode() + b"\n" for line in path.read_text(encoding="utf-8").splitlines() if line]
+    return fixtures
+
+
+def make_png(size: int) -> bytes:
+    """生成指定边长的纯色PNG"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    raw = b"".join(b"\x00" + bytes((i % 256, 128, 200)) * size for i in range(size))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+class MockUpstream:
+    """模拟上游"""
+
+    def __init__(self, args):
+        self.args = args
+        self.fixtures = load_fixtures()
+        self.image = make_png(args.image_size)
+        self.video = os.urandom(args.video_kb * 1024)
+        self.stats = {"conversations": 0, "rate_limits": 0, "uploads": 0, "posts": 0, "assets": 0,
+                      "injected_403": 0, "injected_429": 0, "stalled": 0, "client_aborts": 0,
+                      "continuations": 0, "peak_concurrency": 0}
+        self.active = 0                # 进行中的对话数
+        self.conversation_tokens = []  # 每次对话使用的 sso（按到达顺序）
+        self.conversation_owners = {}  # 会话ID -> 创建会话的 sso
+        self.messages = []             # 每次请求发送的 message（按到达顺序）
+        self.uploaded = []             # 每次上传的请求体（按到达顺序）
+        self.abort_times = []          # 客户端断开时间（time.monotonic）
+
+    def _inject(self) -> web.Response | None:
+        """按比例注入 403/429"""
+        roll = random.random()
+        if roll < self.args.rate_403:
+            self.stats["injected_403"] += 1
+            return web.Response(status=403, text="blocked")
+        if roll < self.args.rate_403 + self.args.rate_429:
+            self.stats["injected_429"] += 1
+            return web.json_response({"error": {"code": 8, "message": "Too many requests"}}, status=429)
+        return None
+
+    def _pick_scenario(self, payload: dict) -> str:
+        if payload.get("toolOverrides", {}).get("videoGen"):
+            return "video"
+        message = str(payload.get("message", "")).lower()
+        for name in ("video", "image", "search"):
+            if name in message:
+                return name
+        return self.args.scenario
+
+    @staticmethod
+    def _sso(request: web.Request) -> str:
+        for part in request.headers.get("Cookie", "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "sso":
+                return value
+        return ""
+
+    def _record_abort(self):
+        self.stats["client_aborts"] += 1
+        self.abort_times.append(time.monotonic())
+
+    async def _hold(self, request: web.Request, seconds: float) -> bool:
+        """等待指定时长（负数为一直等待），期间客户端断开则返回False"""
+        deadline = time.monotonic() + seconds if seconds >= 0 else None
+        while deadline is None or time.monotonic() < deadline:
+            if request.transport is None or request.transport.is_closing():
+                return False
+            await asyncio.sleep(0.05 if deadline is None else min(0.05, max(deadline - time.monotonic(), 0)))
+        return True
+
+    async def conversation(self, request: web.Request) -> web.StreamResponse:
+        if rejected := self._inject():
+            return rejected
+
+        payload = orjson.loads(await request.read())
+        lines = self.fixtures[self._pick_scenario(payload)]
+        self.stats["conversations"] += 1
+        self.conversation_tokens.append(self._sso(request))
+        self.messages.append(payload.get("message", ""))
+
+        conversation_id = str(uuid.uuid4())
+        self.conversation_owners[conversation_id] = self._sso(request)
+        head = orjson.dumps({"result": {"conversation": {"conversationId": conversation_id}}}) + b"\n"
+        # 前N次对话只返回响应头，不发送数据（模拟上游卡死）
+        stall = self.stats["conversations"] <= self.args.stall_first
+        return await self._replay(request, [head] + lines, stall)
+
+    async def continue_conversation(self, request: web.Request) -> web.StreamResponse:
+        if rejected := self._inject():
+            return rejected
+
+        payload = orjson.loads(await request.read())
+        owner = self.conversation_owners.get(request.match_info["conversation_id"])
+        if owner is None or owner != self._sso(request) or not payload.get("parentResponseId"):
+            return web.json_response({"error": {"code": 5, "message": "Conversation not found"}}, status=404)
+
+        self.stats["continuations"] += 1
+        self.messages.append(payload.get("message", ""))
+        lines = [orjson.dumps({"result": orjson.loads(line)["result"]["response"]}) + b"\n"
+                 for line in self.fixtures[self._pick_scenario(payload)]]
+        return await self._replay(request, lines)
+
+    async def _replay(self, request: web.Request, lines: list, stall: bool = False) -> web.StreamResponse:
+        """按配置的首包延迟与速率回放数据行（stall 时只返回响应头）"""
+        self.active += 1
+        self.stats["peak_concurrency"] = max(self.stats["peak_concurrency"], self.active)
+        try:
+            return await self._stream_lines(request, lines, stall)
+        finally:
+            self.active -= 1
+
+    async def _stream_lines(self, request: web.Request, lines: list, stall: bool) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        await response.write(b"\n")  # 立即发出响应头（空行会被客户端忽略）
+
+        if stall:
+            self.stats["stalled"] += 1
+        if not await self._hold(request, -1 if stall else self.args.ttfb):
+            self._record_abort()
+            return response
+
+        interval = 1 / self.args.lines_per_sec if self.args.lines_per_sec > 0 else 0
+        try:
+            for i, line in enumerate(lines):
+                if i and interval and not await self._hold(request, interval):
+                    raise ConnectionResetError("client closed")
+                await response.write(line)
+            await response.write_eof()
+        except ConnectionResetError:
+            self._record_abort()
+        except asyncio.CancelledError:
+            self._record_abort()
+            raise
+        return response
+
+    async def rate_limits(self, request: web.Request) -> web.Response:
+        self.stats["rate_limits"] += 1
+        remaining = random.randint(10, 80)
+        return web.json_response({"windowSizeSeconds": 7200, "remainingQueries": remaining,
+                                  "remainingTokens": remaining, "totalQueries": 80, "totalTokens": 80})
+
+    async def upload(self, request: web.Request) -> web.Response:
+        if rejected := self._inject():
+            return rejected
+        body = await request.read()
+        self.stats["uploads"] += 1
+        self.uploaded.append(orjson.loads(body))
+        file_id = str(uuid.uuid4())
+        return web.json_response({"fileMetadataId": file_id, "fileUri": f"users/mock/{file_id}/content"})
+
+    async def create_post(self, request: web.Request) -> web.Response:
+        await request.read()
+        self.stats["posts"] += 1
+        return web.json_response({"post": {"id": str(uuid.uuid4())}})
+
+    async def asset(self, request: web.Request) -> web.Response:
+        self.stats["assets"] += 1
+        await asyncio.sleep(self.args.asset_latency)
+        if request.path.endswith(".mp4"):
+            return web.Response(body=self.video, content_type="video/mp4")
+        return web.Response(body=self.image, content_type="image/png")
+
+    async def stats_view(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/rest/app-chat/conversations/new", self.conversation)
+        app.router.add_post("/rest/app-chat/conversations/{conversation_id}/responses", self.continue_conversation)
+        app.router.add_post("/rest/rate-limits", self.rate_limits)
+        app.router.add_post("/rest/app-chat/upload-file", self.upload)
+        app.router.add_post("/rest/media/post/create", self.create_post)
+        app.router.add_get("/__stats", self.stats_view)
+        app.router.add_get("/{path:.+}", self.asset)
+        return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="本地模拟 Grok 上游")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--scenario", choices=SCENARIOS, default="text", help="默认回放场景")
+    parser.add_argument("--ttfb", type=float, default=0.3, help="首包延迟（秒）")
+    parser.add_argument("--lines-per-sec", type=float, default=200, help="逐行回放速率（0=不限速）")
+    parser.add_argument("--rate-403", type=float, default=0.0, help="403注入比例")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="429注入比例")
+    parser.add_argument("--asset-latency", type=float, default=0.05, help="资源下载延迟（秒）")
+    parser.add_argument("--image-size", type=int, default=512, help="生成图片边长（像素）")
+    parser.add_argument("--video-kb", type=int, default=512, help="视频大小（KB）")
+    parser.add_argument("--stall-first", type=int, default=0, help="前N次对话挂起不返回数据")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    web.run_app(MockUpstream(args).build_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
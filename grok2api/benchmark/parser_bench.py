@@ -0,0 +1,109 @@
+"""解析器微基准 - 对比逐行完整解析与 GrokLineParser 快速路径
+
+默认回放 benchmark/fixtures/*.ndjson，也可指定录制的上游流（每行一个JSON）:
+    python benchmark/parser_bench.py
+    python benchmark/parser_bench.py --file recorded.ndjson --rounds 2000
+
+stream 模拟流式处理的解析、事件检查与过滤标签匹配，normal 模拟非流式处理的逐行分类。
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import orjson
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.grok.parser import GrokLineParser, LINE_TOKEN, LINE_ERROR, LINE_EMPTY
+
+
+FIXTURE_DIR = Path(__file__).resolve().parent / "fixtures"
+FILTERED_TAGS = "xaiartifact,xai:tool_usage_card"
+
+
+def legacy_stream(lines: List[bytes]):
+    tags = FILTERED_TAGS.split(",")
+    for line in lines:
+        data = orjson.loads(line)
+        if data.get("error"):
+            continue
+        grok_resp = data.get("result", {}).get("response", {})
+        if not grok_resp:
+            continue
+        grok_resp.get("userResponse")
+        grok_resp.get("streamingVideoGenerationResponse")
+        grok_resp.get("imageAttachmentInfo")
+        token = grok_resp.get("token", "")
+        if isinstance(token, str) and any(tag in token for tag in tags if token):
+            continue
+        grok_resp.get("isThinking", False)
+        grok_resp.get("messageTag")
+
+
+def parser_stream(lines: List[bytes]):
+    parser = GrokLineParser(FILTERED_TAGS)
+    for line in lines:
+        kind, grok_resp = parser.parse(line)
+        if kind == LINE_ERROR or kind == LINE_EMPTY:
+            continue
+        if kind != LINE_TOKEN:
+            grok_resp.get("userResponse")
+            grok_resp.get("streamingVideoGenerationResponse")
+            grok_resp.get("imageAttachmentInfo")
+        token = grok_resp.get("token", "")
+        if isinstance(token, str) and token and parser.is_filtered(token):
+            continue
+        grok_resp.get("isThinking", False)
+        grok_resp.get("messageTag")
+
+
+def legacy_normal(lines: List[bytes]):
+    for line in lines:
+        data = orjson.loads(line)
+        grok_resp = data.get("result", {}).get("response", {})
+        grok_resp.get("streamingVideoGenerationResponse")
+        grok_resp.get("modelResponse")
+
+
+def parser_normal(lines: List[bytes]):
+    parser = GrokLineParser()
+    for line in lines:
+        kind, grok_resp = parser.parse(line)
+        if kind == LINE_EMPTY or kind == LINE_TOKEN:
+            continue
+        grok_resp.get("streamingVideoGenerationResponse")
+        grok_resp.get("modelResponse")
+
+
+def measure(func: Callable, lines: List[bytes], rounds: int, repeat: int = 5) -> float:
+    """返回每行耗时（纳秒，取多次中的最小值）"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        for _ in range(rounds):
+            func(lines)
+        best = min(best, (time.perf_counter_ns() - started) / (rounds * len(lines)))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上游NDJSON解析微基准")
+    parser.add_argument("--file", type=Path, action="append", help="录制的上游流文件（可多次指定）")
+    parser.add_argument("--rounds", type=int, default=500, help="每次测量的回放轮数")
+    args = parser.parse_args()
+
+    files = args.file or sorted(FIXTURE_DIR.glob("*.ndjson"))
+    print(f"{'stream':<16}{'lines':>7}{'legacy ns':>12}{'parser ns':>12}{'speedup':>9}   mode")
+    for path in files:
+        lines = [line.strip() for line in path.read_bytes().splitlines() if line.strip()]
+        for mode, legacy, fast in (("stream", legacy_stream, parser_stream), ("normal", legacy_normal, parser_normal)):
+            before = measure(legacy, lines, args.rounds)
+            after = measure(fast, lines, args.rounds)
+            print(f"{path.stem:<16}{len(lines):>7}{before:>12.0f}{after:>12.0f}{before / after:>8.2f}x   {mode}")
+
+
+if __name__ == "__main__":
+    main()
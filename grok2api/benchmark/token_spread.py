@@ -0,0 +1,115 @@
+"""Token 分配策略模拟基准 - 对比不同选择策略下的上游 429 比例
+
+模拟一个账号池：每个账号有真实剩余额度与并发上限，管理器只能在请求完成后
+异步刷新看到的额度（与 GrokClient._update_limits 行为一致）。
+超出真实额度或账号并发上限的请求计为 429。
+
+用法（在 grok2api 目录下）:
+    python benchmark/token_spread.py --tokens 20 --concurrency 32 --requests 2000
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.core.config import setting  # noqa: E402
+from app.services.grok.token import token_manager, SELECT_STRATEGIES  # noqa: E402
+
+
+class SimUpstream:
+    """模拟上游账号"""
+
+    def __init__(self, tokens: int, quota: int, max_concurrent: int):
+        self.quota = {f"tok{i}": quota for i in range(tokens)}
+        self.active = {f"tok{i}": 0 for i in range(tokens)}
+        self.max_concurrent = max_concurrent
+
+    async def request(self, sso: str, latency: float) -> int:
+        if self.quota[sso] <= 0 or self.active[sso] >= self.max_concurrent:
+            await asyncio.sleep(latency / 10)
+            return 429
+        self.quota[sso] -= 1
+        self.active[sso] += 1
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            self.active[sso] -= 1
+        return 200
+
+
+async def run(strategy: str, args) -> dict:
+    setting.grok_config["token_select_strategy"] = strategy
+    setting.grok_config["token_wait_timeout"] = 0
+    token_manager.token_file = Path(tempfile.mkdtemp()) / "token.json"
+    upstream = SimUpstream(args.tokens, args.quota, args.max_concurrent)
+    token_manager.token_data = {
+        "ssoNormal": {sso: {"remainingQueries": -1, "status": "active", "failedCount": 0} for sso in upstream.quota},
+        "ssoSuper": {},
+    }
+    token_manager._cooldown_counts.clear()
+    token_manager._inflight.clear()
+
+    counts = {"ok": 0, "429": 0, "no_token": 0}
+    queue = iter(range(args.requests))
+
+    async def refresh_later(sso: str):
+        await asyncio.sleep(args.refresh_delay)
+        token_manager.token_data["ssoNormal"][sso]["remainingQueries"] = upstream.quota[sso]
+
+    async def worker():
+        for _ in queue:
+            try:
+                sso = await token_manager.select_token("grok-4-fast")
+            except Exception:
+                counts["no_token"] += 1
+                continue
+            try:
+                status = await upstream.request(sso, random.uniform(args.latency * 0.5, args.latency * 1.5))
+            finally:
+                token_manager.release_token(sso)
+            if status == 200:
+                counts["ok"] += 1
+                asyncio.create_task(refresh_later(sso))
+            else:
+                counts["429"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    return {
+        "strategy": strategy,
+        **counts,
+        "rate_429": round(counts["429"] / total * 100, 2) if total else 0,
+        "elapsed": round(elapsed, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Token 分配策略模拟")
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--quota", type=int, default=100, help="每个账号真实额度")
+    parser.add_argument("--max-concurrent", type=int, default=2, help="每个账号上游并发上限")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="平均请求耗时（秒）")
+    parser.add_argument("--refresh-delay", type=float, default=0.2, help="额度刷新延迟（秒）")
+    parser.add_argument("--strategies", default=",".join(SELECT_STRATEGIES))
+    args = parser.parse_args()
+
+    print(f"{'strategy':<14}{'ok':>8}{'429':>8}{'no_token':>10}{'429%':>8}{'time(s)':>9}")
+    for strategy in args.strategies.split(","):
+        r = await run(strategy.strip(), args)
+        print(f"{r['strategy']:<14}{r['ok']:>8}{r['429']:>8}{r['no_token']:>10}{r['rate_429']:>8}{r['elapsed']:>9}")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.INFO)
+    asyncio.run(main())
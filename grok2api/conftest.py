@@ -0,0 +1,187 @@
+"""测试公共设施 - 单例隔离与本地模拟上游
+
+每个测试前把单例的数据文件指向临时目录，结束后恢复单例状态与配置，测试之间互不影响。
+running_stack 使用 benchmark/mock_upstream.py 作为上游，不访问 grok.com。
+"""
+
+import asyncio
+import copy
+import socket
+import sys
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiohttp
+import orjson
+import pytest
+import uvicorn
+from aiohttp import web
+from fastapi import FastAPI
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from benchmark.mock_upstream import MockUpstream, build_parser
+from app.api.v1.batches import router as batches_router
+from app.api.v1.chat import router as chat_router
+from app.api.v1.images import router as images_router
+from app.core.config import setting
+from app.core.exception import register_exception_handlers
+from app.services.api_keys import api_key_manager
+from app.services.batch import batch_manager
+from app.services.grok.cache import image_cache_service, image_variant_service
+from app.services.grok.conversation import conversation_store
+from app.services.grok.token import token_manager
+from app.services.grok.upload import image_normalizer
+from app.services.key_import import key_importer
+from app.services.request_logger import request_logger
+from app.services.request_stats import request_stats
+from app.services.response_cache import response_cache
+
+
+TOKENS = ("tok-a", "tok-b")
+
+# 测试期间会被修改的单例（结束后按快照恢复）
+SINGLETONS = (
+    token_manager, key_importer, batch_manager, api_key_manager, request_logger, request_stats,
+    conversation_store, response_cache, image_cache_service, image_variant_service, image_normalizer,
+)
+
+
+def _snapshot(obj) -> dict:
+    """单例属性快照（容器浅拷贝，避免原地修改泄漏到后续测试）"""
+    return {name: copy.copy(value) if isinstance(value, (dict, list, set, deque, OrderedDict)) else value
+            for name, value in vars(obj).items()}
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path):
+    """单例数据文件指向临时目录，测试结束恢复单例与配置"""
+    saved = [(obj, _snapshot(obj)) for obj in SINGLETONS]
+    saved_grok, saved_global = dict(setting.grok_config), dict(setting.global_config)
+
+    token_manager.token_file = tmp_path / "token.json"
+    token_manager._storage = None
+    key_importer.keys_file = tmp_path / "grok.txt"
+    key_importer.checkpoint_file = tmp_path / "key_import.json"
+    key_importer._checkpoint = None
+    api_key_manager.file_path = tmp_path / "api_keys.json"
+    api_key_manager._loaded = False
+    request_logger.file_path = tmp_path / "logs.json"
+    request_stats.file_path = tmp_path / "stats.json"
+    batch_manager.batch_dir = tmp_path / "batches"
+    batch_manager._jobs = {}
+    try:
+        yield tmp_path
+    finally:
+        for obj, state in saved:
+            vars(obj).clear()
+            vars(obj).update(state)
+        setting.grok_config.clear()
+        setting.grok_config.update(saved_grok)
+        setting.global_config.clear()
+        setting.global_config.update(saved_global)
+
+
+def free_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+@asynccontextmanager
+async def running_stack(mock_argv: list, tokens=TOKENS, **grok_config):
+    """启动模拟上游与服务（依赖 isolated_state 提供的临时目录）"""
+    # 模拟上游
+    upstream = MockUpstream(build_parser().parse_args(mock_argv))
+    runner = web.AppRunner(upstream.build_app())
+    await runner.setup()
+    upstream_sock = free_socket()
+    await web.SockSite(runner, upstream_sock).start()
+    upstream_url = f"http://127.0.0.1:{upstream_sock.getsockname()[1]}"
+
+    # 配置仅修改内存，不写回 setting.toml
+    setting.grok_config.update({
+        "upstream_base_url": upstream_url,
+        "assets_base_url": upstream_url,
+        "api_key": "",
+        "proxy_url": "",
+        "cf_clearance": "",
+        "token_wait_timeout": 0,
+        **grok_config,
+    })
+
+    token_manager.token_file.write_bytes(orjson.dumps({
+        "ssoNormal": {sso: {"createdTime": int(time.time() * 1000), "remainingQueries": -1,
+                            "heavyremainingQueries": -1, "status": "active", "failedCount": 0,
+                            "lastFailureTime": None, "lastFailureReason": None, "tags": [], "note": ""}
+                      for sso in tokens},
+        "ssoSuper": {},
+    }))
+    token_manager._waiters = {}
+    token_manager._inflight = {}
+    token_manager._health = {}
+    token_manager._cooldown_counts = {}
+    await token_manager._load_data()
+    conversation_store._entries.clear()
+    conversation_store._stats = dict.fromkeys(conversation_store._stats, 0)
+    response_cache.clear()
+    await request_stats.reset()
+
+    # 服务（h11，与生产部署一致）
+    app = FastAPI()
+    register_exception_handlers(app)
+    app.include_router(chat_router, prefix="/v1")
+    app.include_router(batches_router, prefix="/v1")
+    app.include_router(images_router)
+    server = uvicorn.Server(uvicorn.Config(app, http="h11", log_level="warning", lifespan="off"))
+    server_sock = free_socket()
+    serve_task = asyncio.create_task(server.serve(sockets=[server_sock]))
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    try:
+        yield f"http://127.0.0.1:{server_sock.getsockname()[1]}", upstream
+    finally:
+        await batch_manager.shutdown()
+        server.should_exit = True
+        await serve_task
+        await runner.cleanup()
+
+
+async def read_events(resp: aiohttp.ClientResponse) -> list:
+    """读取完整 SSE 流，返回解析后的数据块（含 [DONE]）"""
+    events = []
+    async for raw in resp.content:
+        line = raw.strip()
+        if line.startswith(b"data: "):
+            payload = line[6:]
+            events.append(payload.decode() if payload == b"[DONE]" else orjson.loads(payload))
+    return events
+
+
+def content_of(events: list) -> str:
+    return "".join((e["choices"][0].get("delta") or {}).get("content") or ""
+                   for e in events if isinstance(e, dict))
+
+
+def chat_body(prompt: str = "hello") -> dict:
+    return {"model": "grok-4-fast", "stream": True, "messages": [{"role": "user", "content": prompt}]}
+
+
+def final_message(scenario: str) -> str:
+    for line in (Path(__file__).parent / "benchmark" / "fixtures" / f"{scenario}.ndjson").read_bytes().splitlines():
+        if model_resp := orjson.loads(line)["result"]["response"].get("modelResponse"):
+            return model_resp["message"]
+    raise AssertionError("fixture缺少modelResponse")
+
+
+async def wait_until(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.02)
+    return predicate()
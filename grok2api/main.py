@@ -12,10 +12,12 @@ from app.core.logger import logger
 from app.core.exception import register_exception_handlers
 from app.core.storage import storage_manager
 from app.core.config import setting
+from app.services.grok import imaging
 from app.services.grok.token import token_manager
 from app.api.v1.chat import router as chat_router
 from app.api.v1.models import router as models_router
 from app.api.v1.images import router as images_router
+from app.api.v1.batches import router as batches_router
 from app.api.admin.manage import router as admin_router
 from app.api.admin.register import router as register_router
 from app.services.mcp import mcp
@@ -97,14 +99,15 @@ async def lifespan(app: FastAPI):
     
     # 4. 启动批量保存任务
     await token_manager.start_batch_save()
+    await token_manager.start_limit_refresher()
 
-    # 4.5. 启动时自动同步已生成的 Token
-    try:
-        from app.api.admin.register import auto_import_generated_tokens
-        await auto_import_generated_tokens()
-    except Exception as e:
-        logger.warning(f"[启动自检] 自动同步 Token 失败: {e}")
+    # 4.5. 增量导入注册机生成的 Token，并监听新增
+    from app.services.key_import import key_importer
+    await key_importer.start()
 
+    # 4.6. 恢复未完成的批量任务
+    from app.services.batch import batch_manager
+    await batch_manager.resume()
 
     # 5. 管理MCP服务的生命周期
     mcp_lifespan_context = mcp_app.lifespan(app)
@@ -121,9 +124,14 @@ async def lifespan(app: FastAPI):
         await mcp_lifespan_context.__aexit__(None, None, None)
         logger.info("[MCP] MCP服务已关闭")
         
-        # 2. 关闭批量保存任务并刷新数据
+        # 2. 停止批量任务，关闭批量保存任务并刷新数据
+        await batch_manager.shutdown()
+        await key_importer.stop()
         await token_manager.shutdown()
         logger.info("[Token] Token管理器已关闭")
+        await proxy_pool.close()
+        imaging.shutdown()
+        logger.info("[Imaging] 图片处理进程池已关闭")
         
         # 3. 关闭核心服务
         await storage_manager.close()
@@ -148,6 +156,7 @@ register_exception_handlers(app)
 # 注册路由
 app.include_router(chat_router, prefix="/v1")
 app.include_router(models_router, prefix="/v1")
+app.include_router(batches_router, prefix="/v1")
 app.include_router(images_router)
 app.include_router(admin_router)
 app.include_router(register_router)
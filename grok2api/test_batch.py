@@ -0,0 +1,171 @@
+"""批量任务测试 - JSONL 逐行执行、结果输出、重启续跑、取消与按Key隔离
+
+    python -m pytest -q test_batch.py
+"""
+
+import asyncio
+import time
+
+import aiohttp
+import orjson
+
+from conftest import TOKENS, final_message, running_stack
+from app.core.config import setting
+from app.services import batch as batch_module
+from app.services.api_keys import api_key_manager
+from app.services.batch import batch_manager
+
+
+def _batch_payload(count: int, invalid: bool = False) -> bytes:
+    lines = [{"custom_id": f"req-{i}", "method": "POST", "url": "/v1/chat/completions",
+              "body": {"model": "grok-4-fast", "messages": [{"role": "user", "content": f"hello {i}"}]}}
+             for i in range(count)]
+    return (b"not json\n" if invalid else b"") + b"\n".join(orjson.dumps(line) for line in lines) + b"\n"
+
+
+async def _wait_status_counts(job, failed: int, timeout: float = 1) -> bool:
+    deadline = time.monotonic() + timeout
+    while job.counts()["failed"] < failed and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    return job.counts()["failed"] >= failed
+
+
+async def _wait_status(job, statuses: tuple, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while job.meta["status"] not in statuses and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    return job.meta["status"] in statuses
+
+
+def test_batch_runs_jsonl_and_resumes():
+    """批量任务逐行执行并写出结果，重启后只执行未完成的行"""
+    lines = [{"custom_id": f"req-{i}", "method": "POST", "url": "/v1/chat/completions",
+              "body": {"model": "grok-4-fast", "messages": [{"role": "user", "content": f"hello {i}"}]}}
+             for i in range(6)]
+    payload = b"\n".join(orjson.dumps(line) for line in lines) + b"\nnot json\n"
+
+    async def run():
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "500"]) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/v1/batches", data=payload) as resp:
+                    batch = await resp.json()
+                assert batch["request_counts"]["total"] == 7
+
+                async def status():
+                    async with session.get(f"{base_url}/v1/batches/{batch['id']}") as resp:
+                        return await resp.json()
+
+                deadline = time.monotonic() + 10
+                while (info := await status())["status"] == "in_progress" and time.monotonic() < deadline:
+                    await asyncio.sleep(0.1)
+                assert info["status"] == "completed"
+                assert info["request_counts"] == {"total": 7, "completed": 6, "failed": 1}
+
+                async with session.get(f"{base_url}/v1/batches/{batch['id']}/output") as resp:
+                    results = [orjson.loads(line) for line in (await resp.read()).splitlines()]
+
+            by_id = {r["custom_id"]: r for r in results}
+            assert set(by_id) == {f"req-{i}" for i in range(6)} | {None}
+            assert by_id["req-0"]["response"]["body"]["choices"][0]["message"]["content"] == final_message("text")
+            assert by_id[None]["error"]["code"] == "invalid_request"
+            assert upstream.stats["conversations"] == 6
+            # 并发不超过可用Token数
+            assert upstream.stats["peak_concurrency"] <= len(TOKENS)
+
+            # 模拟重启：删除后半结果并留下半行，重新加载后只补跑缺失的行
+            job = batch_manager.get(batch["id"])
+            output = batch_manager.output_path(job)
+            kept = [line for line in output.read_bytes().splitlines() if orjson.loads(line)["line"] <= 3]
+            output.write_bytes(b"\n".join(kept) + b'\n{"partial')
+            job.meta["status"] = "in_progress"
+            job.save_meta()
+            batch_manager._jobs = {}
+            await batch_manager.resume()
+            await batch_manager.get(batch["id"]).task
+
+            job = batch_manager.get(batch["id"])
+            assert job.meta["status"] == "completed"
+            assert job.counts() == {"total": 7, "completed": 6, "failed": 1}
+            assert sorted(orjson.loads(line)["line"] for line in output.read_bytes().splitlines()) == list(range(1, 8))
+            assert upstream.stats["conversations"] == 9
+
+    asyncio.run(run())
+
+
+def test_batch_without_tokens_writes_invalid_lines_and_fails_or_cancels():
+    """无可用Token时无效行不等待直接写出错误；取消立即生效，持续无Token超时后任务失败"""
+    async def run():
+        async with running_stack(["--ttfb", "0"], tokens=(), batch_pool_empty_timeout=0) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/v1/batches", data=_batch_payload(2, invalid=True)) as resp:
+                    job = batch_manager.get((await resp.json())["id"])
+                output = batch_manager.output_path(job)
+                assert await _wait_status_counts(job, 1)
+                assert orjson.loads(output.read_bytes())["error"]["code"] == "invalid_request"
+
+                started = time.monotonic()
+                async with session.post(f"{base_url}/v1/batches/{job.id}/cancel") as resp:
+                    assert resp.status == 200
+                assert await _wait_status(job, ("cancelled",), 1)
+                assert time.monotonic() - started < batch_module.POOL_EMPTY_WAIT
+
+                setting.grok_config["batch_pool_empty_timeout"] = 0.3
+                async with session.post(f"{base_url}/v1/batches", data=_batch_payload(2)) as resp:
+                    job = batch_manager.get((await resp.json())["id"])
+                assert await _wait_status(job, ("failed",), 2)
+                assert "无可用Token" in job.meta["errors"]["message"]
+                assert job.counts() == {"total": 2, "completed": 0, "failed": 0}
+            assert upstream.stats["conversations"] == 0
+
+    asyncio.run(run())
+
+
+def test_batch_saves_meta_periodically(monkeypatch):
+    """执行过程中每写出若干条结果保存一次元数据，崩溃后不必依赖结束时的保存"""
+    monkeypatch.setattr(batch_module, "META_SAVE_EVERY", 2)
+
+    async def run():
+        async with running_stack(["--ttfb", "0.3", "--lines-per-sec", "0"]) as (base_url, _):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/v1/batches", data=_batch_payload(6)) as resp:
+                    job = batch_manager.get((await resp.json())["id"])
+
+            meta_path = job.dir / batch_module.META_FILE
+            saved = orjson.loads(meta_path.read_bytes())
+            deadline = time.monotonic() + 3
+            while saved["request_counts"]["completed"] < 2 and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                saved = orjson.loads(meta_path.read_bytes())
+            assert saved["status"] == "in_progress" and saved["request_counts"]["completed"] >= 2
+            assert "owner" in saved and "owner" not in job.to_dict()
+            await job.task
+
+    asyncio.run(run())
+
+
+def test_batches_are_scoped_to_the_creating_key():
+    """任务只对创建它的Key可见，其他Key查询、取消、下载均返回404"""
+    async def run():
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "0"], api_key="sk-admin") as (base_url, _):
+            api_key_manager._keys = [{"key": "sk-other", "name": "other", "is_active": True}]
+            api_key_manager._loaded = True
+            owner = {"Authorization": "Bearer sk-admin"}
+            other = {"Authorization": "Bearer sk-other"}
+
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/v1/batches", data=_batch_payload(1), headers=owner) as resp:
+                    batch_id = (await resp.json())["id"]
+                await batch_manager.get(batch_id).task
+
+                async with session.get(f"{base_url}/v1/batches", headers=other) as resp:
+                    assert (await resp.json())["data"] == []
+                async with session.get(f"{base_url}/v1/batches", headers=owner) as resp:
+                    assert [job["id"] for job in (await resp.json())["data"]] == [batch_id]
+
+                for method, path in (("GET", ""), ("POST", "/cancel"), ("GET", "/output")):
+                    async with session.request(method, f"{base_url}/v1/batches/{batch_id}{path}", headers=other) as resp:
+                        assert resp.status == 404
+                    async with session.request(method, f"{base_url}/v1/batches/{batch_id}{path}", headers=owner) as resp:
+                        assert resp.status == 200
+
+    asyncio.run(run())
@@ -0,0 +1,66 @@
+"""聊天路由测试 - 客户端断开后取消上游流
+
+上游由替身生成器代替，不访问 grok.com：
+    python -m pytest -q test_chat.py
+"""
+
+import asyncio
+import time
+
+import aiohttp
+import uvicorn
+from fastapi import FastAPI
+
+from conftest import free_socket
+from app.api.v1 import chat
+from app.core.config import setting
+from app.services.request_logger import request_logger
+
+
+def test_client_disconnect_closes_upstream(monkeypatch):
+    """客户端读到首个数据块后断开，上游生成器应在1.5秒内被关闭并记录499日志"""
+    closed = []
+
+    async def fake_openai_to_grok(request: dict):
+        async def stream():
+            try:
+                yield 'data: {"choices":[{"index":0,"delta":{"content":"hi"}}]}\n\n'
+                await asyncio.sleep(3600)
+            finally:
+                closed.append(time.monotonic())
+        return stream()
+
+    monkeypatch.setattr(chat.GrokClient, "openai_to_grok", staticmethod(fake_openai_to_grok))
+    setting.grok_config["api_key"] = ""
+
+    async def run():
+        app = FastAPI()
+        app.include_router(chat.router, prefix="/v1")
+        server = uvicorn.Server(uvicorn.Config(app, http="h11", log_level="warning", lifespan="off"))
+        sock = free_socket()
+        serve_task = asyncio.create_task(server.serve(sockets=[sock]))
+        while not server.started:
+            await asyncio.sleep(0.01)
+
+        try:
+            body = {"model": "grok-4-fast", "stream": True, "messages": [{"role": "user", "content": "hello"}]}
+            async with aiohttp.ClientSession() as session:
+                resp = await session.post(f"http://127.0.0.1:{sock.getsockname()[1]}/v1/chat/completions", json=body)
+                assert resp.status == 200
+                await resp.content.readline()
+                resp.close()
+                closed_at = time.monotonic()
+
+            deadline = closed_at + 3
+            while not closed and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+            assert closed, "上游流未被关闭"
+            assert closed[0] - closed_at < 1.5, f"取消延迟过高: {closed[0] - closed_at:.2f}s"
+
+            logs = await request_logger.get_logs(10)
+            assert logs[0]["status"] == chat.CLIENT_CLOSED_REQUEST
+        finally:
+            server.should_exit = True
+            await serve_task
+
+    asyncio.run(run())
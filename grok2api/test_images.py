@@ -0,0 +1,152 @@
+"""图片链路测试 - 生成图预取、/images 派生图与上传前规范化
+
+    python -m pytest -q test_images.py
+"""
+
+import asyncio
+import base64
+import os
+import time
+from io import BytesIO
+
+import aiohttp
+from PIL import Image
+
+from conftest import chat_body, content_of, read_events, running_stack
+from app.core.config import setting
+from app.services.grok.cache import image_cache_service, image_variant_service
+from app.services.grok import imaging, upload
+from app.services.grok.upload import image_normalizer
+
+
+def test_image_stream_prefetches_and_images_route_waits(tmp_path):
+    """url模式立即输出本地链接，图片后台并发下载，/images 等待进行中的下载"""
+    async def run():
+        image_cache_service.cache_dir = tmp_path / "image"
+        image_cache_service.cache_dir.mkdir()
+        argv = ["--ttfb", "0", "--lines-per-sec", "0", "--image-size", "8", "--asset-latency", "0.5"]
+        async with running_stack(argv) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                started = time.monotonic()
+                async with session.post(f"{base_url}/v1/chat/completions", json=chat_body("image please")) as resp:
+                    events = await read_events(resp)
+                assert time.monotonic() - started < 0.5
+
+                links = [part.split(")")[0] for part in content_of(events).split("![Generated Image](")[1:]]
+                urls = ["/images/" + link.split("/images/")[1] for link in links if "/images/" in link]
+                assert len(urls) == 2
+
+                started = time.monotonic()
+                responses = await asyncio.gather(*(session.get(f"{base_url}{url}") for url in urls))
+                assert [r.status for r in responses] == [200, 200]
+                assert [await r.read() for r in responses] == [upstream.image] * 2
+                assert time.monotonic() - started < 0.9  # 两张图并发下载
+                assert upstream.stats["assets"] == 2
+
+    asyncio.run(run())
+
+
+def test_images_route_serves_cached_variants(tmp_path):
+    """/images 按参数缩放转码，auto 按 Accept 协商格式，参数归档到档位，派生图缓存后复用"""
+    async def run():
+        image_cache_service.cache_dir = tmp_path / "image"
+        image_variant_service.cache_dir = tmp_path / "variant"
+        for cache_dir in (image_cache_service.cache_dir, image_variant_service.cache_dir):
+            cache_dir.mkdir()
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "0", "--image-size", "300"]) as (base_url, _):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/v1/chat/completions", json=chat_body("image please")) as resp:
+                    link = content_of(await read_events(resp)).split("/images/")[1].split(")")[0]
+                url = f"{base_url}/images/{link}"
+
+                async with session.get(f"{url}?w=100&format=webp&q=83") as resp:
+                    assert resp.headers["Content-Type"] == "image/webp"
+                    assert Image.open(BytesIO(await resp.read())).size == (128, 128)
+
+                async with session.get(f"{url}?h=200", headers={"Accept": "image/avif,image/webp,*/*"}) as resp:
+                    assert resp.headers["Content-Type"] == "image/avif" and resp.headers["Vary"] == "Accept"
+                    assert Image.open(BytesIO(await resp.read())).size == (256, 256)
+
+                async with session.get(url) as resp:
+                    assert Image.open(BytesIO(await resp.read())).size == (300, 300)
+
+                # 落在同一档位的参数复用同一派生图
+                variants = sorted(image_variant_service.cache_dir.iterdir())
+                async with session.get(f"{url}?w=120&format=webp&q=78") as resp:
+                    assert resp.status == 200
+                assert sorted(image_variant_service.cache_dir.iterdir()) == variants and len(variants) == 2
+
+    asyncio.run(run())
+
+
+def test_variant_parameters_are_quantized():
+    """w/h 向上取到配置档位（超出按最大档位），q 按步长取整"""
+    assert image_variant_service.quantize(0, 0, None) == (0, 0, None)
+    assert image_variant_service.quantize(1, 65, 1) == (64, 128, 10)
+    assert image_variant_service.quantize(4096, 512, 96) == (2048, 512, 100)
+    setting.global_config["image_variant_sizes"] = [300, 100]
+    assert image_variant_service.quantize(150, 301, 54) == (300, 300, 50)
+
+
+def test_imaging_shutdown_closes_pool():
+    """关闭进程池后再次使用时重新创建"""
+    async def run():
+        assert await imaging.run(abs, -1) == 1
+        assert imaging._pool is not None
+        imaging.shutdown()
+        assert imaging._pool is None
+        assert await imaging.run(abs, -2) == 2
+        imaging.shutdown()
+
+    asyncio.run(run())
+
+
+def test_upload_normalizes_large_images_once():
+    """开启规范化时上传前缩小并重新压缩大图，同一图片按内容哈希复用结果"""
+    async def run():
+        buf = BytesIO()
+        Image.frombytes("RGB", (3000, 1500), os.urandom(3000 * 1500 * 3)).save(buf, "PNG")
+        data_url = "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+        body = {"model": "grok-4-fast", "stream": False, "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "describe"}, {"type": "image_url", "image_url": {"url": data_url}}]}]}
+
+        setting.global_config.update({"image_normalize": True, "image_normalize_max_dimension": 1024})
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "0"]) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                for _ in range(2):
+                    async with session.post(f"{base_url}/v1/chat/completions", json=body) as resp:
+                        assert resp.status == 200
+
+        assert len(upstream.uploaded) == 2 and len(image_normalizer._cache) == 1
+        for uploaded in upstream.uploaded:
+            assert (uploaded["fileMimeType"], uploaded["fileName"]) == ("image/jpeg", "image.jpeg")
+            content = base64.b64decode(uploaded["content"])
+            assert len(content) < len(buf.getvalue())
+            assert Image.open(BytesIO(content)).size == (1024, 512)
+
+    asyncio.run(run())
+
+
+def test_normalizer_cache_is_bounded_and_keeps_no_originals(monkeypatch):
+    """无收益的图片只缓存标记不保留原图，缓存按字节数淘汰最久未使用的条目"""
+    results = {b"small": None, b"a": (b"x" * 600_000, "image/jpeg"), b"b": (b"y" * 600_000, "image/jpeg")}
+
+    async def fake_run(func, raw, *args):
+        return results[raw]
+
+    monkeypatch.setattr(upload.imaging, "run", fake_run)
+    setting.global_config.update({"image_normalize_min_kb": 0, "image_normalize_cache_mb": 1})
+
+    async def run():
+        original = base64.b64encode(b"small").decode()
+        for _ in range(2):
+            assert await image_normalizer.normalize(original, "image/png") == (original, "image/png")
+        assert [value for value, _ in image_normalizer._cache.values()] == [upload._UNCHANGED]
+        assert image_normalizer._size < 100
+
+        for name in (b"a", b"b"):
+            await image_normalizer.normalize(base64.b64encode(name).decode(), "image/png")
+        assert len(image_normalizer._cache) == 1 and image_normalizer._size <= 1024 * 1024
+        assert image_normalizer._size == sum(size for _, size in image_normalizer._cache.values())
+
+    asyncio.run(run())
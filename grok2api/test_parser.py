@@ -0,0 +1,62 @@
+"""上游响应行解析测试
+
+    python -m pytest -q test_parser.py
+"""
+
+import sys
+from pathlib import Path
+
+import orjson
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.services.grok.parser import (
+    GrokLineParser, LINE_CONVERSATION, LINE_EMPTY, LINE_ERROR, LINE_RESPONSE, LINE_TOKEN
+)
+
+
+FIXTURE_DIR = Path(__file__).parent / "benchmark" / "fixtures"
+
+
+def _line(response: dict) -> bytes:
+    return orjson.dumps({"result": {"response": response}})
+
+
+def test_classifies_lines():
+    parse = GrokLineParser.parse
+    assert parse(b"") == (LINE_EMPTY, None)
+    assert parse(b'{"result":{}}') == (LINE_EMPTY, None)
+    assert parse(b'{"error":{"message":"bad","code":8}}') == (LINE_ERROR, {"message": "bad", "code": 8})
+    assert parse(_line({"token": "hi", "isThinking": False}))[0] == LINE_TOKEN
+    assert parse(_line({"token": "", "isThinking": True, "toolUsageCardId": "c1"}))[0] == LINE_RESPONSE
+    assert parse(_line({"token": ["a"]}))[0] == LINE_RESPONSE
+    assert parse(_line({"modelResponse": {"message": "done"}}))[0] == LINE_RESPONSE
+    # 新会话首行与续聊接口（数据直接位于 result 下）
+    assert parse(b'{"result":{"conversation":{"conversationId":"c1"}}}') == (LINE_CONVERSATION, {"conversationId": "c1"})
+    assert parse(b'{"result":{"token":"hi","isThinking":false}}') == (LINE_TOKEN, {"token": "hi", "isThinking": False})
+
+
+def test_fixture_lines_match_full_decode():
+    """解析结果与完整解码一致"""
+    for path in FIXTURE_DIR.glob("*.ndjson"):
+        for line in path.read_bytes().splitlines():
+            kind, grok_resp = GrokLineParser.parse(line)
+            assert grok_resp == orjson.loads(line)["result"]["response"]
+            assert kind in (LINE_TOKEN, LINE_RESPONSE)
+
+
+def test_filtered_tags():
+    parser = GrokLineParser("xaiartifact, xai:tool_usage_card,")
+    assert parser.is_filtered("<xaiartifact id='1'>")
+    assert parser.is_filtered("x xai:tool_usage_card y")
+    assert not parser.is_filtered("plain text")
+    # 空标签不会过滤所有内容
+    assert not GrokLineParser("").is_filtered("plain text")
+    assert not GrokLineParser(",").is_filtered("plain text")
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"{name}: ok")
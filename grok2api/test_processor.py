@@ -0,0 +1,74 @@
+"""流式响应处理测试 - 上游静默时的超时看门狗
+
+    python -m pytest -q test_processor.py
+"""
+
+import asyncio
+import time
+
+import orjson
+import pytest
+
+from app.core.config import setting
+from app.core.exception import GrokApiException
+from app.services.grok.processer import GrokResponseProcessor
+from app.services.grok.token import TokenLease, token_manager
+
+
+class StalledResponse:
+    """从不返回数据的上游响应"""
+
+    def __init__(self):
+        self.closed = False
+
+    async def aiter_lines(self):
+        await asyncio.sleep(3600)
+        yield b""
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def token_calls(monkeypatch):
+    """拦截Token管理器的副作用，记录冷却调用"""
+    cooldowns = []
+
+    async def apply_cooldown(auth_token, status_code, generation=None):
+        cooldowns.append(status_code)
+
+    monkeypatch.setattr(token_manager, "apply_cooldown", apply_cooldown)
+    monkeypatch.setattr(token_manager, "release_token", lambda sso: None)
+    monkeypatch.setattr(token_manager, "record_result", lambda *args, **kwargs: None)
+    setting.grok_config["stream_first_response_timeout"] = 0.2
+    return cooldowns
+
+
+async def _collect(response, lease: TokenLease, failover: bool) -> list:
+    return [chunk async for chunk in GrokResponseProcessor.process_stream(response, lease, failover=failover)]
+
+
+def test_first_response_timeout_finishes_stream(token_calls):
+    """不允许换Token时，首次响应超时后输出结束块与[DONE]"""
+    response = StalledResponse()
+    lease = TokenLease("tok", token_manager)
+    started = time.monotonic()
+    chunks = asyncio.run(_collect(response, lease, failover=False))
+
+    assert time.monotonic() - started < 1, "看门狗未生效"
+    assert chunks[-1] == "data: [DONE]\n\n"
+    assert orjson.loads(chunks[-2][6:])["choices"][0]["finish_reason"] == "stop"
+    assert response.closed and lease.released
+    assert token_calls == []
+
+
+def test_first_response_timeout_fails_over(token_calls):
+    """允许换Token且尚未输出内容时，抛出STREAM_TIMEOUT并冷却Token"""
+    response = StalledResponse()
+    lease = TokenLease("tok", token_manager)
+    with pytest.raises(GrokApiException) as exc:
+        asyncio.run(_collect(response, lease, failover=True))
+
+    assert exc.value.error_code == "STREAM_TIMEOUT"
+    assert token_calls == [504]
+    assert response.closed and lease.released
@@ -0,0 +1,97 @@
+"""代理测试 - 代理池预取、Token固定与隔离，KDL令牌单飞刷新
+
+    python -m pytest -q test_proxy_pool.py
+"""
+
+import asyncio
+import time
+
+from aiohttp import web
+
+from conftest import TOKENS, free_socket
+from app.core.config import setting
+from app.core.proxy_pool import ProxyPool
+from app.core.proxy_secret import KdlSecretConfig, KdlSecretProxy
+
+
+def test_proxy_pool_pins_tokens_and_quarantines():
+    """代理池预取多个代理，Token固定代理，403后隔离并只迁移受影响的Token"""
+    calls = []
+
+    async def pool_api(request):
+        calls.append(time.monotonic())
+        index = len(calls)
+        await asyncio.sleep(0.05)
+        return web.Response(text=f"10.0.0.{index}:8080")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/proxy", pool_api)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        sock = free_socket()
+        await web.SockSite(runner, sock).start()
+
+        setting.grok_config.update({"proxy_pool_size": 3, "proxy_max_forbidden": 2})
+        pool = ProxyPool()
+        pool.configure("", f"http://127.0.0.1:{sock.getsockname()[1]}/proxy", 300, "http")
+        try:
+            # 空池时并发请求只触发一次补充
+            first = await asyncio.gather(*(pool.get_proxy(sso) for sso in TOKENS))
+            assert len(calls) == 3
+            assert first[0] != first[1]  # least_loaded 分散到不同代理
+            assert await pool.get_proxy(TOKENS[0]) == first[0]
+
+            pool.report(first[0], True, 0.2)
+            lease = await pool.acquire(TOKENS[0])
+            assert (await pool.invalidate(lease, TOKENS[0])).url == first[0]  # 单次403不隔离
+            # 同一代的并发403只隔离一次，不会每个请求各换一个代理
+            moved = await asyncio.gather(*(pool.invalidate(lease, TOKENS[0]) for _ in range(10)))
+            assert {m.url for m in moved} == {moved[0].url} and moved[0].url not in (first[0], None)
+            assert await pool.get_proxy(TOKENS[1]) == first[1]
+
+            await pool._refill_task
+            stats = pool.get_stats()
+            assert (stats["depth"], stats["fetched"], stats["quarantined"]) == (3, 4, 1)
+            quarantined = [p for p in stats["proxies"] if p["quarantined"]]
+            assert quarantined[0]["forbidden"] == 2 and quarantined[0]["latency_ms"] == 200
+        finally:
+            await pool.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_kdl_refresh_is_single_flight(tmp_path):
+    """KDL令牌并发刷新只请求一次，持有旧代数的调用方直接使用新令牌"""
+    calls = []
+
+    async def secret_api(request):
+        calls.append(time.monotonic())
+        await asyncio.sleep(0.05)
+        return web.json_response({"code": 0, "data": {"secret_token": f"t{len(calls)}", "expire": 3600}})
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/token", secret_api)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        sock = free_socket()
+        await web.SockSite(runner, sock).start()
+
+        config = KdlSecretConfig("sid", "skey", "127.0.0.1", 1080,
+                                 api_url=f"http://127.0.0.1:{sock.getsockname()[1]}/token")
+        provider = KdlSecretProxy(config, tmp_path / "kdl.json")
+        try:
+            first = await asyncio.gather(*(provider.get_proxy() for _ in range(5)))
+            assert len(calls) == 1 and set(first) == {"http://sid:t1@127.0.0.1:1080"}
+
+            stale = provider.generation
+            refreshed = await asyncio.gather(*(provider.force_refresh(stale) for _ in range(10)))
+            assert len(calls) == 2 and set(refreshed) == {"http://sid:t2@127.0.0.1:1080"}
+            assert await provider.force_refresh(stale) == refreshed[0]
+            assert len(calls) == 2
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+"""注册机接口测试 - 日志尾部读取与增量游标
+
+    python -m pytest -q test_register.py
+"""
+
+import asyncio
+
+from app.api.admin import register as register_api
+
+
+def test_register_log_tail_and_cursor_follow_rotation(tmp_path, monkeypatch):
+    """注册机日志倒序读取尾部，游标增量拉取跨越轮转且不返回写入中的半行"""
+    log_file = tmp_path / "register.log"
+    monkeypatch.setattr(register_api, "REGISTER_LOG_FILE", log_file)
+    monkeypatch.setattr(register_api, "LOG_TAIL_BLOCK", 64)
+
+    async def run():
+        assert (await register_api._read_register_log(5))["logs"] == []
+        log_file.write_text("".join(f"line {i}\n" for i in range(100)))
+        result = await register_api._read_register_log(5)
+        assert result["reset"] and result["logs"] == [f"line {i}" for i in range(95, 100)]
+
+        with open(log_file, "a") as f:
+            f.write("line 100\nline 1")
+        result = await register_api._read_register_log(50, result["cursor"])
+        assert not result["reset"] and result["logs"] == ["line 100"]
+
+        with open(log_file, "a") as f:
+            f.write("01\n")
+        register_api._rotate_register_log()
+        log_file.write_text("line 102\n")
+        result = await register_api._read_register_log(50, result["cursor"])
+        assert result["logs"] == ["line 101", "line 102"]
+
+        result = await register_api._read_register_log(50, "1:999999")
+        assert result["reset"] and result["logs"][-1] == "line 102"
+
+    asyncio.run(run())
+
+
+def test_register_log_cursor_pages_bursts_without_loss(tmp_path, monkeypatch):
+    """一次新增的行数超过 lines 时分多次返回，游标停在最后返回的行之后，跨轮转也不丢行"""
+    log_file = tmp_path / "register.log"
+    monkeypatch.setattr(register_api, "REGISTER_LOG_FILE", log_file)
+
+    async def run():
+        log_file.write_text("start\n")
+        cursor = (await register_api._read_register_log(5))["cursor"]
+
+        with open(log_file, "a") as f:
+            f.write("".join(f"line {i}\n" for i in range(80)))
+        register_api._rotate_register_log()
+        log_file.write_text("".join(f"line {i}\n" for i in range(80, 120)) + "line 1")
+
+        received = []
+        for _ in range(4):
+            result = await register_api._read_register_log(50, cursor)
+            assert not result["reset"] and len(result["logs"]) <= 50
+            received += result["logs"]
+            cursor = result["cursor"]
+        assert received == [f"line {i}" for i in range(120)]
+
+    asyncio.run(run())
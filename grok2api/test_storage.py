@@ -0,0 +1,91 @@
+"""Token存储测试 - 快照+变更日志与 SQLite 多 worker 同步
+
+    python -m pytest -q test_storage.py
+"""
+
+import asyncio
+
+from app.core.storage import SqliteStorage, TokenJournal
+from app.models.grok_models import TokenType
+from app.services.grok.token import token_manager
+
+
+def test_token_journal_appends_deltas_and_compacts():
+    """Token保存只追加变更日志，重启回放日志，压缩后快照为紧凑JSON"""
+    async def run():
+        await token_manager._load_data()
+        snapshot = token_manager.token_file
+        journal = snapshot.with_suffix(".journal")
+
+        await token_manager.add_token(["sso-1", "sso-2"], TokenType.NORMAL)
+        await token_manager._save_data()
+        assert not snapshot.exists()
+        assert len(journal.read_bytes().splitlines()) == 2
+
+        await token_manager.update_token_note("sso-1", TokenType.NORMAL, "hello")
+        await token_manager.delete_token(["sso-2"], TokenType.NORMAL)
+        await token_manager._save_data()
+        # 写入中断留下的半行不影响回放，下次追加时被隔开
+        with open(journal, "ab") as f:
+            f.write(b'["ssoNormal","sso-3",{"no')
+        await token_manager.add_token(["sso-4"], TokenType.NORMAL)
+        await token_manager._save_data()
+
+        replayed = TokenJournal(snapshot).load()
+        assert set(replayed["ssoNormal"]) == {"sso-1", "sso-4"}
+        assert replayed["ssoNormal"]["sso-1"]["note"] == "hello"
+
+        other = TokenJournal(snapshot)
+        other.load()
+        assert other.read_changes() == []
+        await token_manager.add_token(["sso-5"], TokenType.SUPER)
+        await token_manager._save_data()
+        assert [change[:2] for change in other.read_changes()] == [("ssoSuper", "sso-5")]
+
+        await token_manager._save_data(full=True)
+        assert other.read_changes() is None  # 快照被重写，需完整重新加载
+        assert journal.read_bytes() == b""
+        assert b"\n" not in snapshot.read_bytes()
+        assert TokenJournal(snapshot).load() == token_manager.token_data
+
+    asyncio.run(run())
+
+
+def test_sqlite_storage_syncs_rows_between_workers(tmp_path):
+    """SQLite存储按行写入，其他worker按seq增量读取变更（含删除）"""
+    async def run():
+        worker_a = SqliteStorage("", tmp_path)
+        worker_b = SqliteStorage("", tmp_path)
+        await worker_a.init_db()
+        await worker_b.init_db()
+        try:
+            token_manager._storage = worker_a
+            await token_manager._load_data()
+            await token_manager.add_token(["sso-1", "sso-2"], TokenType.NORMAL)
+            await token_manager._save_data()
+            assert set((await worker_b.load_tokens())["ssoNormal"]) == {"sso-1", "sso-2"}
+
+            await token_manager.update_token_note("sso-1", TokenType.NORMAL, "hello")
+            await token_manager.delete_token(["sso-2"], TokenType.NORMAL)
+            await token_manager._save_data()
+            worker_b._last_poll = 0
+            changes = {sso: data for _, sso, data in await worker_b.load_token_changes()}
+            assert changes["sso-1"]["note"] == "hello" and changes["sso-2"] is None
+            assert await worker_a.load_token_changes() == []  # 自己的写入不重复同步
+
+            # 全量保存把不在数据中的行标记为删除
+            await worker_b.save_tokens({"ssoNormal": {}, "ssoSuper": {"sso-9": {"status": "active"}}})
+            token_manager._save_pending = False
+            worker_a._last_poll = 0
+            await token_manager._reload_if_needed()
+            assert token_manager.token_data["ssoNormal"] == {} and "sso-9" in token_manager.token_data["ssoSuper"]
+
+            plan = worker_a._conn.execute(
+                "EXPLAIN QUERY PLAN SELECT sso FROM tokens WHERE token_type = ? AND status = ?",
+                ("ssoNormal", "active")).fetchall()
+            assert "idx_tokens_status" in str(plan)
+        finally:
+            await worker_a.close()
+            await worker_b.close()
+
+    asyncio.run(run())
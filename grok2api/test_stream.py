@@ -0,0 +1,310 @@
+"""流式链路测试 - 本地模拟上游 + 真实 uvicorn 服务
+
+    python -m pytest -q test_stream.py
+"""
+
+import asyncio
+import time
+
+import aiohttp
+import orjson
+
+from conftest import TOKENS, chat_body, content_of, final_message, read_events, running_stack, wait_until
+from app.services.grok.client import FanOutStream, GrokClient
+from app.services.grok.conversation import conversation_store
+from app.services.grok.delta import DELTA_FINISH, DELTA_TEXT
+from app.services.grok.processer import GrokResponseProcessor
+from app.services.response_cache import CachedResponse, CachedStream
+from app.services.grok.token import token_manager
+from app.services.request_stats import request_stats
+
+
+def test_client_disconnect_cancels_upstream():
+    """客户端中途断开后，上游连接应在1.5秒内被关闭且租约释放"""
+    async def run():
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "10"]) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                resp = await session.post(f"{base_url}/v1/chat/completions", json=chat_body())
+                assert resp.status == 200
+                await resp.content.readline()
+                resp.close()
+                closed_at = time.monotonic()
+
+            assert await wait_until(lambda: upstream.abort_times, 3), "上游未感知到断开"
+            latency = upstream.abort_times[0] - closed_at
+            assert latency < 1.5, f"取消延迟过高: {latency:.2f}s"
+            assert await wait_until(lambda: all(token_manager.get_inflight(t) == 0 for t in TOKENS), 1)
+
+    asyncio.run(run())
+
+
+def test_first_response_timeout_finishes_stream():
+    """上游挂起且不允许换Token时，应在首次响应超时后返回结束块并释放租约"""
+    async def run():
+        async with running_stack(["--ttfb", "5"], stream_first_response_timeout=1,
+                                 stream_timeout_failover=0) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                started = time.monotonic()
+                async with session.post(f"{base_url}/v1/chat/completions", json=chat_body()) as resp:
+                    events = await read_events(resp)
+                elapsed = time.monotonic() - started
+
+            assert elapsed < 3, f"超时未生效: {elapsed:.2f}s"
+            assert events[-1] == "[DONE]"
+            assert events[-2]["choices"][0]["finish_reason"] == "stop"
+            assert upstream.stats["conversations"] == 1
+            assert await wait_until(lambda: all(token_manager.get_inflight(t) == 0 for t in TOKENS), 1)
+
+    asyncio.run(run())
+
+
+def test_first_response_timeout_fails_over():
+    """首次响应超时后应换用另一个Token重新请求，并输出完整内容"""
+    async def run():
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "0", "--stall-first", "1"],
+                                 stream_first_response_timeout=1,
+                                 stream_timeout_failover=1) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/v1/chat/completions", json=chat_body()) as resp:
+                    events = await read_events(resp)
+
+            assert events[-1] == "[DONE]"
+            assert content_of(events), "换Token后未输出内容"
+            assert upstream.stats["stalled"] == 1
+            assert len(upstream.conversation_tokens) == 2
+            assert upstream.conversation_tokens[0] != upstream.conversation_tokens[1]
+            assert await wait_until(lambda: all(token_manager.get_inflight(t) == 0 for t in TOKENS), 1)
+
+    asyncio.run(run())
+
+
+def test_chunk_timeout_does_not_fail_over():
+    """上游已返回数据后的数据块超时不换Token，直接结束流"""
+    async def run():
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "0.2"], stream_chunk_timeout=1,
+                                 stream_timeout_failover=1) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/v1/chat/completions", json=chat_body()) as resp:
+                    events = await read_events(resp)
+
+            assert events[-1] == "[DONE]"
+            assert events[-2]["choices"][0]["finish_reason"] == "stop"
+            assert upstream.stats["conversations"] == 1
+            assert await wait_until(lambda: all(token_manager.get_inflight(t) == 0 for t in TOKENS), 1)
+
+    asyncio.run(run())
+
+
+def test_encode_chunk_matches_schema():
+    """SSE块与 OpenAIChatCompletionChunkResponse 序列化结果一致"""
+    from app.models.openai_schema import (
+        OpenAIChatCompletionChunkResponse, OpenAIChatCompletionChunkChoice, OpenAIChatCompletionChunkMessage
+    )
+    from app.services.grok.delta import encode_chunk
+
+    for content, finish in (("你好 \"x\"\n", None), ("", "stop")):
+        encoded = orjson.loads(encode_chunk(content, "grok-4", finish, "chatcmpl-1")[6:])
+        expected = OpenAIChatCompletionChunkResponse(
+            id="chatcmpl-1", created=encoded["created"], model="grok-4",
+            choices=[OpenAIChatCompletionChunkChoice(
+                index=0,
+                delta=OpenAIChatCompletionChunkMessage(role="assistant", content=content) if content else {},
+                finish_reason=finish,
+            )],
+        )
+        assert encoded == orjson.loads(expected.model_dump_json())
+
+
+def test_stream_non_stream_and_mcp_share_deltas():
+    """流式输出思考标签与正文，非流式与MCP使用上游最终回复"""
+    from app.services.mcp.tools import ask_grok_impl
+
+    async def run():
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "0"]) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/v1/chat/completions", json=chat_body()) as resp:
+                    events = await read_events(resp)
+                body = {**chat_body(), "stream": False}
+                async with session.post(f"{base_url}/v1/chat/completions", json=body) as resp:
+                    assert resp.status == 200
+                    completion = await resp.json()
+
+            streamed = content_of(events)
+            assert streamed.startswith("<think>\n") and "\n</think>\n" in streamed
+            assert len({e["id"] for e in events if isinstance(e, dict)}) == 1
+            assert events[-1] == "[DONE]"
+
+            message = final_message("text")
+            assert completion["choices"][0]["message"]["content"] == message
+            assert await ask_grok_impl("hello", "grok-4-fast") == message
+            assert await wait_until(lambda: all(token_manager.get_inflight(t) == 0 for t in TOKENS), 1)
+
+    asyncio.run(run())
+
+
+def test_image_stream_finishes_with_done():
+    """图片流输出图片链接并以 [DONE] 结束"""
+    async def run():
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "0", "--image-size", "8"]) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{base_url}/v1/chat/completions", json=chat_body("image please")) as resp:
+                    events = await read_events(resp)
+
+            assert content_of(events).count("![Generated Image](") == 2
+            assert events[-1] == "[DONE]"
+            assert events[-2]["choices"][0]["finish_reason"] == "stop"
+
+    asyncio.run(run())
+
+
+def test_conversation_affinity_continues_upstream_conversation():
+    """多轮对话命中会话映射时只发送新增消息，会话失效时回退完整重放"""
+    async def run():
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "0"]) as (base_url, upstream):
+            async with aiohttp.ClientSession() as session:
+                first = {**chat_body(), "stream": False}
+                async with session.post(f"{base_url}/v1/chat/completions", json=first) as resp:
+                    reply = (await resp.json())["choices"][0]["message"]["content"]
+
+                # 第二轮（流式）：只发送新消息，使用创建会话的Token
+                messages = first["messages"] + [{"role": "assistant", "content": reply},
+                                                 {"role": "user", "content": "tell me more"}]
+                async with session.post(f"{base_url}/v1/chat/completions",
+                                        json={**chat_body(), "messages": messages}) as resp:
+                    events = await read_events(resp)
+                assert upstream.stats["continuations"] == 1
+                assert upstream.messages[-1] == "tell me more"
+                assert events[-1] == "[DONE]"
+
+                # 第三轮：客户端回传含 <think> 的流式内容同样命中
+                messages += [{"role": "assistant", "content": content_of(events)},
+                             {"role": "user", "content": "and then?"}]
+                async with session.post(f"{base_url}/v1/chat/completions",
+                                        json={**chat_body(), "messages": messages, "stream": False}) as resp:
+                    assert resp.status == 200
+                assert upstream.stats["continuations"] == 2
+                assert upstream.stats["conversations"] == 1
+
+                # 上游会话失效：回退为完整重放
+                upstream.conversation_owners.clear()
+                messages += [{"role": "assistant", "content": final_message("text")},
+                             {"role": "user", "content": "last one"}]
+                async with session.post(f"{base_url}/v1/chat/completions",
+                                        json={**chat_body(), "messages": messages, "stream": False}) as resp:
+                    assert resp.status == 200
+                assert upstream.stats["conversations"] == 2
+                assert upstream.messages[-1].startswith("用户：hello")
+
+            stats = conversation_store.get_stats()
+            assert (stats["hits"], stats["misses"], stats["fallbacks"]) == (3, 0, 1)
+            assert stats["bytes_saved"] > 0
+            # 会话失效（404）不计入Token失败
+            assert all(token_manager._find_token(t)[1].get("failedCount", 0) == 0 for t in TOKENS)
+            assert await wait_until(lambda: all(token_manager.get_inflight(t) == 0 for t in TOKENS), 1)
+
+    asyncio.run(run())
+
+
+def test_response_cache_replays_identical_requests():
+    """开启响应缓存后相同请求不再访问上游，流式请求以合成流回放，未命中的流式请求不计入miss"""
+    async def run():
+        async with running_stack(["--ttfb", "0", "--lines-per-sec", "0"],
+                                 response_cache_default=True) as (base_url, upstream):
+            body = {**chat_body(), "stream": False}
+            async with aiohttp.ClientSession() as session:
+                replies = []
+                for _ in range(2):
+                    async with session.post(f"{base_url}/v1/chat/completions", json=body) as resp:
+                        replies.append((await resp.json())["choices"][0]["message"]["content"])
+                async with session.post(f"{base_url}/v1/chat/completions", json=chat_body()) as resp:
+                    events = await read_events(resp)
+                # 参数不同则不命中
+                async with session.post(f"{base_url}/v1/chat/completions", json={**body, "temperature": 0.1}) as resp:
+                    assert resp.status == 200
+                # 未命中的流式请求不会写入缓存，不计入miss
+                async with session.post(f"{base_url}/v1/chat/completions", json=chat_body("other")) as resp:
+                    assert (await read_events(resp))[-1] == "[DONE]"
+
+            assert replies[0] == replies[1] == content_of(events) == final_message("text")
+            assert events[-1] == "[DONE]"
+            assert upstream.stats["conversations"] == 3
+            cache = request_stats.get_stats()["cache"]
+            assert (cache["hits"], cache["misses"], cache["quota_saved"]) == (2, 2, 2)
+
+    asyncio.run(run())
+
+
+def test_n_fans_out_across_tokens_and_merges_choices():
+    """n>1 并发发起多个上游会话（不同Token），流式按 index 交错输出，非流式合并为多个 choices"""
+    async def run():
+        tokens = ("tok-a", "tok-b", "tok-c")
+        image = "data:image/png;base64,iVBORw0KGgo="
+        async with running_stack(["--ttfb", "0.1", "--lines-per-sec", "0"], tokens=tokens) as (base_url, upstream):
+            body = {"model": "grok-4-fast", "stream": True, "n": 3, "messages": [{"role": "user", "content": [
+                {"type": "text", "text": "hello"}, {"type": "image_url", "image_url": {"url": image}}]}]}
+            async with aiohttp.ClientSession() as session:
+                started = time.monotonic()
+                async with session.post(f"{base_url}/v1/chat/completions", json=body) as resp:
+                    events = await read_events(resp)
+                assert time.monotonic() - started < 0.3  # 三个上游会话并发
+
+                assert events.count("[DONE]") == 1 and events[-1] == "[DONE]"
+                chunks = [e for e in events if isinstance(e, dict)]
+                assert len({e["id"] for e in chunks}) == 1
+                finished = [e["choices"][0]["index"] for e in chunks if e["choices"][0]["finish_reason"]]
+                assert sorted(finished) == [0, 1, 2]
+                assert sorted(upstream.conversation_tokens) == sorted(tokens)
+                assert upstream.stats["uploads"] == 3
+
+                # 多轮消息也不查询会话映射，各候选完整重放
+                messages = [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"},
+                            {"role": "user", "content": "again"}]
+                body.update({"stream": False, "n": 2, "messages": messages})
+                async with session.post(f"{base_url}/v1/chat/completions", json=body) as resp:
+                    result = await resp.json()
+                assert [c["index"] for c in result["choices"]] == [0, 1]
+                assert all(c["message"]["content"] for c in result["choices"])
+                stats = conversation_store.get_stats()
+                assert (stats["hits"], stats["misses"], stats["entries"]) == (0, 0, 0)
+                assert upstream.stats["continuations"] == 0
+
+    asyncio.run(run())
+
+
+def test_fan_out_stream_yields_indexed_deltas():
+    """多候选流的 deltas() 输出带候选序号的增量事件，SSE输出在全部候选结束后只有一次 [DONE]"""
+    def streams():
+        return [CachedStream(CachedResponse(f"answer {i}", "grok-4-fast", 0, 0)) for i in range(3)]
+
+    async def run():
+        stream = FanOutStream(streams(), "grok-4-fast")
+        deltas = [delta async for delta in stream.deltas()]
+        await stream.aclose()
+        assert sorted((d.index, d.kind, d.text) for d in deltas if d.kind == DELTA_TEXT) == \
+            [(i, DELTA_TEXT, f"answer {i}") for i in range(3)]
+        assert sorted(d.index for d in deltas if d.kind == DELTA_FINISH) == [0, 1, 2]
+
+        stream = FanOutStream(streams(), "grok-4-fast")
+        chunks = [chunk async for chunk in stream]
+        await stream.aclose()
+        assert chunks.count("data: [DONE]\n\n") == 1 and chunks[-1] == "data: [DONE]\n\n"
+        events = [orjson.loads(chunk[6:]) for chunk in chunks[:-1]]
+        assert len({e["id"] for e in events}) == 1
+        assert sorted(e["choices"][0]["index"] for e in events if e["choices"][0]["finish_reason"]) == [0, 1, 2]
+
+    asyncio.run(run())
+
+
+def test_fan_out_merges_non_stream_responses_into_new_object():
+    """非流式多候选合并为新的响应对象，choices 重新编号，usage 逐项求和"""
+    first = GrokResponseProcessor._build_response("a", "grok-4-fast")
+    second = GrokResponseProcessor._build_response("b", "grok-4-fast")
+    first.usage = {"prompt_tokens": 3, "completion_tokens": 5}
+    second.usage = {"prompt_tokens": 3, "completion_tokens": 7}
+
+    merged = GrokClient._merge_responses([first, second])
+    assert merged is not first and merged.id not in (first.id, second.id)
+    assert [(c.index, c.message.content) for c in merged.choices] == [(0, "a"), (1, "b")]
+    assert merged.usage == {"prompt_tokens": 6, "completion_tokens": 12}
+    assert len(first.choices) == 1 and first.usage == {"prompt_tokens": 3, "completion_tokens": 5}
+    assert GrokClient._merge_responses([GrokResponseProcessor._build_response("c", "m")]).usage is None
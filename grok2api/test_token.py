@@ -0,0 +1,392 @@
+"""Token管理测试 - 导入导出、列表索引、限额桶、排队等待、健康度与后台刷新
+
+    python -m pytest -q test_token.py
+"""
+
+import asyncio
+import time
+
+import orjson
+import portalocker
+import pytest
+
+from app.core.config import setting
+from app.core.exception import GrokApiException
+from app.models.grok_models import TokenType
+from app.services.grok import token as token_module
+from app.services.grok.token import LIMIT_REFRESH_LOCK, TOKEN_WAIT_POLL, token_manager
+from app.services.key_import import key_importer
+from app.services.token_transfer import token_transfer
+
+
+def test_key_import_reads_new_lines_and_keeps_existing_tokens():
+    """注册输出按检查点增量导入，已存在的Token不被覆盖，文件被替换时从头读取"""
+    async def run():
+        await token_manager._load_data()
+        keys = key_importer.keys_file
+
+        await token_manager.add_token(["sso-1"], TokenType.NORMAL)
+        await token_manager.update_token_note("sso-1", TokenType.NORMAL, "keep")
+        keys.write_text("sso-1\nsso-2\nsso-3")  # 末行仍在写入
+        assert await key_importer.sync() == {"read": 2, "added": 1}
+        assert token_manager.token_data["ssoNormal"]["sso-1"]["note"] == "keep"
+
+        with open(keys, "a") as f:
+            f.write("\nsso-4\n")
+        assert await key_importer.sync() == {"read": 2, "added": 2}
+        assert await key_importer.sync() == {"read": 0, "added": 0}
+        assert await key_importer.sync(rescan=True) == {"read": 4, "added": 0}
+
+        # 检查点持久化，新实例状态下继续从偏移读取
+        key_importer._checkpoint = None
+        assert await key_importer.sync() == {"read": 0, "added": 0}
+
+        keys.unlink()
+        keys.write_text("sso-5\n")  # 清空后重新生成（新inode）
+        assert await key_importer.sync() == {"read": 1, "added": 1}
+        assert set(token_manager.token_data["ssoNormal"]) == {f"sso-{i}" for i in range(1, 6)}
+
+    asyncio.run(run())
+
+
+def test_token_import_export_streams_in_chunks(tmp_path):
+    """批量导入跨块拆分的行并去重，导出的NDJSON可原样导入另一节点"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token(["sso-1"], TokenType.NORMAL)
+        await token_manager.update_token_note("sso-1", TokenType.NORMAL, "keep")
+
+        body = b"sso-1\nsso-2\n" + orjson.dumps(["ssoSuper", "sso-3", {"note": "moved", "remainingQueries": 7}]) \
+            + b"\n[broken\n\nsso-2\nsso-4"
+
+        async def chunks():
+            for i in range(0, len(body), 5):
+                yield body[i:i + 5]
+
+        progress = await token_transfer.import_stream(chunks(), TokenType.NORMAL)
+        assert (progress["read"], progress["added"], progress["skipped"], progress["invalid"]) == (5, 3, 2, 1)
+        assert token_manager.token_data["ssoNormal"]["sso-1"]["note"] == "keep"
+        assert token_manager.token_data["ssoSuper"]["sso-3"]["remainingQueries"] == 7
+        assert token_manager.token_data["ssoSuper"]["sso-3"]["status"] == "active"
+
+        exported = b"".join([chunk async for chunk in token_transfer.export_stream()])
+        text = b"".join([chunk async for chunk in token_transfer.export_stream(TokenType.NORMAL, "text")])
+        assert text.split() == [b"sso-1", b"sso-2", b"sso-4"]
+
+        source = token_manager.token_data
+        token_manager.token_file = tmp_path / "other.json"
+        await token_manager._load_data()
+
+        async def single():
+            yield exported
+
+        assert (await token_transfer.import_stream(single(), TokenType.NORMAL))["added"] == 4
+        assert token_manager.token_data == source
+
+    asyncio.run(run())
+
+
+def test_token_index_filters_sorts_and_counts():
+    """Token列表索引：按状态/标签/冷却筛选、排序分页，统计随Token变更增量更新"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token([f"sso-{i}" for i in range(6)], TokenType.NORMAL)
+        await token_manager.add_token(["super-1"], TokenType.SUPER)
+        await token_manager.update_limits("sso-1", normal=5)
+        await token_manager.update_limits("sso-2", normal=0)
+        await token_manager.update_limits("sso-3", normal=9)
+        await token_manager.update_token_tags("sso-3", TokenType.NORMAL, ["vip"])
+        await token_manager.update_token_note("sso-4", TokenType.NORMAL, "Backup Pool")
+
+        stats = token_manager.get_token_stats()["ssoNormal"]
+        assert (stats["total"], stats["unused"], stats["active"], stats["exhausted"]) == (6, 3, 2, 1)
+        assert stats["remaining_queries"] == 14
+        assert token_manager.get_all_tags() == ["vip"]
+
+        total, page = token_manager.query_tokens(status="active", sort="remaining", desc=True)
+        assert total == 2 and [t[0] for t in page] == ["sso-3", "sso-1"]
+        assert [t[0] for t in token_manager.query_tokens(tag="vip")[1]] == ["sso-3"]
+        assert [t[0] for t in token_manager.query_tokens(search="backup")[1]] == ["sso-4"]
+        assert token_manager.query_tokens(token_type="ssoSuper")[0] == 1
+
+        total, page = token_manager.query_tokens(token_type="ssoNormal", sort="token", desc=False, offset=2, limit=2)
+        assert total == 6 and [t[0] for t in page] == ["sso-2", "sso-3"]
+
+        # 冷却叠加在基础状态上，到期后自动恢复
+        token_manager.token_data["ssoNormal"]["sso-1"]["cooldownUntil"] = int(time.time() * 1000) + 60000
+        token_manager._mark_dirty("sso-1")
+        stats = token_manager.get_token_stats()["ssoNormal"]
+        assert (stats["active"], stats["cooldown"], stats["limited"]) == (1, 1, 2)
+        assert [t[0] for t in token_manager.query_tokens(status="cooldown")[1]] == ["sso-1"]
+        assert token_manager.query_tokens(cooldown=False)[0] == 6
+        assert token_manager._index.stats(now_ms=int(time.time() * 1000) + 120000)["ssoNormal"]["cooldown"] == 0
+
+        await token_manager.update_token_tags("sso-3", TokenType.NORMAL, [])
+        await token_manager.delete_token(["sso-0"], TokenType.NORMAL)
+        assert token_manager.get_all_tags() == []
+        assert token_manager.get_token_stats()["ssoNormal"]["total"] == 5
+
+    asyncio.run(run())
+
+
+def test_quota_buckets_select_by_model_and_predict_reset():
+    """按模型所属限额桶分配Token：桶耗尽不影响其他桶，429按窗口预测重置而非冷却整个Token"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token(["sso-a"], TokenType.NORMAL)
+        await token_manager.update_quota("sso-a", "grok-4", {"remainingTokens": 0, "windowSizeSeconds": 7200})
+        await token_manager.update_quota("sso-a", "grok-3", {"remainingTokens": 5, "windowSizeSeconds": 7200})
+
+        data = token_manager.token_data["ssoNormal"]["sso-a"]
+        assert data["quotas"]["grok-4"]["resetAt"] > time.time() * 1000 + 7000 * 1000
+        assert token_manager.available_count("grok-4") == 0
+        assert token_manager.available_count("grok-4.1-thinking") == 1  # 未记录的桶视为未知
+        assert await token_manager.select_token("grok-3-fast") == "sso-a"
+        token_manager.release_token("sso-a")
+
+        await token_manager.apply_cooldown("sso-rw=sso-a;sso=sso-a", 429, None, "grok-3-fast")
+        quota = data["quotas"]["grok-3"]
+        assert quota["remaining"] == 0 and quota["resetAt"] == quota["checkedAt"] + 7200 * 1000
+        assert not data.get("cooldownUntil")
+        assert token_manager.available_count("grok-3-fast") == 0
+
+        # 预计重置时间已过的桶重新可用
+        data["quotas"]["grok-4"]["resetAt"] = int(time.time() * 1000) - 1
+        assert await token_manager.select_token("grok-4") == "sso-a"
+        token_manager.release_token("sso-a")
+        assert set(token_manager._refresh_buckets("ssoNormal")) >= {"grok-3", "grok-4"}
+        assert "grok-4-heavy" not in token_manager._refresh_buckets("ssoNormal")
+        token_manager._refresh_queue.clear()
+
+    asyncio.run(run())
+
+
+def test_wait_for_token_times_out_and_leaves_queue():
+    """无可用Token时排队到最长等待时间后失败，并退出等待队列"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token(["sso-a"], TokenType.NORMAL)
+        token_manager._cooldown_counts["sso-a"] = 100
+        setting.grok_config["token_wait_timeout"] = 0.3
+
+        started = time.monotonic()
+        with pytest.raises(GrokApiException) as exc:
+            await token_manager.select_token("grok-4-fast")
+        assert exc.value.error_code == "NO_AVAILABLE_TOKEN"
+        assert 0.3 <= time.monotonic() - started < 1
+        assert not token_manager._waiters["normal"]
+
+    asyncio.run(run())
+
+
+def test_wait_for_token_hands_released_token_in_fifo_order():
+    """Token恢复可用时按排队顺序交给等待者，租约在交付时计入"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token(["sso-a"], TokenType.NORMAL)
+        token_manager._cooldown_counts["sso-a"] = 100
+        setting.grok_config["token_wait_timeout"] = 5
+
+        served = []
+        waiters = []
+        for i in range(3):
+            task = asyncio.create_task(token_manager.select_token("grok-4-fast"))
+            task.add_done_callback(lambda _, i=i: served.append(i))
+            waiters.append(task)
+            await asyncio.sleep(0.05)
+        assert len(token_manager._waiters["normal"]) == 3
+
+        started = time.monotonic()
+        del token_manager._cooldown_counts["sso-a"]
+        await token_manager.add_token(["sso-b"], TokenType.NORMAL)  # 新增Token唤醒等待者
+        results = await asyncio.gather(*waiters)
+        assert time.monotonic() - started < 0.5
+        assert served == [0, 1, 2]
+        assert set(results) <= {"sso-a", "sso-b"}
+        assert sum(token_manager.get_inflight(sso) for sso in ("sso-a", "sso-b")) == 3
+        assert not token_manager._waiters["normal"]
+
+    asyncio.run(run())
+
+
+def test_wait_for_token_wakes_on_cooldown_expiry():
+    """时间冷却到期时由定时器唤醒等待者，无需等到兜底轮询"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token(["sso-a"], TokenType.NORMAL)
+        token_manager.token_data["ssoNormal"]["sso-a"]["cooldownUntil"] = int(time.time() * 1000) + 300
+        setting.grok_config["token_wait_timeout"] = 5
+
+        started = time.monotonic()
+        assert await token_manager.select_token("grok-4-fast") == "sso-a"
+        assert 0.25 <= time.monotonic() - started < TOKEN_WAIT_POLL
+        assert token_manager.get_inflight("sso-a") == 1
+
+    asyncio.run(run())
+
+
+def test_acquire_spreads_concurrent_leases_and_release_decrements():
+    """并发分配的租约落在不同Token上，释放后并发计数递减且重复释放无效"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token(["sso-a", "sso-b", "sso-c"], TokenType.NORMAL)
+
+        leases = await asyncio.gather(*(token_manager.acquire("grok-4-fast") for _ in range(3)))
+        assert sorted(lease.sso for lease in leases) == ["sso-a", "sso-b", "sso-c"]
+        assert all(token_manager.get_inflight(lease.sso) == 1 for lease in leases)
+
+        extra = await token_manager.acquire("grok-4-fast")
+        assert token_manager.get_inflight(extra.sso) == 2
+        extra.release()
+        extra.release()
+        assert token_manager.get_inflight(extra.sso) == 1
+
+        token_manager.release_token(leases[0].auth_token)  # 也接受 Cookie 形式的令牌
+        assert token_manager.get_inflight(leases[0].sso) == 0
+        for lease in leases[1:]:
+            lease.release()
+        assert token_manager._inflight == {}
+
+    asyncio.run(run())
+
+
+def test_health_factor_adapts_after_cooldown_and_ignores_stale_results():
+    """冷却后首个新租约成功则缩短冷却倍数、失败则延长，冷却前在途请求的迟到结果不参与调整"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token(["sso-a"], TokenType.NORMAL)
+        health = token_manager._get_health("sso-a")
+
+        stale = await token_manager.acquire("grok-4-fast")
+        first = await token_manager.acquire("grok-4-fast")
+        await token_manager.apply_cooldown(first.auth_token, 500, first.generation)
+        assert (health.generation, health.recovering, token_manager._cooldown_counts["sso-a"]) == (1, True, 5)
+
+        # 冷却前已在途请求的失败与成功都不影响本轮冷却
+        await token_manager.apply_cooldown(stale.auth_token, 500, stale.generation)
+        token_manager.record_result(stale.auth_token, True, generation=stale.generation)
+        assert (health.generation, health.recovering, health.cooldown_factor) == (1, True, 1.0)
+        assert token_manager._cooldown_counts["sso-a"] == 5
+
+        # 冷却结束后首个新租约成功：倍数减半，下一轮冷却次数随之缩短
+        del token_manager._cooldown_counts["sso-a"]
+        recovered = await token_manager.acquire("grok-4-fast")
+        token_manager.record_result(recovered.auth_token, True, generation=recovered.generation)
+        assert (health.cooldown_factor, health.recovering) == (0.5, False)
+        await token_manager.apply_cooldown(recovered.auth_token, 500, recovered.generation)
+        assert token_manager._cooldown_counts["sso-a"] == 2
+
+        # 冷却结束后首个新租约仍失败：倍数翻倍后再进入冷却
+        del token_manager._cooldown_counts["sso-a"]
+        retry = await token_manager.acquire("grok-4-fast")
+        await token_manager.apply_cooldown(retry.auth_token, 500, retry.generation)
+        assert (health.cooldown_factor, health.generation) == (1.0, 3)
+        assert token_manager._cooldown_counts["sso-a"] == 5
+
+        for lease in (stale, first, recovered, retry):
+            lease.release()
+
+    asyncio.run(run())
+
+
+def _mark_checked(sso: str, now: float, remaining: int = 10) -> dict:
+    """标记Token近期已检查且额度已知（不参与陈旧抽样）"""
+    data = token_manager._find_token(sso)[1]
+    data.update({"lastLimitCheck": int(now * 1000), "remainingQueries": remaining})
+    return data
+
+
+def test_refresher_pops_due_tokens_in_order_and_skips_superseded():
+    """到期预约按时间顺序弹出，跳过失效Token、被延长的冷却与已被请求刷新过的条目"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token(["sso-a", "sso-b", "sso-c", "sso-d", "sso-e"], TokenType.NORMAL)
+        now = time.time()
+        token_manager._refresh_queue.clear()
+
+        token_manager.schedule_limit_check("sso-b", now - 10)
+        token_manager.schedule_limit_check("sso-a", now - 20)
+        token_manager.schedule_limit_check("sso-e", now + 60)  # 尚未到期
+        token_manager.token_data["ssoNormal"]["sso-c"]["status"] = "expired"
+        token_manager.schedule_limit_check("sso-c", now - 30)
+        token_manager.token_data["ssoNormal"]["sso-d"]["cooldownUntil"] = int((now + 60) * 1000)
+        token_manager.schedule_limit_check("sso-d", now - 5)  # 冷却已被延长
+        _mark_checked("sso-b", now - 15)
+        token_manager.schedule_limit_check("sso-b", now - 16)  # 到期后已被请求刷新过
+        token_manager.schedule_limit_check("sso-b", now - 0.5, "grok-3")  # 该桶尚未记录，到期即检查
+
+        assert token_manager._pop_due_token(now) == ("sso-a", "")
+        assert token_manager._pop_due_token(now) == ("sso-b", "")
+        assert token_manager._pop_due_token(now) == ("sso-b", "grok-3")
+        assert token_manager._pop_due_token(now) is None
+        assert [entry[1] for entry in token_manager._refresh_queue] == ["sso-e"]
+
+    asyncio.run(run())
+
+
+def test_refresher_samples_expired_cooldowns_before_stale_tokens():
+    """抽样优先冷却已到期但未检查的Token，其次额度未知或陈旧的Token，跳过冷却中与失效Token"""
+    async def run():
+        await token_manager._load_data()
+        ssos = ["cooled", "unknown", "old", "fresh", "cooling", "dead"]
+        await token_manager.add_token(ssos, TokenType.NORMAL)
+        now = time.time()
+        setting.grok_config["limit_refresh_stale_seconds"] = 3600
+
+        _mark_checked("cooled", now - 600)["cooldownUntil"] = int((now - 60) * 1000)
+        _mark_checked("old", now - 7200)
+        _mark_checked("fresh", now - 60)
+        _mark_checked("cooling", now - 7200)["cooldownUntil"] = int((now + 60) * 1000)
+        _mark_checked("dead", now - 7200)["status"] = "expired"
+
+        assert token_manager._sample_stale_tokens(1, now) == ["cooled"]
+        picked = token_manager._sample_stale_tokens(5, now)
+        assert picked[0] == "cooled" and sorted(picked[1:]) == ["old", "unknown"]
+
+    asyncio.run(run())
+
+
+def test_refresher_lock_is_held_by_one_process(monkeypatch):
+    """刷新锁被其他进程持有时不执行刷新且丢弃到期预约，取得锁后按预约刷新"""
+    async def run():
+        await token_manager._load_data()
+        await token_manager.add_token(["sso-a", "sso-b"], TokenType.NORMAL)
+        now = time.time()
+        for sso in ("sso-a", "sso-b"):
+            _mark_checked(sso, now - 60)
+        token_manager._refresh_queue.clear()
+        setting.grok_config["limit_refresh_budget"] = 600000
+
+        refreshed = []
+
+        async def refresh_token_limits(sso, bucket=None):
+            refreshed.append((sso, bucket))
+
+        monkeypatch.setattr(token_manager, "refresh_token_limits", refresh_token_limits)
+        monkeypatch.setattr(token_module, "LIMIT_REFRESH_TICK", 0.01)
+
+        # 模拟其他worker持有主机级刷新锁
+        other = open(token_manager.token_file.parent / LIMIT_REFRESH_LOCK, "a")
+        portalocker.lock(other, portalocker.LOCK_EX | portalocker.LOCK_NB)
+        token_manager.schedule_limit_check("sso-a", now - 1)
+        worker = asyncio.create_task(token_manager._limit_refresh_worker())
+        try:
+            await asyncio.sleep(0.1)
+            assert not token_manager._acquire_refresher_lock()
+            assert refreshed == [] and token_manager._refresh_queue == []
+
+            portalocker.unlock(other)
+            token_manager.schedule_limit_check("sso-b", time.time() - 1, "grok-3")
+            token_manager.schedule_limit_check("sso-a", time.time() - 2)
+            await asyncio.sleep(0.1)
+            assert refreshed == [("sso-a", None), ("sso-b", "grok-3")]
+            assert token_manager._refresher_lock_file is not None
+            with pytest.raises(portalocker.LockException):
+                portalocker.lock(other, portalocker.LOCK_EX | portalocker.LOCK_NB)
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+            token_manager._release_refresher_lock()
+            other.close()
+
+    asyncio.run(run())
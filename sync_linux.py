@@ -6,6 +6,8 @@ import json
 import time
 from pathlib import Path
 
+from sync_tokens import load_token_data, append_tokens
+
 def sync():
     # 获取脚本所在目录（假设在项目根目录 ~/grok/ 下执行）
     base_dir = Path(__file__).parent.absolute()
@@ -36,31 +38,20 @@ def sync():
         print(f"[*] 创建目录: {data_dir}")
         data_dir.mkdir(parents=True, exist_ok=True)
 
-    # 4. 加载或初始化 token.json
+    # 4. 加载 token.json（含变更日志）
     current_data = {"ssoNormal": {}, "ssoSuper": {}}
-    if token_file.exists():
-        try:
-            with open(token_file, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if content:
-                    loaded = json.loads(content)
-                    # 自动迁移旧格式 sso -> ssoNormal
-                    if "sso" in loaded:
-                        current_data["ssoNormal"].update(loaded["sso"])
-                    if "ssoNormal" in loaded:
-                        current_data["ssoNormal"].update(loaded["ssoNormal"])
-                    if "ssoSuper" in loaded:
-                        current_data["ssoSuper"].update(loaded["ssoSuper"])
-            print(f"[*] 已同步现有 {len(current_data['ssoNormal'])} 个 ssoNormal 账号")
-        except Exception as e:
-            print(f"[!] 读取 token.json 失败: {e}，将重新创建")
+    try:
+        current_data = load_token_data(token_file)
+        print(f"[*] 已同步现有 {len(current_data['ssoNormal'])} 个 ssoNormal 账号")
+    except Exception as e:
+        print(f"[!] 读取 token.json 失败: {e}，仅追加新账号")
 
-    # 5. 合并新 Token
-    new_count = 0
+    # 5. 合并新 Token（已存在的账号保持不变）
+    new_tokens = {}
     now_ms = int(time.time() * 1000)
     for t in tokens:
-        if t not in current_data["ssoNormal"] and t not in current_data["ssoSuper"]:
-            current_data["ssoNormal"][t] = {
+        if t not in current_data["ssoNormal"] and t not in current_data["ssoSuper"] and t not in new_tokens:
+            new_tokens[t] = {
                 "createdTime": now_ms,
                 "remainingQueries": -1,
                 "heavyremainingQueries": -1,
@@ -71,15 +62,15 @@ def sync():
                 "tags": [],
                 "note": "Initial Linux Sync"
             }
-            new_count += 1
+    new_count = len(new_tokens)
 
-    # 6. 写入文件
-    with open(token_file, 'w', encoding='utf-8') as f:
-        json.dump(current_data, f, indent=2, ensure_ascii=False)
+    # 6. 追加到变更日志（不重写 token.json）
+    if new_tokens:
+        append_tokens(token_file, new_tokens)
 
     print(f"\n[✓] 同步完成!")
     print(f"[✓] 新增账号: {new_count}")
-    print(f"[✓] 当前总计 ssoNormal 账号: {len(current_data['ssoNormal'])}")
+    print(f"[✓] 当前总计 ssoNormal 账号: {len(current_data['ssoNormal']) + new_count}")
     print(f"[✓] 持久化路径: {token_file}")
     print(f"\n[*] 提示: 如果你使用 Docker 部署，请确保 docker-compose.yml 中的 volumes 已正确挂载。")
 
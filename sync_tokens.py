@@ -3,6 +3,67 @@ import json
 import time
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def load_token_data(token_file: Path) -> dict:
+    """读取 token.json 快照并回放 token.journal 变更日志（与服务端 TokenJournal 格式一致）"""
+    data = {"ssoNormal": {}, "ssoSuper": {}}
+    if token_file.exists():
+        content = token_file.read_text(encoding="utf-8").strip()
+        if content:
+            loaded = json.loads(content)
+            # 兼容旧格式同步
+            if "sso" in loaded and "ssoNormal" not in loaded:
+                data["ssoNormal"] = loaded["sso"]
+                data["ssoSuper"] = loaded.get("ssoSuper", {})
+            else:
+                data["ssoNormal"] = loaded.get("ssoNormal", {})
+                data["ssoSuper"] = loaded.get("ssoSuper", {})
+
+    journal = token_file.with_suffix(".journal")
+    if journal.exists():
+        with open(journal, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    token_type, sso, value = json.loads(line)
+                except ValueError:
+                    continue
+                pool = data.setdefault(token_type, {})
+                if value is None:
+                    pool.pop(sso, None)
+                else:
+                    pool[sso] = value
+    return data
+
+
+def append_tokens(token_file: Path, tokens: dict) -> None:
+    """以追加变更日志的方式写入新 Token（不重写 token.json，运行中的服务可安全并存）"""
+    journal = token_file.with_suffix(".journal")
+    lines = "".join(json.dumps(["ssoNormal", sso, value], ensure_ascii=False, separators=(",", ":")) + "\n"
+                    for sso, value in tokens.items())
+    with open(journal, "ab") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if f.tell() > 0:
+                with open(journal, "rb") as r:
+                    r.seek(-1, os.SEEK_END)
+                    if r.read(1) != b"\n":
+                        f.write(b"\n")  # 隔开上次中断的半行
+            f.write(lines.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
 def sync_tokens():
     """
     手动将 keys/grok.txt 中的 SSO Token 同步到 grok2api/data/token.json
@@ -29,31 +90,20 @@ def sync_tokens():
     # 确保 data 目录存在
     token_file.parent.mkdir(parents=True, exist_ok=True)
 
-    # 读取现有的 token.json
+    # 读取现有的 token.json（含变更日志）
     current_data = {"ssoNormal": {}, "ssoSuper": {}}
-    if token_file.exists():
-        try:
-            with open(token_file, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if content:
-                    loaded = json.loads(content)
-                    # 兼容旧格式同步
-                    if "sso" in loaded and "ssoNormal" not in loaded:
-                        current_data["ssoNormal"] = loaded["sso"]
-                        current_data["ssoSuper"] = loaded.get("ssoSuper", {})
-                    else:
-                        current_data["ssoNormal"] = loaded.get("ssoNormal", {})
-                        current_data["ssoSuper"] = loaded.get("ssoSuper", {})
-            print(f"[*] 已加载现有 {len(current_data['ssoNormal']) + len(current_data['ssoSuper'])} 个账号数据")
-        except Exception as e:
-            print(f"[!] 读取现有 token.json 失败 (可能是格式错误)，将重新创建: {e}")
+    try:
+        current_data = load_token_data(token_file)
+        print(f"[*] 已加载现有 {len(current_data['ssoNormal']) + len(current_data['ssoSuper'])} 个账号数据")
+    except Exception as e:
+        print(f"[!] 读取现有 token.json 失败 (可能是格式错误)，仅追加新账号: {e}")
 
-    # 合并新 Token
-    added_count = 0
+    # 合并新 Token（已存在的账号保留原有额度与失败记录）
+    new_tokens = {}
     for token in tokens:
         # 检查是否已存在（在 normal 或 super 中）
-        if token not in current_data["ssoNormal"] and token not in current_data["ssoSuper"]:
-            current_data["ssoNormal"][token] = {
+        if token not in current_data["ssoNormal"] and token not in current_data["ssoSuper"] and token not in new_tokens:
+            new_tokens[token] = {
                 "createdTime": int(time.time() * 1000),
                 "remainingQueries": -1,
                 "heavyremainingQueries": -1,
@@ -64,13 +114,11 @@ def sync_tokens():
                 "tags": [],
                 "note": "Manual Import"
             }
-            added_count += 1
 
     # 保存
-    if added_count > 0:
-        with open(token_file, "w", encoding="utf-8") as f:
-            json.dump(current_data, f, indent=2, ensure_ascii=False)
-        print(f"[✓] 成功! 已新增 {added_count} 个账号，当前总计 {len(current_data['ssoNormal'])} 个 ssoNormal 账号")
+    if new_tokens:
+        append_tokens(token_file, new_tokens)
+        print(f"[✓] 成功! 已新增 {len(new_tokens)} 个账号，当前总计 {len(current_data['ssoNormal']) + len(new_tokens)} 个 ssoNormal 账号")
     else:
         print("[!] 没有发现新账号，无需更新")
 